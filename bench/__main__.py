@@ -0,0 +1,175 @@
+import argparse
+import contextlib
+import io
+import json
+import time
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import urlparse
+from lxml import etree
+from notion_client import Client as NotionClient
+import book.douban
+import movie.douban
+import main
+from common import AdaptiveTokenBucket, NotionWriter, set_meta_cache, set_page_cache, set_rate_limiter
+from bench.server import StubServer, load_fixture
+
+DEFAULT_ITERATIONS = 200  # 微基准的迭代次数
+DEFAULT_PAGES = 200  # 端到端同步的 Notion 页面数
+DEFAULT_CONCURRENCY = [1, 4, 16]
+UNLIMITED_RATE = 1e9
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(name: str, latencies: List[float], elapsed: float) -> Dict[str, Any]:
+    return {
+        "name": name,
+        "count": len(latencies),
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def measure(name: str, func: Callable[[], Any], iterations: int) -> Dict[str, Any]:
+    latencies = []
+    started_at = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(iterations):
+            start = time.perf_counter()
+            func()
+            latencies.append(time.perf_counter() - start)
+    return summarize(name, latencies, time.perf_counter() - started_at)
+
+
+def bench_parse(iterations: int) -> List[Dict[str, Any]]:
+    book_content = load_fixture("book_subject.html")
+    movie_content = load_fixture("movie_subject.html")
+    book_parser = book.douban.DoubanBookHtmlParser()
+    movie_parser = movie.douban.DoubanMovieHtmlParser()
+    return [
+        measure("parse_book", lambda: book_parser.parse_book("https://book.douban.com/subject/10554308/",
+                                                             book_content), iterations),
+        measure("parse_movie", lambda: movie_parser.parse_movie("https://movie.douban.com/subject/1292052/",
+                                                                movie_content), iterations),
+    ]
+
+
+def bench_search(iterations: int, stub: StubServer) -> List[Dict[str, Any]]:
+    results = []
+    book_searcher = book.douban.DoubanBookSearcher()
+    movie_searcher = movie.douban.DoubanMovieSearcher()
+    for kind, searcher in (("book", book_searcher), ("movie", movie_searcher)):
+        content = load_fixture(f"{kind}_search.html")
+        hrefs = [link.attrib["href"] for link in etree.HTML(content).xpath('//a[@class="nbg"]')]
+        results.append(measure(f"calc_url[{kind}]", lambda: [searcher.calc_url(href) for href in hrefs],
+                               iterations))
+        extract = getattr(searcher, f"extract_{kind}_urls")
+        results.append(measure(f"extract_{kind}_urls", lambda: extract(content), iterations))
+        load = getattr(searcher, f"load_{kind}_urls")
+        queries = iter(range(iterations))
+        results.append(measure(f"load_{kind}_urls", lambda: load(str(next(queries))), iterations))
+    return results
+
+
+class TimingWriter(NotionWriter):
+
+    def __init__(self, client, started: Dict[str, float], **kwargs):
+        super().__init__(client, **kwargs)
+        self.started = started
+        self.latencies: List[float] = []
+
+    def update(self, page_id: str, properties: Dict[str, Any], previous: Optional[str] = None,
+               current: Optional[Dict[str, Any]] = None) -> bool:
+        updated = super().update(page_id, properties, previous=previous, current=current)
+        self.latencies.append(time.perf_counter() - self.started.pop(page_id))
+        return updated
+
+
+def bench_sync(pages: int, concurrency_levels: List[int], stub: StubServer,
+               parse_processes: int = 0) -> List[Dict[str, Any]]:
+    results = []
+    client = NotionClient(auth="bench", base_url=stub.base_url)
+    parse_pool = main.open_parse_pool(parse_processes)
+    for kind in ("book", "movie"):
+        provider = main.DoubanBookProvider() if kind == "book" else main.DoubanaMovieProvider()
+        iter_pages = main.iter_book_pages if kind == "book" else main.iter_movie_pages
+        sync = main.sync_book_info if kind == "book" else main.sync_movie_info
+        for level in concurrency_levels:
+            started: Dict[str, float] = {}
+            writer = TimingWriter(client, started, rate=UNLIMITED_RATE, concurrency=level)
+
+            def stamped(items):
+                # 从 Notion 查询结果中取出时开始计时, 写回 Notion 后结束
+                for item in items:
+                    started[item.page_id] = time.perf_counter()
+                    yield item
+
+            concurrency = {stage: level for stage in main.SYNC_CONCURRENCY}
+            started_at = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                sync(stamped(iter_pages(f"{kind}-database", client)), provider, client,
+                     concurrency=concurrency, writer=writer, parse_pool=parse_pool)
+            results.append(summarize(f"sync_{kind}_info[c={level},p={parse_processes}]", writer.latencies,
+                                     time.perf_counter() - started_at))
+    if parse_pool is not None:
+        parse_pool.shutdown()
+    return results
+
+
+def print_results(results: List[Dict[str, Any]]):
+    print(f"{'benchmark':<32}{'count':>8}{'ops/s':>12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for result in results:
+        print(f"{result['name']:<32}{result['count']:>8}{result['throughput']:>12.1f}"
+              f"{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}{result['p99_ms']:>10.2f}")
+
+
+def run(args) -> List[Dict[str, Any]]:
+    # 基准只测代码本身: 关闭持久化缓存, 放开对本地桩服务的限速
+    set_meta_cache(None)
+    set_page_cache(None)
+    stub = StubServer(pages=args.pages, latency=args.latency / 1000).start()
+    set_rate_limiter(urlparse(stub.base_url).netloc,
+                     AdaptiveTokenBucket(rate=UNLIMITED_RATE, burst=UNLIMITED_RATE, max_rate=UNLIMITED_RATE))
+    book.douban.DOUBAN_SEARCH_URL = f"{stub.base_url}/search"
+    movie.douban.DOUBAN_SEARCH_URL = f"{stub.base_url}/search"
+    book.douban.DOUBAN_BOOK_ISBN_URL = f"{stub.base_url}/isbn/{{}}/"
+    movie.douban.DOUBAN_MOVIE_SUGGEST_URL = f"{stub.base_url}/j/subject_suggest"
+    movie.douban.DOUBAN_MOVIE_SUBJECT_URL = f"{stub.base_url}/movie/subject/{{}}/"
+    try:
+        results = []
+        if "parse" in args.suites:
+            results.extend(bench_parse(args.iterations))
+        if "search" in args.suites:
+            results.extend(bench_search(args.iterations, stub))
+        if "sync" in args.suites:
+            results.extend(bench_sync(args.pages, args.concurrency, stub, args.parse_processes))
+    finally:
+        stub.stop()
+    # 桩服务收到的请求数, 用来观察每个条目实际消耗的请求
+    print(json.dumps(stub.requests, sort_keys=True))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m bench", description="离线回放豆瓣与 Notion 请求的性能基准")
+    parser.add_argument("--suites", nargs="+", choices=["parse", "search", "sync"], default=["parse", "search", "sync"])
+    parser.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS)
+    parser.add_argument("--pages", type=int, default=DEFAULT_PAGES)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--parse-processes", type=int, default=0, help="sync 基准使用的解析进程数")
+    parser.add_argument("--latency", type=float, default=0.0, help="桩服务每个请求的模拟延迟(毫秒)")
+    parser.add_argument("--output", help="把结果写成 JSON, 便于和历史结果对比")
+    args = parser.parse_args()
+    results = run(args)
+    print_results(results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
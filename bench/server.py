@@ -0,0 +1,160 @@
+import json
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+from urllib.parse import parse_qs, quote, urlparse
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+SUBJECT_PATH_PATTERN = re.compile("^/(book|movie)/subject/(\\d+)/?$")
+ISBN_PATH_PATTERN = re.compile("^/isbn/(\\d+)/?$")
+NOTION_QUERY_PATTERN = re.compile("^/v1/databases/([^/]+)/query$")
+NOTION_PAGE_PATTERN = re.compile("^/v1/pages/([^/]+)$")
+DOUBAN_CATS = {"1001": "book", "1002": "movie"}
+
+__ALL__ = ["StubServer"]
+
+
+def load_fixture(name: str) -> bytes:
+    with open(os.path.join(FIXTURES_DIR, name), "rb") as f:
+        return f.read()
+
+
+# 本地回放豆瓣搜索页/详情页以及 Notion 查询/更新接口, latency 为每个请求额外的模拟延迟(秒)
+class StubServer:
+
+    def __init__(self, pages: int = 200, latency: float = 0.0):
+        self.pages = pages
+        self.latency = latency
+        self.requests: Dict[str, int] = {}
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.handler())
+        self.server.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}"
+        self.search_pages = {kind: self.rewrite(load_fixture(f"{kind}_search.html"), kind)
+                             for kind in ("book", "movie")}
+        self.subject_pages = {kind: self.rewrite(load_fixture(f"{kind}_subject.html"), kind)
+                              for kind in ("book", "movie")}
+        self.page_templates = {kind: load_fixture(f"notion_{kind}_page.json.tmpl").decode("utf-8")
+                               for kind in ("book", "movie")}
+        self.thread: Optional[threading.Thread] = None
+
+    def rewrite(self, content: bytes, kind: str) -> bytes:
+        # 把豆瓣域名换成本地地址, 保持 /subject/<id>/ 的路径格式
+        host = f"https://{kind}.douban.com"
+        local = f"{self.base_url}/{kind}"
+        return content.replace(quote(host, safe="").encode(), quote(local, safe="").encode()) \
+            .replace(host.encode(), local.encode())
+
+    def page(self, kind: str, index: int) -> Dict:
+        content = self.page_templates[kind] \
+            .replace("{page_id}", f"page-{kind}-{index}") \
+            .replace("{index}", str(index)) \
+            .replace("{isbn}", str(9787544258609 + index)) \
+            .replace("{imdb}", f"tt{index:07d}")
+        return json.loads(content)
+
+    def query(self, kind: str, body: Dict) -> Dict:
+        page_size = body.get("page_size", 100)
+        start = int(body.get("start_cursor") or 0)
+        end = min(start + page_size, self.pages)
+        return {
+            "object": "list",
+            "results": [self.page(kind, index) for index in range(start, end)],
+            "next_cursor": str(end) if end < self.pages else None,
+            "has_more": end < self.pages,
+        }
+
+    def count(self, name: str):
+        with self.lock:
+            self.requests[name] = self.requests.get(name, 0) + 1
+
+    def handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # 关闭 Nagle, 否则 keep-alive 连接上每个响应都会多出约 40ms 的延迟确认
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def reply(self, status: int, body: bytes, content_type: str):
+                if stub.latency:
+                    time.sleep(stub.latency)
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def redirect(self, location: str):
+                if stub.latency:
+                    time.sleep(stub.latency)
+                self.send_response(302)
+                self.send_header("Location", location)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def reply_json(self, data):
+                self.reply(200, json.dumps(data, ensure_ascii=False).encode("utf-8"), "application/json")
+
+            def read_json(self) -> Dict:
+                length = int(self.headers.get("Content-Length") or 0)
+                return json.loads(self.rfile.read(length) or b"{}")
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path == "/search":
+                    kind = DOUBAN_CATS.get(parse_qs(url.query).get("cat", [""])[0])
+                    if kind:
+                        stub.count(f"douban_{kind}_search")
+                        return self.reply(200, stub.search_pages[kind], "text/html; charset=utf-8")
+                isbn_match = ISBN_PATH_PATTERN.match(url.path)
+                if isbn_match:
+                    stub.count("douban_book_isbn")
+                    subject_id = int(isbn_match.group(1)) % 100000000
+                    return self.redirect(f"{stub.base_url}/book/subject/{subject_id}/")
+                if url.path == "/j/subject_suggest":
+                    stub.count("douban_movie_suggest")
+                    imdb = parse_qs(url.query).get("q", [""])[0]
+                    subject_id = int(imdb[2:] or 0)
+                    return self.reply_json([{"url": f"{stub.base_url}/movie/subject/{subject_id}/?suggest={imdb}",
+                                             "id": str(subject_id), "title": imdb, "type": "movie"}])
+                subject_match = SUBJECT_PATH_PATTERN.match(url.path)
+                if subject_match:
+                    kind = subject_match.group(1)
+                    stub.count(f"douban_{kind}_subject")
+                    return self.reply(200, stub.subject_pages[kind], "text/html; charset=utf-8")
+                self.reply(404, b"not found", "text/plain")
+
+            def do_POST(self):
+                query_match = NOTION_QUERY_PATTERN.match(self.path)
+                if query_match:
+                    stub.count("notion_query")
+                    kind = "movie" if "movie" in query_match.group(1) else "book"
+                    return self.reply_json(stub.query(kind, self.read_json()))
+                self.reply(404, b"not found", "text/plain")
+
+            def do_PATCH(self):
+                page_match = NOTION_PAGE_PATTERN.match(self.path)
+                if page_match:
+                    stub.count("notion_update")
+                    body = self.read_json()
+                    return self.reply_json({"object": "page", "id": page_match.group(1),
+                                            "properties": body.get("properties", {})})
+                self.reply(404, b"not found", "text/plain")
+
+        return Handler
+
+    def start(self) -> "StubServer":
+        self.thread = threading.Thread(target=self.server.serve_forever, name="bench_stub_server", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
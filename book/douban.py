@@ -1,21 +1,30 @@
-import random
+import asyncio
 import re
-import time
-import requests
 from datetime import datetime
-from typing import List, Optional, Any
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from urllib.parse import urlparse, unquote
-from functools import lru_cache
+from typing import AsyncIterator, List, Optional, Any, Tuple
+from urllib.parse import unquote, urljoin
 from lxml import etree
+from common.aio import get_async_client, run_sync
+from common.cache import get_meta_cache
+from common.http import get_transport
+from common.records import intern_list, intern_text
+from common.prefetch import aiter_prefetched
+from common.singleflight import SingleFlight
 from book.meta import MetaRecord, Metadata, MetaSourceInfo
 
 DOUBAN_SEARCH_JSON_URL = "https://www.douban.com/j/search"  # 最新豆瓣屏蔽此url
 DOUBAN_SEARCH_URL = "https://www.douban.com/search"
 DOUBAN_BOOK_CAT = "1001"
-DOUBAN_BOOK_CACHE_SIZE = 500  # 最大缓存数量
+DOUBAN_BOOK_CACHE = "douban_book"  # 详情页解析结果的缓存空间
+DOUBAN_BOOK_SEARCH_CACHE = "douban_book_search"  # 搜索结果的缓存空间
+DOUBAN_BOOK_ISBN_CACHE = "douban_book_isbn"  # ISBN 到详情页地址的映射
+DOUBAN_BOOK_ISBN_URL = "https://book.douban.com/isbn/{}/"  # 豆瓣按 ISBN 直接跳转到详情页
 DOUBAN_CONCURRENCY_SIZE = 5  # 并发查询数
+DOUBAN_PREFETCH_SIZE = 2  # search_one 按排名顺序提前下载的候选数
+DOUBAN_SEARCH_CHUNK_SIZE = 16 * 1024  # 搜索页按块增量解析, 拿到足够的候选后不再读后面的内容
+DOUBAN_REDIRECT_URL_PATTERN = re.compile("[?&]url=([^&#]+)")  # 搜索结果链接经过跳转, 真实地址在 url 参数里
 DOUBAN_BOOK_URL_PATTERN = re.compile(".*/subject/(\\d+)/?")
+ISBN_PATTERN = re.compile("^(?:97[89])?\\d{9}[\\dX]$")
 DEFAULT_HEADERS = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 6.1; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/71.0.3573.0 Safari/537.36',
     'Accept-Encoding': 'gzip, deflate'
@@ -24,7 +33,21 @@ DEFAULT_HEADERS = {
 __ALL__ = ["DoubanBookProvider"]
 
 
+def normalize_isbn(value) -> Optional[str]:
+    # 统一成 ISBN-13, 方便和详情页上的 ISBN 比较
+    isbn = str(value).strip().replace("-", "").replace(" ", "").upper()
+    if not ISBN_PATTERN.match(isbn):
+        return None
+    if len(isbn) == 10:
+        isbn = "978" + isbn[:9]
+        checksum = sum(int(digit) * (3 if index % 2 else 1) for index, digit in enumerate(isbn))
+        isbn += str((10 - checksum % 10) % 10)
+    return isbn
+
+
 class DoubanBookProvider(Metadata):
+    __name__ = "Douban Books"
+    __id__ = "douban"
 
     def __init__(self):
         self.searcher = DoubanBookSearcher()
@@ -40,81 +63,297 @@ class DoubanBookProvider(Metadata):
             self, query: str, generic_cover: str = "", locale: str = "en"
     ) -> Optional[MetaRecord]:
         if self.active:
-            resp = self.searcher.search_books(query)
-            if resp:
-                return resp[0]
+            return self.searcher.search_one_book(query)
+
+    async def asearch(
+            self, query: str, generic_cover: str = "", locale: str = "en"
+    ) -> Optional[List[MetaRecord]]:
+        if self.active:
+            return await self.searcher.asearch_books(query)
+
+    async def asearch_one(
+            self, query: str, generic_cover: str = "", locale: str = "en"
+    ) -> Optional[MetaRecord]:
+        if self.active:
+            return await self.searcher.asearch_one_book(query)
+
+    def search_urls(self, query: str) -> List[str]:
+        return self.searcher.load_book_urls(query)
+
+    def fetch(self, url: str) -> Optional[bytes]:
+        return self.searcher.book_loader.fetch_book(url)
+
+    def parse(self, url: str, content: bytes) -> MetaRecord:
+        return self.searcher.book_loader.parse_book(url, content)
+
+    def cached(self, url: str) -> Optional[MetaRecord]:
+        return self.searcher.book_loader.cached_book(url)
+
+    def batch_parser(self):
+        return parse_book_batch
+
+    def store(self, url: str, record: MetaRecord) -> MetaRecord:
+        return self.searcher.book_loader.store_book(url, record)
+
+    def verify(self, query: str, record: MetaRecord) -> bool:
+        return not self.searcher.is_identifier(query) or self.searcher.matches(query, record)
+
+    def seed(self, query: str, record: MetaRecord):
+        # 写入缓存后, 同一查询直接命中详情页缓存, 不再访问豆瓣
+        self.searcher.book_loader.store_book(record.url, record)
+        self.searcher.store_resolved(query, record.url)
 
 
 class DoubanBookSearcher:
 
     def __init__(self):
         self.book_loader = DoubanBookLoader()
-        self.thread_pool = ThreadPoolExecutor(max_workers=10, thread_name_prefix='douban_book_async')
+        self.flight = SingleFlight("douban_book_search")
 
     def search_books(self, query: str) -> List[Any]:
-        book_urls = self.load_book_urls(query)
-        books = []
-        futures = [self.thread_pool.submit(self.book_loader.load_book, book_url) for book_url in book_urls]
-        for future in as_completed(futures):
-            book = future.result()
-            if book is not None:
-                books.append(future.result())
-        return books
+        # 同步接口只是异步实现的包装, 在共享的后台事件循环里执行
+        return run_sync(self.asearch_books(query))
+
+    def search_one_book(self, query: str) -> Optional[MetaRecord]:
+        return run_sync(self.asearch_one_book(query))
+
+    async def aiter_books(self, query: str, prefetch: int = DOUBAN_PREFETCH_SIZE) -> AsyncIterator[MetaRecord]:
+        # 按搜索结果的排名顺序产出, 只提前下载 prefetch 个候选; 调用方停止迭代时取消还没开始的下载
+        books = aiter_prefetched(self.book_loader.aload_book, await self.aload_book_urls(query), prefetch)
+        try:
+            async for book in books:
+                if book is not None:
+                    yield book
+        finally:
+            await books.aclose()
+
+    @staticmethod
+    def is_identifier(query: str) -> bool:
+        return normalize_isbn(query) is not None
+
+    @staticmethod
+    def matches(query: str, book: MetaRecord) -> bool:
+        isbn = normalize_isbn(query)
+        return isbn is not None and isbn == normalize_isbn(book.identifiers.get("isbn", ""))
 
     @staticmethod
-    def calc_url(href: str) -> str:
-        query = urlparse(href).query
-        params = {item.split('=')[0]: item.split('=')[1] for item in query.split('&')}
-        url = unquote(params['url'])
+    def calc_url(href: str) -> Optional[str]:
+        url_match = DOUBAN_REDIRECT_URL_PATTERN.search(href)
+        if url_match is None:
+            return None
+        url = unquote(url_match.group(1))
         if DOUBAN_BOOK_URL_PATTERN.match(url):
             return url
+        return None
 
     def load_book_urls(self, query: str) -> List[Any]:
+        # 同一查询同时只请求一次, 其余调用等待并共享结果
+        return self.flight.do(self.query_key(query), self.fetch_book_urls, query)
+
+    async def aload_book_urls(self, query: str) -> List[Any]:
+        return await self.flight.ado(self.query_key(query), self.afetch_book_urls, query)
+
+    @staticmethod
+    def query_key(query: str) -> str:
+        # 写法不同的同一个编号合并为一次请求
+        return normalize_isbn(query) or str(query)
+
+    def fetch_book_urls(self, query: str) -> List[Any]:
+        book_url = self.resolve_isbn(query)
+        if book_url:
+            return [book_url]
+        book_urls = self.cached_book_urls(query)
+        if book_urls is not None:
+            return book_urls
+        url = DOUBAN_SEARCH_URL
+        params = {"cat": DOUBAN_BOOK_CAT, "q": query}
+        content = get_transport().get_page(url, params, headers=DEFAULT_HEADERS)
+        if content is not None:
+            return self.store_book_urls(query, self.extract_book_urls(content))
+        return []
+
+    async def afetch_book_urls(self, query: str) -> List[Any]:
+        book_url = await self.aresolve_isbn(query)
+        if book_url:
+            return [book_url]
+        book_urls = self.cached_book_urls(query)
+        if book_urls is not None:
+            return book_urls
         url = DOUBAN_SEARCH_URL
         params = {"cat": DOUBAN_BOOK_CAT, "q": query}
-        res = requests.get(url, params, headers=DEFAULT_HEADERS)
+        content = await get_async_client().get_page(url, params, headers=DEFAULT_HEADERS)
+        if content is not None:
+            return self.store_book_urls(query, self.extract_book_urls(content))
+        return []
+
+    @classmethod
+    def resolve_isbn(cls, query: str) -> Optional[str]:
+        # 查询本身是 ISBN 时不走搜索页, 直接由豆瓣的 ISBN 跳转拿到详情页地址
+        isbn = normalize_isbn(query)
+        if isbn is None:
+            return None
+        book_url = cls.cached_isbn_url(isbn)
+        if book_url is not None:
+            return book_url
+        res = get_transport().get(DOUBAN_BOOK_ISBN_URL.format(isbn), headers=DEFAULT_HEADERS,
+                                  allow_redirects=False)
+        return cls.store_isbn_redirect(isbn, res.status_code, urljoin(res.url, res.headers.get("Location", "")))
+
+    @classmethod
+    async def aresolve_isbn(cls, query: str) -> Optional[str]:
+        isbn = normalize_isbn(query)
+        if isbn is None:
+            return None
+        book_url = cls.cached_isbn_url(isbn)
+        if book_url is not None:
+            return book_url
+        url = DOUBAN_BOOK_ISBN_URL.format(isbn)
+        status, headers, _ = await get_async_client().request(url, headers=DEFAULT_HEADERS, allow_redirects=False)
+        return cls.store_isbn_redirect(isbn, status, urljoin(url, headers.get("Location", "")))
+
+    @staticmethod
+    def cached_isbn_url(isbn: str) -> Optional[str]:
+        cache = get_meta_cache()
+        if cache is not None:
+            return cache.get(DOUBAN_BOOK_ISBN_CACHE, isbn)
+        return None
+
+    @staticmethod
+    def store_isbn_redirect(isbn: str, status: int, book_url: str) -> Optional[str]:
+        # 只有跳转到详情页才算找到, 否则退回搜索
+        if status not in [301, 302] or not DOUBAN_BOOK_URL_PATTERN.match(book_url):
+            return None
+        cache = get_meta_cache()
+        if cache is not None:
+            cache.set(DOUBAN_BOOK_ISBN_CACHE, isbn, book_url)
+        return book_url
+
+    @staticmethod
+    def cached_book_urls(query: str) -> Optional[List[Any]]:
+        cache = get_meta_cache()
+        if cache is not None:
+            return cache.get(DOUBAN_BOOK_SEARCH_CACHE, str(query))
+        return None
+
+    @classmethod
+    def store_resolved(cls, query: str, book_url: str):
+        isbn = normalize_isbn(query)
+        cache = get_meta_cache()
+        if cache is not None and isbn is not None:
+            cache.set(DOUBAN_BOOK_ISBN_CACHE, isbn, book_url)
+        cls.store_book_urls(query, [book_url])
+
+    @staticmethod
+    def store_book_urls(query: str, book_urls: List[Any]) -> List[Any]:
+        cache = get_meta_cache()
+        # 没有结果时不缓存, 下次运行重新搜索
+        if cache is not None and book_urls:
+            cache.set(DOUBAN_BOOK_SEARCH_CACHE, str(query), book_urls)
+        return book_urls
+
+    async def asearch_one_book(self, query: str) -> Optional[MetaRecord]:
+        # 按排名顺序检查候选, 只提前下载 DOUBAN_PREFETCH_SIZE 个; 查询不是 ISBN 时直接取第一个
+        first = None
+        books = self.aiter_books(query)
+        try:
+            async for book in books:
+                if self.matches(query, book):
+                    return book
+                first = first or book
+                if not self.is_identifier(query):
+                    break
+        finally:
+            await books.aclose()
+        # 没有条目能对上编号时退回排名第一的结果
+        return first
+
+    async def asearch_books(self, query: str) -> List[Any]:
+        book_urls = await self.aload_book_urls(query)
+        books = await asyncio.gather(*[self.book_loader.aload_book(book_url) for book_url in book_urls])
+        return [book for book in books if book is not None]
+
+    def extract_book_urls(self, content: bytes) -> List[Any]:
+        # 结果与 //a[@class="nbg"] 取前 DOUBAN_CONCURRENCY_SIZE 个有效地址相同, 但只解析到最后一个需要的链接
         book_urls = []
-        if res.status_code in [200, 201]:
-            html = etree.HTML(res.content)
-            alist = html.xpath('//a[@class="nbg"]')
-            for link in alist:
-                href = link.attrib['href']
-                parsed = self.calc_url(href)
-                if parsed:
-                    if len(book_urls) < DOUBAN_CONCURRENCY_SIZE:
-                        book_urls.append(parsed)
+        parser = etree.HTMLPullParser(events=("start",), tag="a")
+        for offset in range(0, len(content), DOUBAN_SEARCH_CHUNK_SIZE):
+            parser.feed(content[offset:offset + DOUBAN_SEARCH_CHUNK_SIZE])
+            if self.collect_urls(parser, book_urls):
+                return book_urls
+        try:
+            parser.close()
+        except etree.XMLSyntaxError:
+            return book_urls
+        self.collect_urls(parser, book_urls)
         return book_urls
 
+    def collect_urls(self, parser, book_urls: List[Any]) -> bool:
+        # 返回 True 表示候选已经够了
+        for _, link in parser.read_events():
+            if link.get('class') != 'nbg':
+                continue
+            parsed = self.calc_url(link.get('href', ''))
+            if parsed:
+                book_urls.append(parsed)
+                if len(book_urls) >= DOUBAN_CONCURRENCY_SIZE:
+                    return True
+        return False
+
 
 class DoubanBookLoader:
 
     def __init__(self):
         self.book_parser = DoubanBookHtmlParser()
+        self.flight = SingleFlight("douban_book")
+        self.fetch_flight = SingleFlight("douban_book_fetch")
+
+    async def aload_book(self, url):
+        # 以 subject id 合并并发请求, 同一条目只下载、解析一次
+        return await self.flight.ado(self.cache_key(url), self.aresolve_book, url)
+
+    def parse_book(self, url, content) -> MetaRecord:
+        return self.store_book(url, self.book_parser.parse_book(url, content))
 
-    @lru_cache(maxsize=DOUBAN_BOOK_CACHE_SIZE)
-    def load_book(self, url):
-        book = None
-        self.random_sleep()
-        start_time = time.time()
-        res = requests.get(url, headers=DEFAULT_HEADERS)
-        if res.status_code in [200, 201]:
-            print("Download Book:{} success,耗时 {:.0f}ms".format(url, (time.time() - start_time) * 1000))
-            book_detail_content = res.content
-            book = self.book_parser.parse_book(url, book_detail_content)
+    def store_book(self, url, book: MetaRecord) -> MetaRecord:
+        cache = get_meta_cache()
+        if cache is not None:
+            cache.set(DOUBAN_BOOK_CACHE, self.cache_key(url), book)
         return book
 
+    def cached_book(self, url) -> Optional[MetaRecord]:
+        cache = get_meta_cache()
+        if cache is not None:
+            return cache.get(DOUBAN_BOOK_CACHE, self.cache_key(url))
+        return None
+
     @staticmethod
-    def random_sleep():
-        random_sec = random.random() / 10
-        print("Random sleep time {}s".format(random_sec))
-        time.sleep(random_sec)
+    def cache_key(url) -> str:
+        # 以豆瓣 subject id 作为缓存键, 同一条目的不同链接共享缓存
+        id_match = DOUBAN_BOOK_URL_PATTERN.match(url)
+        return id_match.group(1) if id_match else url
+
+    def fetch_book(self, url) -> Optional[bytes]:
+        return self.fetch_flight.do(self.cache_key(url), self.download_book, url)
+
+    def download_book(self, url) -> Optional[bytes]:
+        return get_transport().get_page(url, headers=DEFAULT_HEADERS)
+
+    async def aresolve_book(self, url):
+        book = self.cached_book(url)
+        if book is not None:
+            return book
+        content = await get_async_client().get_page(url, headers=DEFAULT_HEADERS)
+        if content is not None:
+            book = self.parse_book(url, content)
+        return book
 
 
 class DoubanBookHtmlParser:
     def __init__(self):
         self.id_pattern = DOUBAN_BOOK_URL_PATTERN
         self.date_pattern = re.compile("(\\d{4})-(\\d+)")
-        self.tag_pattern = re.compile("criteria = '(.+)'")
+        # 直接在原始字节上匹配, 避免为了找标签把整个页面解码一遍
+        self.tag_pattern = re.compile(b"criteria = '(.+)'")
 
     def parse_book(self, url, content) -> MetaRecord:
         book = MetaRecord(
@@ -129,55 +368,92 @@ class DoubanBookHtmlParser:
         html = etree.HTML(content)
         if html is None:
             return book
-        title_element = html.xpath("//span[@property='v:itemreviewed']")
+        title_element, share_element, img_element, rating_element, elements, summary_element, tag_elements = \
+            self.__collect(html)
         book.title = self.__get_text(title_element)
-        share_element = html.xpath("//a[@data-url]")
         if len(share_element):
             url = share_element[0].attrib['data-url']
         book.url = url
         id_match = self.id_pattern.match(url)
         if id_match:
-            book.book_id = id_match.group(1)
-        img_element = html.xpath("//a[@class='nbg']")
+            book.id = id_match.group(1)
         if len(img_element):
             cover = img_element[0].attrib['href']
             if not cover or cover.endswith('update_image'):
                 book.cover = ''
             else:
                 book.cover = cover
-        rating_element = html.xpath("//strong[@property='v:average']")
         book.rating = self.__get_rating(rating_element)
-        elements = html.xpath("//span[@class='pl']")
+        parent_links = {}
         for element in elements:
             text = self.__get_text(element)
             if text.startswith("作者") or text.startswith("译者"):
-                book.authors.extend([self.__get_text(author_element) for author_element in
-                                     filter(self.author_filter, element.findall("..//a"))])
+                parent = element.getparent()
+                if parent not in parent_links:
+                    parent_links[parent] = element.findall("..//a")
+                book.authors.extend(intern_list(self.__get_text(author_element) for author_element in
+                                                filter(self.author_filter, parent_links[parent])))
             elif text.startswith("出版社"):
-                book.publisher = self.__get_tail(element)
+                book.publisher = intern_text(self.__get_tail(element))
             elif text.startswith("副标题"):
                 book.title = book.title + ':' + self.__get_tail(element)
             elif text.startswith("出版年"):
                 book.publishedDate = self.__get_publish_date(self.__get_tail(element))
             elif text.startswith("丛书"):
-                book.series = self.__get_text(element.getnext())
+                book.series = intern_text(self.__get_text(element.getnext()))
             elif text.startswith("ISBN"):
                 book.identifiers["isbn"] = self.__get_tail(element)
-        summary_element = html.xpath("//div[@id='link-report']//div[@class='intro']")
         if len(summary_element):
             book.description = etree.tostring(summary_element[-1], encoding="utf8").decode("utf8").strip()
-        tag_elements = html.xpath("//a[contains(@class, 'tag')]")
         if len(tag_elements):
-            book.tags = [self.__get_text(tag_element) for tag_element in tag_elements]
+            book.tags = intern_list(self.__get_text(tag_element) for tag_element in tag_elements)
         else:
-            book.tags = self.__get_tags(content)
+            book.tags = intern_list(self.__get_tags(content))
         return book
 
+    @staticmethod
+    def __collect(html):
+        # 一次遍历取出所有需要的节点, 结果与逐个执行下列 XPath 相同:
+        # //span[@property='v:itemreviewed'], //a[@data-url], //a[@class='nbg'], //strong[@property='v:average'],
+        # //span[@class='pl'], //div[@id='link-report']//div[@class='intro'], //a[contains(@class, 'tag')]
+        title_element, share_element, img_element, rating_element = [], [], [], []
+        elements, reports, tag_elements = [], [], []
+        for element in html.iter('span', 'a', 'strong', 'div'):
+            tag = element.tag
+            get = element.get
+            if tag == 'a':
+                if not share_element and get('data-url') is not None:
+                    share_element.append(element)
+                css = get('class')
+                if css is not None:
+                    if not img_element and css == 'nbg':
+                        img_element.append(element)
+                    if 'tag' in css:
+                        tag_elements.append(element)
+            elif tag == 'span':
+                if get('class') == 'pl':
+                    elements.append(element)
+                if not title_element and get('property') == 'v:itemreviewed':
+                    title_element.append(element)
+            elif tag == 'div':
+                if get('id') == 'link-report':
+                    reports.append(element)
+            elif not rating_element and get('property') == 'v:average':
+                rating_element.append(element)
+        summary_element = []
+        seen = set()
+        for report in reports:
+            for element in report.iterdescendants('div'):
+                if element.get('class') == 'intro' and element not in seen:
+                    seen.add(element)
+                    summary_element.append(element)
+        return title_element, share_element, img_element, rating_element, elements, summary_element, tag_elements
+
     def __get_tags(self, book_content) -> List[Any]:
-        tag_match = self.tag_pattern.findall(book_content.decode('utf-8'))
-        if len(tag_match):
+        tag_match = self.tag_pattern.search(book_content)
+        if tag_match:
             return [tag.replace('7:', '') for tag in
-                    filter(lambda tag: tag and tag.startswith('7:'), tag_match[0].split('|'))]
+                    filter(lambda tag: tag and tag.startswith('7:'), tag_match.group(1).decode('utf-8').split('|'))]
         return []
 
     def __get_publish_date(self, date_str):
@@ -215,3 +491,15 @@ class DoubanBookHtmlParser:
             if not text:
                 text = self.__get_text(element.getnext(), default_str)
         return text if text else default_str
+
+
+def parse_book_batch(pages: List[Tuple[str, bytes]]) -> List[Any]:
+    # 在解析进程里执行: 只解析不写缓存; 单个页面出错时返回异常, 不影响同一批的其他页面
+    parser = DoubanBookHtmlParser()
+    records = []
+    for url, content in pages:
+        try:
+            records.append(parser.parse_book(url, content))
+        except Exception as e:
+            records.append(ValueError(f"failed to parse {url}: {e!r}"))
+    return records
@@ -1,4 +1,4 @@
-import requests
+from common.http import get_transport
 
 
 def _get_image_from_douban(book_name: str) -> str:
@@ -6,7 +6,7 @@ def _get_image_from_douban(book_name: str) -> str:
     headers = {
         "User-Agent": "Mozilla/4.0 (compatible; MSIE 6.0; Windows NT 5.1; SV1; AcooBrowser;"
     }
-    _resp = requests.get(url, headers=headers)
+    _resp = get_transport().get(url, headers=headers)
     if _resp.status_code != 200 or not _resp.json():
         return ""
     body = _resp.json()
@@ -1,17 +1,17 @@
-import abc
 import os
 import dataclasses
 from typing import Dict, List, Optional, Union
+from common.provider import StagedProvider
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class MetaSourceInfo:
     id: str
     description: str
     link: str
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class MetaRecord:
     id: Union[str, int]
     # 名称
@@ -32,7 +32,7 @@ class MetaRecord:
     # 出版日期
     publishedDate: Optional[str] = None
     # 评分
-    rating: Optional[int] = 0
+    rating: Optional[float] = 0
     # 语言
     languages: Optional[List[str]] = dataclasses.field(default_factory=list)
     # 标签
@@ -41,24 +41,13 @@ class MetaRecord:
     description: Optional[str] = ""
 
 
-class Metadata:
+class Metadata(StagedProvider):
     __name__ = "Generic"
     __id__ = "generic"
+    __kind__ = "book"
 
     def __init__(self):
         self.active = True
 
     def set_status(self, state):
         self.active = state
-
-    @abc.abstractmethod
-    def search(
-            self, query: str, generic_cover: str = "", locale: str = "cn"
-    ) -> Optional[List[MetaRecord]]:
-        pass
-
-    @abc.abstractmethod
-    def search_one(
-            self, query: str, generic_cover: str = "", locale: str = "cn"
-    ) -> Optional[MetaRecord]:
-        pass
@@ -0,0 +1,14 @@
+from .notion import iter_database_pages, aiter_database_pages, NotionWriter, diff_properties
+from .pipeline import Stage, Pipeline
+from .aio import AsyncHttpClient, get_async_client, close_async_client, configure_async_client, run_sync
+from .cache import MetaCache, get_meta_cache, set_meta_cache
+from .http import HttpTransport, get_transport, configure_transport
+from .ratelimit import TokenBucket, AdaptiveTokenBucket, get_rate_limiter, set_rate_limiter
+from .state import SyncStateStore
+from .provider import Provider, StagedProvider, ProviderGroup, ProviderRegistry, merge_records
+from .covers import CoverStore
+from .records import RecordBatch, intern_text, intern_list
+from .export import ExportedRecord, JsonlExporter, ParquetExporter, open_exporter, iter_exported
+from .schema import OptionIndex, normalize_option
+from .metrics import Metrics, get_metrics, set_metrics, start_metrics_server
+from .pagecache import PageCache, CachedPage, get_page_cache, set_page_cache
@@ -0,0 +1,153 @@
+import asyncio
+import atexit
+import threading
+from typing import Any, Awaitable, Dict, Optional, Tuple
+from urllib.parse import urlparse
+from common.http import HTTP_BACKOFF, HTTP_BACKOFF_MAX, HTTP_RETRIES, HTTP_RETRY_STATUS, backoff_delay, \
+    is_throttled
+from common.metrics import get_metrics
+from common.pagecache import get_page_cache, page_key
+from common.ratelimit import get_rate_limiter
+
+AIO_POOL_SIZE = 100  # 连接池总连接数
+AIO_POOL_SIZE_PER_HOST = 10  # 单个域名的连接数
+AIO_TIMEOUT = 30  # 单次请求超时秒数
+
+__ALL__ = ["AsyncHttpClient", "get_async_client", "close_async_client", "configure_async_client", "run_sync"]
+
+
+class AsyncHttpClient:
+
+    def __init__(self, headers: Optional[Dict[str, str]] = None, pool_size: int = AIO_POOL_SIZE,
+                 pool_size_per_host: int = AIO_POOL_SIZE_PER_HOST, timeout: float = AIO_TIMEOUT,
+                 retries: int = HTTP_RETRIES, backoff: float = HTTP_BACKOFF, backoff_max: float = HTTP_BACKOFF_MAX):
+        try:
+            import aiohttp
+        except ImportError as e:
+            raise ImportError("async providers require aiohttp, install it with `pip install aiohttp`") from e
+        self.errors = (aiohttp.ClientError, asyncio.TimeoutError)
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=pool_size, limit_per_host=pool_size_per_host),
+            timeout=aiohttp.ClientTimeout(total=timeout),
+            headers=headers,
+        )
+
+    async def get(self, url: str, params: Optional[Dict[str, Any]] = None,
+                  headers: Optional[Dict[str, str]] = None) -> Tuple[int, bytes]:
+        status, _, content = await self.request(url, params, headers)
+        return status, content
+
+    async def get_page(self, url: str, params: Optional[Dict[str, Any]] = None,
+                       headers: Optional[Dict[str, str]] = None) -> Optional[bytes]:
+        # 与 HttpTransport.get_page 相同, 共用原始页面缓存
+        cache = get_page_cache()
+        key = page_key(url, params)
+        cached = cache.get(key) if cache is not None else None
+        metrics = get_metrics()
+        if cached is not None and not cached.expired:
+            metrics.incr("page_cache", result="hit")
+            return cached.content
+        status, resp_headers, content = await self.request(
+            url, params, cached.conditional_headers(headers) if cached is not None else headers)
+        if status == 304 and cached is not None:
+            metrics.incr("page_cache", result="revalidated")
+            cache.touch(key)
+            return cached.content
+        if status not in [200, 201]:
+            return None
+        if cache is not None:
+            metrics.incr("page_cache", result="miss" if cached is None else "changed")
+            cache.set(key, content, resp_headers.get("ETag"), resp_headers.get("Last-Modified"))
+        return content
+
+    async def request(self, url: str, params: Optional[Dict[str, Any]] = None,
+                      headers: Optional[Dict[str, str]] = None,
+                      allow_redirects: bool = True) -> Tuple[int, Dict[str, str], bytes]:
+        # 与 HttpTransport.get 相同: 5xx、连接错误和限流按指数退避重试, 重试用完后返回最后一次的结果
+        # 响应头保留不区分大小写的副本, 服务端返回 Etag / ETag 都能取到
+        host = urlparse(url).netloc
+        limiter = get_rate_limiter(host)
+        metrics = get_metrics()
+        attempt = 0
+        while True:
+            try:
+                await limiter.aacquire()
+                with metrics.timer("http_request", host=host):
+                    async with self.session.get(url, params=params, headers=headers,
+                                                allow_redirects=allow_redirects) as resp:
+                        if is_throttled(resp.status, str(resp.url), resp.headers.get("Location", "")):
+                            metrics.incr("http_throttled", host=host)
+                            limiter.on_throttle()
+                            # 验证码页面同样返回 200, 统一按 429 交给调用方处理
+                            result = 429, {}, b""
+                        elif resp.status in HTTP_RETRY_STATUS:
+                            result = resp.status, resp.headers.copy(), b""
+                        else:
+                            limiter.on_success()
+                            return resp.status, resp.headers.copy(), await resp.read()
+                if attempt >= self.retries:
+                    return result
+            except self.errors:
+                metrics.incr("http_errors", host=host)
+                if attempt >= self.retries:
+                    raise
+            metrics.incr("http_retries", host=host)
+            await asyncio.sleep(backoff_delay(attempt, self.backoff, self.backoff_max))
+            attempt += 1
+
+    async def close(self):
+        await self.session.close()
+
+
+# 每个事件循环共享一个连接池
+_clients: Dict[asyncio.AbstractEventLoop, AsyncHttpClient] = {}
+_client_options: Dict[str, Any] = {}
+# 同步接口共用的后台事件循环
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+
+def get_async_client() -> AsyncHttpClient:
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = _clients[loop] = AsyncHttpClient(**_client_options)
+    return client
+
+
+def configure_async_client(**options):
+    # 之后新建的连接池使用这些参数, 例如 CLI 的 --budget 限制连接总数
+    _client_options.update(options)
+
+
+def run_sync(coro: Awaitable[Any]) -> Any:
+    # 同步接口是异步实现的包装: 协程交给共享的后台事件循环执行, 所有线程共用一个连接池
+    global _loop
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        pass
+    else:
+        coro.close()
+        raise RuntimeError("run_sync cannot be called from a running event loop, await the coroutine instead")
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="aio_loop", daemon=True).start()
+            atexit.register(_stop_loop, _loop)
+        loop = _loop
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+
+def _stop_loop(loop: asyncio.AbstractEventLoop):
+    asyncio.run_coroutine_threadsafe(close_async_client(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+
+
+async def close_async_client():
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.close()
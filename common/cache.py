@@ -0,0 +1,116 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+from common.metrics import get_metrics
+
+META_CACHE_PATH = os.environ.get("DOUBAN_CACHE_PATH", os.path.join(".cache", "douban.sqlite3"))
+META_CACHE_TTL = 30 * 24 * 3600  # 缓存有效期, 默认30天
+META_CACHE_MAX_ENTRIES = 200000  # 最大缓存条数, 超出后按最近访问时间淘汰
+META_CACHE_VERSION = 2  # 记录结构变化时递增, 旧缓存自动失效
+EVICT_INTERVAL = 1000  # 每写入多少条检查一次容量
+
+__ALL__ = ["MetaCache", "get_meta_cache", "set_meta_cache"]
+
+
+class MetaCache:
+
+    def __init__(self, path: str = META_CACHE_PATH, ttl: float = META_CACHE_TTL,
+                 max_entries: int = META_CACHE_MAX_ENTRIES):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " namespace TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " value BLOB NOT NULL,"
+            " expires_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL,"
+            " PRIMARY KEY (namespace, key))")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)")
+        self.hits: Dict[str, int] = {}
+        self.misses: Dict[str, int] = {}
+        self.writes = 0
+
+    @staticmethod
+    def namespaced(namespace: str) -> str:
+        return f"{namespace}:v{META_CACHE_VERSION}"
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ?",
+                                    (self.namespaced(namespace), key)).fetchone()
+            if row is None or row[1] < now:
+                self.misses[namespace] = self.misses.get(namespace, 0) + 1
+                get_metrics().incr("cache_misses", namespace=namespace)
+                return None
+            self.conn.execute("UPDATE cache SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                              (now, self.namespaced(namespace), key))
+            self.hits[namespace] = self.hits.get(namespace, 0) + 1
+        get_metrics().incr("cache_hits", namespace=namespace)
+        return pickle.loads(row[0])
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None):
+        now = time.time()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO cache (namespace, key, value, expires_at, accessed_at) "
+                              "VALUES (?, ?, ?, ?, ?)", (self.namespaced(namespace), key, data, expires_at, now))
+            self.writes += 1
+            if self.writes % EVICT_INTERVAL == 0:
+                self.evict()
+
+    def delete(self, namespace: str, key: str):
+        with self.lock:
+            self.conn.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (self.namespaced(namespace), key))
+
+    def evict(self):
+        # 调用方需持有 self.lock
+        self.conn.execute("DELETE FROM cache WHERE expires_at < ?", (time.time(),))
+        count = self.conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        if count > self.max_entries:
+            self.conn.execute("DELETE FROM cache WHERE rowid IN ("
+                              " SELECT rowid FROM cache ORDER BY accessed_at LIMIT ?)", (count - self.max_entries,))
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        namespaces = set(self.hits) | set(self.misses)
+        return {namespace: {"hits": self.hits.get(namespace, 0), "misses": self.misses.get(namespace, 0)}
+                for namespace in sorted(namespaces)}
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+_meta_cache: Optional[MetaCache] = None
+_meta_cache_lock = threading.Lock()
+_meta_cache_disabled = False
+
+
+def get_meta_cache() -> Optional[MetaCache]:
+    global _meta_cache
+    if _meta_cache_disabled:
+        return None
+    with _meta_cache_lock:
+        if _meta_cache is None:
+            _meta_cache = MetaCache()
+        return _meta_cache
+
+
+def set_meta_cache(cache: Optional[MetaCache]):
+    # 传入 None 关闭缓存
+    global _meta_cache, _meta_cache_disabled
+    with _meta_cache_lock:
+        _meta_cache = cache
+        _meta_cache_disabled = cache is None
@@ -0,0 +1,129 @@
+import hashlib
+import io
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional, Tuple
+from common.http import get_transport, is_throttled
+from common.metrics import get_metrics
+
+try:
+    from PIL import Image
+except ImportError:  # 未安装 Pillow 时只保存原图, 不生成缩略图
+    Image = None
+
+COVER_STORE_PATH = os.environ.get("COVER_STORE_PATH", os.path.join(".cache", "covers"))
+COVER_BASE_URL = os.environ.get("COVER_BASE_URL", "")  # 封面目录对外访问的地址, 为空时 Notion 仍然使用豆瓣链接
+COVER_THUMB_SIZE = (400, 600)  # 缩略图最大宽高
+COVER_THUMB_QUALITY = 85
+COVER_HEADERS = {"Referer": "https://www.douban.com/"}  # 豆瓣图片防盗链
+COVER_EXTENSIONS = {
+    b"\xff\xd8\xff": ".jpg",
+    b"\x89PNG": ".png",
+    b"GIF8": ".gif",
+    b"RIFF": ".webp",
+}
+
+__ALL__ = ["CoverStore"]
+
+
+def guess_extension(content: bytes) -> str:
+    for magic, extension in COVER_EXTENSIONS.items():
+        if content.startswith(magic):
+            return extension
+    return ".jpg"
+
+
+class CoverStore:
+
+    def __init__(self, path: str = COVER_STORE_PATH, base_url: str = COVER_BASE_URL,
+                 thumb_size: Tuple[int, int] = COVER_THUMB_SIZE):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.base_url = base_url.rstrip("/")
+        self.thumb_size = thumb_size
+        self.lock = threading.Lock()
+        # 原始链接 -> 内容哈希, 重复运行时同一张图片不再下载
+        self.conn = sqlite3.connect(os.path.join(path, "index.sqlite3"), check_same_thread=False,
+                                    isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS covers ("
+            " url TEXT PRIMARY KEY,"
+            " digest TEXT NOT NULL,"
+            " filename TEXT NOT NULL,"
+            " created_at REAL NOT NULL)")
+
+    def lookup(self, url: str) -> Optional[str]:
+        with self.lock:
+            row = self.conn.execute("SELECT filename FROM covers WHERE url = ?", (url,)).fetchone()
+        if row is None or not os.path.exists(os.path.join(self.path, row[0])):
+            return None
+        return row[0]
+
+    def store(self, url: str) -> Optional[str]:
+        filename = self.lookup(url)
+        if filename is not None:
+            get_metrics().incr("covers", result="cached")
+            return filename
+        resp = get_transport().get(url, headers=COVER_HEADERS)
+        if resp.status_code != 200 or is_throttled(resp.status_code, resp.url) or not resp.content:
+            get_metrics().incr("covers", result="failed")
+            return None
+        get_metrics().incr("covers", result="downloaded")
+        # 按内容寻址, 不同链接指向同一张图片时只保存一份
+        digest = hashlib.sha256(resp.content).hexdigest()
+        filename = self.write(digest, resp.content)
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO covers (url, digest, filename, created_at) VALUES (?, ?, ?, ?)",
+                              (url, digest, filename, time.time()))
+        return filename
+
+    def write(self, digest: str, content: bytes) -> str:
+        original = os.path.join(digest[:2], digest + guess_extension(content))
+        self.write_file(original, content)
+        if Image is None:
+            return original
+        thumbnail = os.path.join(digest[:2], f"{digest}_{self.thumb_size[0]}x{self.thumb_size[1]}.jpg")
+        if os.path.exists(os.path.join(self.path, thumbnail)):
+            return thumbnail
+        try:
+            with Image.open(io.BytesIO(content)) as image:
+                image.thumbnail(self.thumb_size)
+                buffer = io.BytesIO()
+                image.convert("RGB").save(buffer, "JPEG", quality=COVER_THUMB_QUALITY, optimize=True)
+        except OSError:
+            return original
+        self.write_file(thumbnail, buffer.getvalue())
+        return thumbnail
+
+    def write_file(self, filename: str, content: bytes):
+        path = os.path.join(self.path, filename)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 先写临时文件再改名, 并发写同一张图片时不会读到半个文件
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(content)
+        os.replace(tmp, path)
+
+    def public_url(self, filename: str) -> str:
+        return f"{self.base_url}/{filename.replace(os.sep, '/')}"
+
+    def localize(self, url: str) -> str:
+        # 下载失败或未配置对外地址时保留原链接
+        if not url or not url.startswith("http"):
+            return url
+        # 同一条记录被多个页面共享时可能已经换成了自己的地址
+        if self.base_url and url.startswith(self.base_url + "/"):
+            return url
+        filename = self.store(url)
+        if filename is None or not self.base_url:
+            return url
+        return self.public_url(filename)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,177 @@
+import dataclasses
+import glob
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Generic, Iterator, List, Type, TypeVar
+from common.records import RecordBatch
+
+T = TypeVar("T")
+
+EXPORT_BATCH_SIZE = 1000  # parquet 每攒够多少条写一个分片文件
+EXPORT_JSON_COLUMNS = b"json_columns"  # parquet 中以 JSON 字符串保存的列, 记录在文件元数据里
+
+__ALL__ = ["ExportedRecord", "JsonlExporter", "ParquetExporter", "open_exporter", "iter_exported",
+           "record_to_dict", "record_from_dict"]
+
+
+@dataclasses.dataclass
+class ExportedRecord(Generic[T]):
+    page_id: str
+    query: str
+    record: T
+
+
+def record_to_dict(record: Any) -> Dict[str, Any]:
+    return dataclasses.asdict(record)
+
+
+def record_from_dict(record_type: Type[T], data: Dict[str, Any]) -> T:
+    # 忽略未知字段, 缺失的字段使用默认值, 新旧版本导出的文件都能读
+    kwargs = {}
+    for field in dataclasses.fields(record_type):
+        if field.name not in data:
+            continue
+        value = data[field.name]
+        if dataclasses.is_dataclass(field.type) and isinstance(value, dict):
+            value = record_from_dict(field.type, value)
+        kwargs[field.name] = value
+    return record_type(**kwargs)
+
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("parquet export requires pyarrow, install it with `pip install pyarrow`") from e
+    return pyarrow, pyarrow.parquet
+
+
+class JsonlExporter:
+
+    def __init__(self, path: str, record_type: Type[Any]):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.record_type = record_type
+        self.lock = threading.Lock()
+        # 追加写入, 多次运行的结果累积在同一个文件里
+        self.file = open(path, "a", encoding="utf-8")
+
+    def write(self, page_id: str, query: str, record: Any):
+        line = json.dumps({"page_id": page_id, "query": query, "record": record_to_dict(record)},
+                          ensure_ascii=False)
+        with self.lock:
+            self.file.write(line + "\n")
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ParquetExporter:
+
+    def __init__(self, path: str, record_type: Type[Any], batch_size: int = EXPORT_BATCH_SIZE):
+        self.pyarrow, self.parquet = import_pyarrow()
+        # parquet 文件不能追加, 每批写成目录下的一个分片, 读取时按文件名顺序合并
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.record_type = record_type
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        self.prefix = f"part-{time.strftime('%Y%m%d%H%M%S')}-{os.getpid()}"
+        self.parts = 0
+        self.reset()
+
+    def reset(self):
+        self.page_ids: List[str] = []
+        self.queries: List[str] = []
+        self.batch = RecordBatch(self.record_type)
+
+    def write(self, page_id: str, query: str, record: Any):
+        with self.lock:
+            self.page_ids.append(page_id)
+            self.queries.append(query)
+            self.batch.append(record)
+            if len(self.batch) >= self.batch_size:
+                self.flush()
+
+    def flush(self):
+        if not len(self.batch):
+            return
+        pa = self.pyarrow
+        arrays = [pa.array(self.page_ids, pa.string()), pa.array(self.queries, pa.string())]
+        names = ["page_id", "query"]
+        json_columns = []
+        for name in self.batch.names:
+            values = self.batch.column(name)
+            array = None
+            if not any(isinstance(value, dict) or dataclasses.is_dataclass(value) for value in values):
+                try:
+                    array = pa.array(values)
+                except (pa.ArrowInvalid, pa.ArrowTypeError):
+                    array = None
+            if array is None:
+                # 嵌套结构或同一列类型不一致时退化为 JSON 字符串
+                json_columns.append(name)
+                array = pa.array([json.dumps(record_to_dict(value) if dataclasses.is_dataclass(value) else value,
+                                             ensure_ascii=False) for value in values], pa.string())
+            names.append(name)
+            arrays.append(array)
+        table = pa.Table.from_arrays(arrays, names=names)
+        table = table.replace_schema_metadata({EXPORT_JSON_COLUMNS: ",".join(json_columns).encode()})
+        self.parts += 1
+        self.parquet.write_table(table, os.path.join(self.path, f"{self.prefix}-{self.parts:05d}.parquet"))
+        self.reset()
+
+    def close(self):
+        with self.lock:
+            self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_exporter(path: str, record_type: Type[Any]):
+    if path.endswith(".parquet"):
+        return ParquetExporter(path, record_type)
+    return JsonlExporter(path, record_type)
+
+
+def iter_jsonl(path: str, record_type: Type[T]) -> Iterator[ExportedRecord]:
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            yield ExportedRecord(row["page_id"], row["query"], record_from_dict(record_type, row["record"]))
+
+
+def iter_parquet(path: str, record_type: Type[T]) -> Iterator[ExportedRecord]:
+    _, parquet = import_pyarrow()
+    for filename in sorted(glob.glob(os.path.join(path, "*.parquet"))):
+        parquet_file = parquet.ParquetFile(filename)
+        metadata = parquet_file.schema_arrow.metadata or {}
+        json_columns = set(filter(None, metadata.get(EXPORT_JSON_COLUMNS, b"").decode().split(",")))
+        for batch in parquet_file.iter_batches(batch_size=EXPORT_BATCH_SIZE):
+            for row in batch.to_pylist():
+                for name in json_columns:
+                    row[name] = json.loads(row[name])
+                yield ExportedRecord(row.pop("page_id"), row.pop("query"), record_from_dict(record_type, row))
+
+
+def iter_exported(path: str, record_type: Type[T]) -> Iterator[ExportedRecord]:
+    if path.endswith(".parquet"):
+        return iter_parquet(path, record_type)
+    return iter_jsonl(path, record_type)
@@ -0,0 +1,156 @@
+import random
+import threading
+import time
+import requests
+from contextlib import contextmanager, nullcontext
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from common.metrics import get_metrics
+from common.pagecache import get_page_cache, page_key
+from common.ratelimit import get_rate_limiter
+
+HTTP_POOL_SIZE = 10  # 连接池大小, 与下载线程数一致
+HTTP_MAX_PER_HOST = 10  # 单个域名同时进行的请求数
+HTTP_MAX_TOTAL = 0  # 所有域名合计同时进行的请求数, 0 表示不限制
+HTTP_RETRIES = 3  # 5xx 或连接错误时的重试次数
+HTTP_BACKOFF = 0.5  # 指数退避的初始等待秒数
+HTTP_BACKOFF_MAX = 10  # 单次退避的最长等待秒数
+HTTP_TIMEOUT = (5, 15)  # (连接超时, 读取超时)
+HTTP_RETRY_STATUS = {500, 502, 503, 504}
+HTTP_THROTTLE_STATUS = {403, 429}
+HTTP_THROTTLE_URL_MARKERS = ("sec.douban.com", "/misc/sorry")  # 豆瓣限流时跳转的验证码页面
+
+__ALL__ = ["HttpTransport", "get_transport", "configure_transport", "is_throttled", "backoff_delay"]
+
+
+def is_throttled(status: int, url: str, location: str = "") -> bool:
+    # location 为未跟随跳转时的 Location 头, 跳转到验证码页面同样视为限流
+    return status in HTTP_THROTTLE_STATUS or any(marker in url or marker in location
+                                                 for marker in HTTP_THROTTLE_URL_MARKERS)
+
+
+def backoff_delay(attempt: int, backoff: float = HTTP_BACKOFF, backoff_max: float = HTTP_BACKOFF_MAX) -> float:
+    # full jitter: 在 [0, backoff * 2^attempt] 之间随机等待, 避免多个请求同时重试; 同步和异步客户端共用
+    return random.uniform(0, min(backoff_max, backoff * (2 ** attempt)))
+
+
+class HttpTransport:
+
+    def __init__(self, pool_size: int = HTTP_POOL_SIZE, max_per_host: int = HTTP_MAX_PER_HOST,
+                 retries: int = HTTP_RETRIES, backoff: float = HTTP_BACKOFF, backoff_max: float = HTTP_BACKOFF_MAX,
+                 timeout: Tuple[float, float] = HTTP_TIMEOUT, headers: Optional[Dict[str, str]] = None,
+                 max_total: int = HTTP_MAX_TOTAL):
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.max_per_host = max_per_host
+        self.pool_size = 0
+        self.session = requests.Session()
+        if headers:
+            self.session.headers.update(headers)
+        self.lock = threading.Lock()
+        self.host_limits: Dict[str, threading.BoundedSemaphore] = {}
+        # 连接池满了不会阻塞, 总并发由这个信号量限制
+        self.total_limit = threading.BoundedSemaphore(max_total) if max_total > 0 else nullcontext()
+        self.ensure_pool_size(pool_size)
+
+    def ensure_pool_size(self, pool_size: int):
+        # 连接池只增不减, 多个任务共享时按最大的并发数配置
+        with self.lock:
+            if pool_size <= self.pool_size:
+                return
+            self.pool_size = pool_size
+            # 重试由 get 自己处理, 适配器不再重试
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+            self.session.mount("https://", adapter)
+            self.session.mount("http://", adapter)
+
+    @contextmanager
+    def host_limit(self, host: str):
+        with self.lock:
+            semaphore = self.host_limits.get(host)
+            if semaphore is None:
+                semaphore = self.host_limits[host] = threading.BoundedSemaphore(self.max_per_host)
+        with semaphore:
+            yield
+
+    def backoff_delay(self, attempt: int) -> float:
+        return backoff_delay(attempt, self.backoff, self.backoff_max)
+
+    def get(self, url: str, params: Optional[Dict[str, Any]] = None, headers: Optional[Dict[str, str]] = None,
+            **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        host = urlparse(url).netloc
+        limiter = get_rate_limiter(host)
+        metrics = get_metrics()
+        attempt = 0
+        while True:
+            try:
+                limiter.acquire()
+                with self.total_limit, self.host_limit(host), metrics.timer("http_request", host=host):
+                    res = self.session.get(url, params=params, headers=headers, **kwargs)
+                throttled = is_throttled(res.status_code, res.url, res.headers.get("Location", ""))
+                if throttled:
+                    metrics.incr("http_throttled", host=host)
+                    limiter.on_throttle()
+                elif res.status_code not in HTTP_RETRY_STATUS:
+                    limiter.on_success()
+                    return res
+                if attempt >= self.retries:
+                    return res
+                res.close()
+            except (requests.ConnectionError, requests.Timeout):
+                metrics.incr("http_errors", host=host)
+                if attempt >= self.retries:
+                    raise
+            metrics.incr("http_retries", host=host)
+            time.sleep(self.backoff_delay(attempt))
+            attempt += 1
+
+    def get_page(self, url: str, params: Optional[Dict[str, Any]] = None,
+                 headers: Optional[Dict[str, str]] = None) -> Optional[bytes]:
+        # 经过原始页面缓存的 GET: 未过期直接返回, 过期后发条件请求, 304 时沿用缓存; 失败或被限流时返回 None
+        cache = get_page_cache()
+        key = page_key(url, params)
+        cached = cache.get(key) if cache is not None else None
+        metrics = get_metrics()
+        if cached is not None and not cached.expired:
+            metrics.incr("page_cache", result="hit")
+            return cached.content
+        res = self.get(url, params, headers=cached.conditional_headers(headers) if cached is not None else headers)
+        if res.status_code == 304 and cached is not None:
+            metrics.incr("page_cache", result="revalidated")
+            cache.touch(key)
+            return cached.content
+        if res.status_code not in [200, 201] or is_throttled(res.status_code, res.url):
+            return None
+        if cache is not None:
+            metrics.incr("page_cache", result="miss" if cached is None else "changed")
+            cache.set(key, res.content, res.headers.get("ETag"), res.headers.get("Last-Modified"))
+        return res.content
+
+    def close(self):
+        self.session.close()
+
+
+_transport: Optional[HttpTransport] = None
+_transport_lock = threading.Lock()
+
+
+def get_transport() -> HttpTransport:
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            _transport = HttpTransport()
+        return _transport
+
+
+def configure_transport(**kwargs) -> HttpTransport:
+    global _transport
+    with _transport_lock:
+        if _transport is not None:
+            _transport.close()
+        _transport = HttpTransport(**kwargs)
+        return _transport
@@ -0,0 +1,187 @@
+import bisect
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# 耗时直方图的桶上限(秒)
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+METRICS_PATH = os.environ.get("METRICS_PATH", "")  # 每次运行结束时写入 JSON 汇总的路径, 为空时不写
+METRICS_PROMETHEUS_PATH = os.environ.get("METRICS_PROMETHEUS_PATH", "")  # Prometheus 文本格式输出路径
+METRICS_PREFIX = "notion_sync_"
+
+__ALL__ = ["Metrics", "get_metrics", "set_metrics", "start_metrics_server"]
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def write_atomic(path: str, text: str):
+    # 先写同目录下的临时文件再改名, 读取方不会看到写了一半的文件; 临时文件名唯一, 多个线程同时导出也不冲突
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+class Histogram:
+
+    def __init__(self, buckets: Tuple[float, ...] = METRICS_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        # 按桶估算分位数, 取命中桶的上限
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.buckets[index] if index < len(self.buckets) else self.max
+        return self.max
+
+
+class Metrics:
+
+    def __init__(self, buckets: Tuple[float, ...] = METRICS_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.counters: Dict[str, Dict[Labels, float]] = {}
+        self.histograms: Dict[str, Dict[Labels, Histogram]] = {}
+
+    @staticmethod
+    def labels(labels: Dict[str, str]) -> Labels:
+        return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def incr(self, name: str, value: float = 1, **labels: str):
+        key = self.labels(labels)
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels: str):
+        key = self.labels(labels)
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def summary(self) -> Dict[str, object]:
+        with self.lock:
+            counters = {name: [{"labels": dict(key), "value": value} for key, value in series.items()]
+                        for name, series in self.counters.items()}
+            histograms = {name: [{"labels": dict(key), "count": h.count, "sum": round(h.sum, 6),
+                                  "max": round(h.max, 6), "p50": h.quantile(0.5), "p95": h.quantile(0.95),
+                                  "p99": h.quantile(0.99)}
+                                 for key, h in series.items()]
+                          for name, series in self.histograms.items()}
+        return {"started_at": self.started_at, "duration": round(time.time() - self.started_at, 3),
+                "counters": counters, "histograms": histograms}
+
+    def write_summary(self, path: str):
+        write_atomic(path, json.dumps(self.summary(), ensure_ascii=False, indent=2))
+
+    @staticmethod
+    def format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+        pairs = list(labels) + ([extra] if extra else [])
+        if not pairs:
+            return ""
+        escaped = (value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, value in pairs)
+        return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+    def to_prometheus(self) -> str:
+        lines: List[str] = []
+        with self.lock:
+            for name, series in sorted(self.counters.items()):
+                metric = f"{METRICS_PREFIX}{name}_total"
+                lines.append(f"# TYPE {metric} counter")
+                for key, value in series.items():
+                    lines.append(f"{metric}{self.format_labels(key)} {value}")
+            for name, series in sorted(self.histograms.items()):
+                metric = f"{METRICS_PREFIX}{name}_seconds"
+                lines.append(f"# TYPE {metric} histogram")
+                for key, h in series.items():
+                    cumulative = 0
+                    for bound, count in zip(h.buckets, h.counts):
+                        cumulative += count
+                        lines.append(f"{metric}_bucket{self.format_labels(key, ('le', str(bound)))} {cumulative}")
+                    lines.append(f"{metric}_bucket{self.format_labels(key, ('le', '+Inf'))} {h.count}")
+                    lines.append(f"{metric}_sum{self.format_labels(key)} {h.sum}")
+                    lines.append(f"{metric}_count{self.format_labels(key)} {h.count}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str):
+        # 供 node_exporter 的 textfile collector 读取
+        write_atomic(path, self.to_prometheus())
+
+    def export(self, path: str = METRICS_PATH, prometheus_path: str = METRICS_PROMETHEUS_PATH):
+        if path:
+            self.write_summary(path)
+        if prometheus_path:
+            self.write_prometheus(prometheus_path)
+
+
+_metrics = Metrics()
+
+
+def get_metrics() -> Metrics:
+    return _metrics
+
+
+def set_metrics(metrics: Metrics):
+    global _metrics
+    _metrics = metrics
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    # 长时间运行时通过 /metrics 暴露 Prometheus 文本格式
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = get_metrics().to_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics_server", daemon=True).start()
+    return server
@@ -0,0 +1,234 @@
+import asyncio
+import hashlib
+import json
+import threading
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, Optional
+from notion_client.errors import HTTPResponseError, RequestTimeoutError
+from common.metrics import get_metrics
+from common.ratelimit import TokenBucket
+
+NOTION_PAGE_SIZE = 100  # Notion 单次查询最大条数
+NOTION_RATE = 3.0  # Notion 平均每秒请求数上限
+NOTION_BURST = 3
+NOTION_WRITE_CONCURRENCY = 3  # 同时进行的写入数
+NOTION_MAX_RETRIES = 5  # 429 / 5xx 的重试次数
+NOTION_BACKOFF = 1.0  # 没有 Retry-After 时的初始等待秒数
+NOTION_BACKOFF_MAX = 30
+
+NOTION_PROPERTY_META_KEYS = ("id", "type", "name")
+
+__ALL__ = ["iter_database_pages", "aiter_database_pages", "NotionWriter", "diff_properties"]
+
+
+def iter_database_pages(c, database_id: str, query_filter: Optional[Dict[str, Any]] = None,
+                        page_size: int = NOTION_PAGE_SIZE, start_cursor: Optional[str] = None,
+                        on_cursor: Optional[Callable[[str], None]] = None,
+                        writer: Optional["NotionWriter"] = None) -> Iterator[Dict[str, Any]]:
+    # on_cursor 在上一批结果全部被取走、请求下一批之前调用, 可用于保存断点;
+    # 给出 writer 时查询与写入共用同一个限流和重试
+    kwargs = {"database_id": database_id, "page_size": page_size}
+    if query_filter:
+        kwargs["filter"] = query_filter
+    while True:
+        if start_cursor:
+            kwargs["start_cursor"] = start_cursor
+        if writer is not None:
+            resp = writer.call(c.databases.query, "notion_query", **kwargs)
+        else:
+            with get_metrics().timer("notion_query"):
+                resp = c.databases.query(**kwargs)
+        for item in resp["results"]:
+            yield item
+        start_cursor = resp.get("next_cursor")
+        if not resp.get("has_more") or not start_cursor:
+            break
+        if on_cursor is not None:
+            on_cursor(start_cursor)
+
+
+async def aiter_database_pages(c, database_id: str, query_filter: Optional[Dict[str, Any]] = None,
+                               page_size: int = NOTION_PAGE_SIZE, start_cursor: Optional[str] = None,
+                               on_cursor: Optional[Callable[[str], None]] = None,
+                               writer: Optional["NotionWriter"] = None) -> AsyncIterator[Dict[str, Any]]:
+    kwargs = {"database_id": database_id, "page_size": page_size}
+    if query_filter:
+        kwargs["filter"] = query_filter
+    while True:
+        if start_cursor:
+            kwargs["start_cursor"] = start_cursor
+        if writer is not None:
+            resp = await writer.acall(c.databases.query, "notion_query", **kwargs)
+        else:
+            with get_metrics().timer("notion_query"):
+                resp = await c.databases.query(**kwargs)
+        for item in resp["results"]:
+            yield item
+        start_cursor = resp.get("next_cursor")
+        if not resp.get("has_more") or not start_cursor:
+            break
+        if on_cursor is not None:
+            on_cursor(start_cursor)
+
+
+def property_type(value: Dict[str, Any]) -> Optional[str]:
+    # 查询结果带 type, 本地生成的属性只有一个取值字段
+    if value.get("type") in value:
+        return value["type"]
+    return next((key for key in value if key not in NOTION_PROPERTY_META_KEYS), None)
+
+
+def normalize_date(value: Optional[str]) -> Optional[str]:
+    # 只有日期的属性读回来可能带上零点时间
+    if value and "T" in value and value.split("T", 1)[1].startswith("00:00:00"):
+        return value[:10]
+    return value or None
+
+
+def normalize_property(value: Any) -> Any:
+    # 把本地生成的属性和 Notion 返回的属性转成同一种可比较的形式
+    if not isinstance(value, dict):
+        return value
+    kind = property_type(value)
+    data = value.get(kind)
+    if kind == "multi_select":
+        return tuple(sorted({option.get("name") for option in data or [] if option.get("name")}))
+    if kind in ("select", "status"):
+        return (data or {}).get("name") or None
+    if kind == "date":
+        if not data or not data.get("start"):
+            return None
+        return normalize_date(data.get("start")), normalize_date(data.get("end"))
+    if kind == "files":
+        # Notion 托管的文件链接带签名且会过期, 只比较文件名
+        return tuple(item["external"].get("url") if "external" in item else item.get("name")
+                     for item in data or [])
+    if kind in ("title", "rich_text"):
+        return "".join(item.get("plain_text") or (item.get("text") or {}).get("content", "")
+                       for item in data or [])
+    if kind in ("relation", "people"):
+        return tuple(sorted(item.get("id") for item in data or []))
+    if data == "" or data == []:
+        return None
+    return data
+
+
+def diff_properties(properties: Dict[str, Any], current: Dict[str, Any]) -> Dict[str, Any]:
+    # 只保留和页面现有内容不同的属性
+    return {name: value for name, value in properties.items()
+            if name not in current or normalize_property(value) != normalize_property(current[name])}
+
+
+class NotionWriter:
+
+    def __init__(self, client, rate: float = NOTION_RATE, concurrency: int = NOTION_WRITE_CONCURRENCY,
+                 max_retries: int = NOTION_MAX_RETRIES, dry_run: bool = False):
+        self.client = client
+        self.dry_run = dry_run  # 只计算要写入的内容, 不调用 Notion
+        self.bucket = TokenBucket(rate, NOTION_BURST)
+        self.semaphore = threading.BoundedSemaphore(concurrency)
+        self.asemaphore = asyncio.Semaphore(concurrency)  # 异步客户端的并发限制, 和线程共用令牌桶
+        self.max_retries = max_retries
+        self.lock = threading.Lock()
+        # page_id -> 最近一次写入内容的摘要, 相同内容不重复写入
+        self.written: Dict[str, str] = {}
+
+    @staticmethod
+    def payload_hash(properties: Dict[str, Any]) -> str:
+        data = json.dumps(properties, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+    def update(self, page_id: str, properties: Dict[str, Any], previous: Optional[str] = None,
+               current: Optional[Dict[str, Any]] = None) -> bool:
+        digest = self.payload_hash(properties)
+        payload = self.prepare(page_id, properties, digest, previous, current)
+        if payload is None:
+            return False
+        if not self.dry_run:
+            self.call(self.client.pages.update, "notion_update", page_id=page_id, **payload)
+        return self.written_page(page_id, digest)
+
+    async def aupdate(self, page_id: str, properties: Dict[str, Any], previous: Optional[str] = None,
+                      current: Optional[Dict[str, Any]] = None) -> bool:
+        # 异步客户端使用的 update, client 为 notion_client.AsyncClient
+        digest = self.payload_hash(properties)
+        payload = self.prepare(page_id, properties, digest, previous, current)
+        if payload is None:
+            return False
+        if not self.dry_run:
+            await self.acall(self.client.pages.update, "notion_update", page_id=page_id, **payload)
+        return self.written_page(page_id, digest)
+
+    def prepare(self, page_id: str, properties: Dict[str, Any], digest: str, previous: Optional[str],
+                current: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        # current 为查询时拿到的页面属性, 给出时只和它比较, 只写入有变化的属性;
+        # 否则按 previous (调用方记录的上次写入摘要, 例如来自同步状态库) 和本进程写过的内容跳过重复写入;
+        # 返回 None 表示不需要写入
+        if current is None:
+            with self.lock:
+                unchanged = digest == previous or self.written.get(page_id) == digest
+            if unchanged:
+                get_metrics().incr("notion_writes", result="unchanged")
+                return None
+            return properties
+        changed = diff_properties(properties.get("properties", {}), current)
+        if not changed:
+            with self.lock:
+                self.written[page_id] = digest
+            get_metrics().incr("notion_writes", result="unchanged")
+            return None
+        return {**properties, "properties": changed}
+
+    def written_page(self, page_id: str, digest: str) -> bool:
+        if self.dry_run:
+            get_metrics().incr("notion_writes", result="dry_run")
+            return True
+        with self.lock:
+            self.written[page_id] = digest
+        get_metrics().incr("notion_writes", result="written")
+        return True
+
+    def call(self, func: Callable[..., Any], metric: str = "notion_request", **kwargs) -> Any:
+        # 同一个 integration 的所有请求 (查询、读写数据库结构、更新页面) 共用令牌桶, 429 / 5xx 时重试
+        metrics = get_metrics()
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            try:
+                with self.semaphore, metrics.timer(metric):
+                    return func(**kwargs)
+            except (HTTPResponseError, RequestTimeoutError) as e:
+                if attempt >= self.max_retries or not self.retryable(e):
+                    raise
+                metrics.incr("notion_retries", status=getattr(e, "status", None))
+                self.bucket.pause(self.retry_after(e, attempt))
+            attempt += 1
+
+    async def acall(self, func: Callable[..., Awaitable[Any]], metric: str = "notion_request", **kwargs) -> Any:
+        # call 的异步版本
+        metrics = get_metrics()
+        attempt = 0
+        while True:
+            await self.bucket.aacquire()
+            try:
+                async with self.asemaphore:
+                    with metrics.timer(metric):
+                        return await func(**kwargs)
+            except (HTTPResponseError, RequestTimeoutError) as e:
+                if attempt >= self.max_retries or not self.retryable(e):
+                    raise
+                metrics.incr("notion_retries", status=getattr(e, "status", None))
+                self.bucket.pause(self.retry_after(e, attempt))
+            attempt += 1
+
+    @staticmethod
+    def retryable(e: Exception) -> bool:
+        status = getattr(e, "status", None)
+        return status is None or status == 429 or status >= 500
+
+    @staticmethod
+    def retry_after(e: Exception, attempt: int) -> float:
+        headers = getattr(e, "headers", None) or {}
+        try:
+            return float(headers.get("retry-after"))
+        except (TypeError, ValueError):
+            return min(NOTION_BACKOFF_MAX, NOTION_BACKOFF * (2 ** attempt))
@@ -0,0 +1,124 @@
+import dataclasses
+import os
+import sqlite3
+import threading
+import time
+import zlib
+import requests
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+PAGE_CACHE_PATH = os.environ.get("DOUBAN_PAGE_CACHE_PATH", os.path.join(".cache", "douban_pages.sqlite3"))
+PAGE_CACHE_TTL = 24 * 3600  # 超过有效期的页面带 ETag / Last-Modified 重新验证, 未变化时只消耗一次 304
+PAGE_CACHE_LEVEL = 6  # zlib 压缩级别
+
+__ALL__ = ["PageCache", "CachedPage", "get_page_cache", "set_page_cache"]
+
+
+def page_key(url: str, params: Optional[Dict[str, Any]] = None) -> str:
+    # 带上查询参数的完整地址, 同步和异步请求共用同一份缓存
+    return requests.Request("GET", url, params=params).prepare().url
+
+
+@dataclasses.dataclass(slots=True)
+class CachedPage:
+    url: str
+    content: bytes
+    etag: Optional[str]
+    last_modified: Optional[str]
+    expires_at: float
+
+    @property
+    def expired(self) -> bool:
+        return self.expires_at < time.time()
+
+    def conditional_headers(self, headers: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+        result = dict(headers or {})
+        if self.etag:
+            result["If-None-Match"] = self.etag
+        if self.last_modified:
+            result["If-Modified-Since"] = self.last_modified
+        return result
+
+
+class PageCache:
+    # 豆瓣搜索页和详情页的原始响应, 按完整 URL 保存; 过期的页面不删除, 用于条件请求和离线重新解析
+
+    def __init__(self, path: str = PAGE_CACHE_PATH, ttl: float = PAGE_CACHE_TTL, level: int = PAGE_CACHE_LEVEL):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.ttl = ttl
+        self.level = level
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            " url TEXT PRIMARY KEY,"
+            " content BLOB NOT NULL,"
+            " etag TEXT,"
+            " last_modified TEXT,"
+            " fetched_at REAL NOT NULL,"
+            " expires_at REAL NOT NULL)")
+
+    def get(self, url: str) -> Optional[CachedPage]:
+        with self.lock:
+            row = self.conn.execute("SELECT content, etag, last_modified, expires_at FROM pages WHERE url = ?",
+                                    (url,)).fetchone()
+        if row is None:
+            return None
+        return CachedPage(url, zlib.decompress(row[0]), row[1], row[2], row[3])
+
+    def set(self, url: str, content: bytes, etag: Optional[str] = None, last_modified: Optional[str] = None):
+        now = time.time()
+        data = zlib.compress(content, self.level)
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO pages (url, content, etag, last_modified, fetched_at, expires_at) "
+                              "VALUES (?, ?, ?, ?, ?, ?)", (url, data, etag, last_modified, now, now + self.ttl))
+
+    def touch(self, url: str):
+        # 304 时只延长有效期
+        now = time.time()
+        with self.lock:
+            self.conn.execute("UPDATE pages SET fetched_at = ?, expires_at = ? WHERE url = ?",
+                              (now, now + self.ttl, url))
+
+    def urls(self) -> Iterator[str]:
+        with self.lock:
+            urls = [row[0] for row in self.conn.execute("SELECT url FROM pages ORDER BY url")]
+        return iter(urls)
+
+    def iter_pages(self) -> Iterator[Tuple[str, bytes]]:
+        # 逐条读取, 重新解析整个库时不需要把所有页面放进内存
+        for url in self.urls():
+            page = self.get(url)
+            if page is not None:
+                yield url, page.content
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+_page_cache: Optional[PageCache] = None
+_page_cache_lock = threading.Lock()
+_page_cache_disabled = False
+
+
+def get_page_cache() -> Optional[PageCache]:
+    global _page_cache
+    if _page_cache_disabled:
+        return None
+    with _page_cache_lock:
+        if _page_cache is None:
+            _page_cache = PageCache()
+        return _page_cache
+
+
+def set_page_cache(cache: Optional[PageCache]):
+    # 传入 None 关闭页面缓存
+    global _page_cache, _page_cache_disabled
+    with _page_cache_lock:
+        _page_cache = cache
+        _page_cache_disabled = cache is None
+
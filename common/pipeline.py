@@ -0,0 +1,136 @@
+import queue
+import threading
+import time
+from typing import Any, Callable, Iterable, List, Optional
+from common.metrics import get_metrics
+
+DEFAULT_QUEUE_SIZE = 16  # 每个阶段输入队列的容量, 满了之后上游阻塞
+DEFAULT_BATCH_TIMEOUT = 0.05  # 批量阶段凑批的最长等待秒数, 超时后不满一批也先处理
+
+__ALL__ = ["Stage", "Pipeline"]
+
+_STOP = object()
+
+
+class Stage:
+
+    def __init__(self, name: str, func: Callable[[Any], Any], workers: int = 1,
+                 queue_size: int = DEFAULT_QUEUE_SIZE, batch_size: int = 1,
+                 batch_timeout: float = DEFAULT_BATCH_TIMEOUT):
+        if workers < 1:
+            raise ValueError(f"stage {name} needs at least one worker")
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.queue_size = queue_size
+        # batch_size > 1 时 func 接收一批条目, 返回等长的结果列表, 结果为异常时交给 on_error
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+
+
+# 多阶段流水线: 每个阶段有独立的线程池, 阶段之间用有界队列连接.
+# 阶段函数返回 None 表示丢弃该条目, 抛出的异常交给 on_error 处理, 不会中断流水线.
+class Pipeline:
+
+    def __init__(self, stages: List[Stage], on_error: Optional[Callable[[Any, str, Exception], None]] = None):
+        if not stages:
+            raise ValueError("pipeline needs at least one stage")
+        self.stages = stages
+        self.on_error = on_error or self.default_on_error
+        self.queues = [queue.Queue(maxsize=stage.queue_size) for stage in stages]
+        self.completed = 0
+        self.lock = threading.Lock()
+
+    def run(self, items: Iterable[Any]) -> int:
+        workers = []
+        for index, stage in enumerate(self.stages):
+            threads = [threading.Thread(target=self.work, args=(index,), name=f"pipeline_{stage.name}_{i}",
+                                        daemon=True)
+                       for i in range(stage.workers)]
+            for thread in threads:
+                thread.start()
+            workers.append(threads)
+        try:
+            for item in items:
+                self.queues[0].put(item)
+        finally:
+            # 逐级关闭: 上一阶段全部退出后再通知下一阶段
+            for index, stage in enumerate(self.stages):
+                for _ in range(stage.workers):
+                    self.queues[index].put(_STOP)
+                for thread in workers[index]:
+                    thread.join()
+        return self.completed
+
+    def work(self, index: int):
+        stage = self.stages[index]
+        if stage.batch_size > 1:
+            return self.work_batches(index)
+        inbox = self.queues[index]
+        outbox = self.queues[index + 1] if index + 1 < len(self.queues) else None
+        metrics = get_metrics()
+        while True:
+            item = inbox.get()
+            if item is _STOP:
+                return
+            try:
+                with metrics.timer("stage", stage=stage.name):
+                    result = stage.func(item)
+            except Exception as e:
+                metrics.incr("stage_failures", stage=stage.name)
+                self.on_error(item, stage.name, e)
+                continue
+            self.emit(result, outbox)
+
+    def work_batches(self, index: int):
+        stage = self.stages[index]
+        inbox = self.queues[index]
+        outbox = self.queues[index + 1] if index + 1 < len(self.queues) else None
+        metrics = get_metrics()
+        stopped = False
+        while not stopped:
+            item = inbox.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            deadline = time.monotonic() + stage.batch_timeout
+            while len(batch) < stage.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = inbox.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    # 处理完手上这一批再退出
+                    stopped = True
+                    break
+                batch.append(item)
+            try:
+                with metrics.timer("stage", stage=stage.name):
+                    results = stage.func(batch)
+            except Exception as e:
+                metrics.incr("stage_failures", len(batch), stage=stage.name)
+                for item in batch:
+                    self.on_error(item, stage.name, e)
+                continue
+            for item, result in zip(batch, results):
+                if isinstance(result, Exception):
+                    metrics.incr("stage_failures", stage=stage.name)
+                    self.on_error(item, stage.name, result)
+                    continue
+                self.emit(result, outbox)
+
+    def emit(self, result: Any, outbox: Optional[queue.Queue]):
+        if result is None:
+            return
+        if outbox is not None:
+            outbox.put(result)
+        else:
+            with self.lock:
+                self.completed += 1
+
+    @staticmethod
+    def default_on_error(item: Any, stage_name: str, e: Exception):
+        print(f"Failed at stage {stage_name} for {item}, error: {e}")
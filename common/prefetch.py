@@ -0,0 +1,22 @@
+import asyncio
+import itertools
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterable
+
+__ALL__ = ["aiter_prefetched"]
+
+
+async def aiter_prefetched(func: Callable[[Any], Awaitable[Any]], items: Iterable[Any],
+                           prefetch: int) -> AsyncIterator[Any]:
+    # 按 items 的顺序产出 func(item), 最多提前启动 prefetch 个 task; 调用方停止迭代时取消还没完成的 task
+    items = iter(items)
+    tasks = deque(asyncio.ensure_future(func(item)) for item in itertools.islice(items, max(prefetch, 1)))
+    try:
+        while tasks:
+            task = tasks.popleft()
+            for item in itertools.islice(items, 1):
+                tasks.append(asyncio.ensure_future(func(item)))
+            yield await task
+    finally:
+        for task in tasks:
+            task.cancel()
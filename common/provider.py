@@ -0,0 +1,263 @@
+import abc
+import asyncio
+import dataclasses
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+PROVIDER_BUDGET = 10.0  # 单个数据源的默认耗时上限(秒), 超时的数据源结果被忽略
+PROVIDER_WORKERS = 16  # 并行查询多个数据源的线程数
+MODE_RACE = "race"  # 同时查询所有数据源, 取最先返回的结果
+MODE_FALLBACK = "fallback"  # 按优先级依次查询, 前一个失败或超时再查下一个
+
+__ALL__ = ["Provider", "StagedProvider", "ProviderGroup", "ProviderRegistry", "merge_records"]
+
+
+class Provider:
+    __name__ = "Generic Provider"
+    __id__ = "generic"
+    __kind__ = ""  # book / movie
+
+    @abc.abstractmethod
+    def search(
+            self, query: str, generic_cover: str = "", locale: str = "cn"
+    ) -> Optional[List[Any]]:
+        pass
+
+    @abc.abstractmethod
+    def search_one(
+            self, query: str, generic_cover: str = "", locale: str = "cn"
+    ) -> Optional[Any]:
+        pass
+
+    async def asearch(
+            self, query: str, generic_cover: str = "", locale: str = "cn"
+    ) -> Optional[List[Any]]:
+        # 没有异步实现的数据源放到默认线程池里执行
+        return await asyncio.get_running_loop().run_in_executor(None, self.search, query)
+
+    async def asearch_one(
+            self, query: str, generic_cover: str = "", locale: str = "cn"
+    ) -> Optional[Any]:
+        return await asyncio.get_running_loop().run_in_executor(None, self.search_one, query)
+
+    def seed(self, query: str, record: Any):
+        # 导入之前导出的记录; 没有缓存的数据源忽略
+        pass
+
+
+# 能拆成 搜索详情页地址 / 下载详情页 / 解析详情页 三步的数据源, 同步流水线会分阶段调用
+class StagedProvider(Provider):
+
+    @abc.abstractmethod
+    def search_urls(self, query: str) -> List[str]:
+        pass
+
+    @abc.abstractmethod
+    def fetch(self, url: str) -> Optional[bytes]:
+        pass
+
+    @abc.abstractmethod
+    def parse(self, url: str, content: bytes) -> Optional[Any]:
+        pass
+
+    @abc.abstractmethod
+    def cached(self, url: str) -> Optional[Any]:
+        pass
+
+    def batch_parser(self) -> Optional[Callable[[List[Tuple[str, bytes]]], List[Any]]]:
+        # 可以放到子进程里执行的批量解析函数, 必须是模块级函数且不访问缓存; 返回 None 时只在线程里解析
+        return None
+
+    def store(self, url: str, record: Any) -> Any:
+        # 子进程解析出的记录回到主进程后写入缓存
+        return record
+
+    def verify(self, query: str, record: Any) -> bool:
+        # 查询是 ISBN / IMDb 等编号时检查详情页上的编号是否一致, 不一致时流水线继续尝试后面的搜索结果
+        return True
+
+
+def is_empty(value: Any) -> bool:
+    return value is None or value == "" or value == [] or value == {}
+
+
+def merge_records(primary: Any, others: List[Any]) -> Any:
+    # 以 primary 为准, 只补齐它缺失的字段; identifiers 取并集
+    merged = dataclasses.replace(primary)
+    for field in dataclasses.fields(primary):
+        value = getattr(merged, field.name)
+        if isinstance(value, dict):
+            combined = {}
+            for other in reversed(others):
+                other_value = getattr(other, field.name, None)
+                if isinstance(other_value, dict):
+                    combined.update(other_value)
+            combined.update(value)
+            setattr(merged, field.name, combined)
+        elif is_empty(value):
+            for other in others:
+                other_value = getattr(other, field.name, None)
+                if not is_empty(other_value):
+                    setattr(merged, field.name, other_value)
+                    break
+    return merged
+
+
+@dataclasses.dataclass
+class RegisteredProvider:
+    provider: Provider
+    budget: float = PROVIDER_BUDGET
+    priority: int = 0
+
+
+class ProviderGroup(Provider):
+
+    def __init__(self, entries: List[RegisteredProvider], mode: str = MODE_RACE,
+                 executor: Optional[ThreadPoolExecutor] = None):
+        if mode not in (MODE_RACE, MODE_FALLBACK):
+            raise ValueError(f"unknown provider mode {mode}")
+        self.entries = sorted(entries, key=lambda entry: -entry.priority)
+        self.mode = mode
+        self.executor = executor or ThreadPoolExecutor(max_workers=PROVIDER_WORKERS,
+                                                       thread_name_prefix='provider_group')
+
+    def search(
+            self, query: str, generic_cover: str = "", locale: str = "cn"
+    ) -> Optional[List[Any]]:
+        records = []
+        for _, result in self.gather(lambda provider: provider.search(query)):
+            records.extend(result or [])
+        return records
+
+    def search_one(
+            self, query: str, generic_cover: str = "", locale: str = "cn"
+    ) -> Optional[Any]:
+        if self.mode == MODE_FALLBACK:
+            return self.fallback(query)
+        return self.race(query)
+
+    def gather(self, call: Callable[[Provider], Any]) -> List[Any]:
+        started_at = time.monotonic()
+        futures = {self.executor.submit(call, entry.provider): entry for entry in self.entries}
+        results = []
+        for future, entry in futures.items():
+            remaining = entry.budget - (time.monotonic() - started_at)
+            try:
+                results.append((entry, future.result(timeout=max(remaining, 0))))
+            except Exception as e:
+                print(f"Provider {entry.provider.__id__} failed, error: {e!r}")
+        return results
+
+    def fallback(self, query: str) -> Optional[Any]:
+        for entry in self.entries:
+            future = self.executor.submit(entry.provider.search_one, query)
+            try:
+                record = future.result(timeout=entry.budget)
+            except Exception as e:
+                print(f"Provider {entry.provider.__id__} failed, error: {e!r}")
+                continue
+            if record is not None:
+                return record
+        return None
+
+    def race(self, query: str) -> Optional[Any]:
+        # 第一个有效结果胜出, 同时已经返回的其他结果用来补齐缺失字段; 超出预算的数据源直接放弃
+        started_at = time.monotonic()
+        pending = {self.executor.submit(entry.provider.search_one, query): entry for entry in self.entries}
+        winner, others = None, []
+        while pending and winner is None:
+            now = time.monotonic() - started_at
+            for future in [future for future, entry in pending.items() if entry.budget <= now]:
+                pending.pop(future)
+                future.cancel()
+            if not pending:
+                break
+            timeout = min(entry.budget for entry in pending.values()) - now
+            done, _ = wait(pending, timeout=max(timeout, 0), return_when=FIRST_COMPLETED)
+            for future in sorted(done, key=lambda f: -pending[f].priority):
+                entry = pending.pop(future)
+                try:
+                    record = future.result()
+                except Exception as e:
+                    print(f"Provider {entry.provider.__id__} failed, error: {e!r}")
+                    continue
+                if record is None:
+                    continue
+                if winner is None:
+                    winner = record
+                else:
+                    others.append(record)
+        for future in list(pending):
+            if future.done() and not future.exception() and future.result() is not None:
+                others.append(future.result())
+            else:
+                future.cancel()
+        if winner is None:
+            return None
+        return merge_records(winner, others) if others else winner
+
+    async def asearch_one(
+            self, query: str, generic_cover: str = "", locale: str = "cn"
+    ) -> Optional[Any]:
+        if self.mode == MODE_FALLBACK:
+            for entry in self.entries:
+                try:
+                    record = await asyncio.wait_for(entry.provider.asearch_one(query), entry.budget)
+                except Exception as e:
+                    print(f"Provider {entry.provider.__id__} failed, error: {e!r}")
+                    continue
+                if record is not None:
+                    return record
+            return None
+        tasks = [asyncio.ensure_future(asyncio.wait_for(entry.provider.asearch_one(query), entry.budget))
+                 for entry in self.entries]
+        winner, others = None, []
+        try:
+            for task in asyncio.as_completed(tasks):
+                try:
+                    record = await task
+                except Exception:
+                    continue
+                if record is None:
+                    continue
+                if winner is None:
+                    winner = record
+                    break
+        finally:
+            for task in tasks:
+                if task.done() and not task.cancelled() and not task.exception() and task.result() is not None \
+                        and task.result() is not winner:
+                    others.append(task.result())
+                task.cancel()
+        if winner is None:
+            return None
+        return merge_records(winner, others) if others else winner
+
+
+class ProviderRegistry:
+
+    def __init__(self, mode: str = MODE_RACE):
+        self.mode = mode
+        self.entries: Dict[str, List[RegisteredProvider]] = {}
+        self.groups: Dict[str, Provider] = {}
+        self.lock = threading.Lock()
+
+    def register(self, kind: str, provider: Provider, budget: float = PROVIDER_BUDGET, priority: int = 0):
+        with self.lock:
+            self.entries.setdefault(kind, []).append(RegisteredProvider(provider, budget, priority))
+            self.groups.pop(kind, None)
+
+    def provider(self, kind: str) -> Provider:
+        # 只有一个数据源时直接返回它, 这样同步流水线仍然可以分阶段调用
+        with self.lock:
+            entries = self.entries.get(kind)
+            if not entries:
+                raise LookupError(f"no provider registered for {kind}")
+            if len(entries) == 1:
+                return entries[0].provider
+            group = self.groups.get(kind)
+            if group is None:
+                group = self.groups[kind] = ProviderGroup(entries, self.mode)
+            return group
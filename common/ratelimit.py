@@ -0,0 +1,88 @@
+import asyncio
+import threading
+import time
+from typing import Dict
+
+RATE_LIMIT_RATE = 2.0  # 每个域名初始每秒请求数
+RATE_LIMIT_BURST = 4  # 允许的突发请求数
+RATE_LIMIT_MIN_RATE = 0.2  # 被限流后最低降到的速率
+RATE_LIMIT_MAX_RATE = 5.0  # 恢复时最高升到的速率
+RATE_LIMIT_DECREASE = 0.5  # 被限流时速率乘以该系数
+RATE_LIMIT_INCREASE = 0.05  # 每个正常响应速率增加的值
+
+__ALL__ = ["TokenBucket", "AdaptiveTokenBucket", "get_rate_limiter", "set_rate_limiter"]
+
+
+class TokenBucket:
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, tokens: float = 1) -> float:
+        # 预先扣除令牌, 返回需要等待的秒数; 令牌可以为负, 后来者排在后面等待
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            self.tokens -= tokens
+            if self.tokens >= 0:
+                return 0
+            return -self.tokens / self.rate
+
+    def acquire(self, tokens: float = 1):
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def aacquire(self, tokens: float = 1):
+        wait = self.reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds: float):
+        # 服务端要求等待时(如 Retry-After), 让所有调用方至少等待 seconds 秒
+        with self.lock:
+            self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+# AIMD: 被限流时速率减半并清空令牌, 正常响应时缓慢加速
+class AdaptiveTokenBucket(TokenBucket):
+
+    def __init__(self, rate: float = RATE_LIMIT_RATE, burst: float = RATE_LIMIT_BURST,
+                 min_rate: float = RATE_LIMIT_MIN_RATE, max_rate: float = RATE_LIMIT_MAX_RATE,
+                 decrease: float = RATE_LIMIT_DECREASE, increase: float = RATE_LIMIT_INCREASE):
+        super().__init__(rate, burst)
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.decrease = decrease
+        self.increase = increase
+
+    def on_throttle(self):
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self.tokens = min(self.tokens, 0)
+
+    def on_success(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+
+_limiters: Dict[str, AdaptiveTokenBucket] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(host: str) -> AdaptiveTokenBucket:
+    with _limiters_lock:
+        limiter = _limiters.get(host)
+        if limiter is None:
+            limiter = _limiters[host] = AdaptiveTokenBucket()
+        return limiter
+
+
+def set_rate_limiter(host: str, limiter: AdaptiveTokenBucket):
+    with _limiters_lock:
+        _limiters[host] = limiter
@@ -0,0 +1,51 @@
+import dataclasses
+import sys
+from typing import Any, Dict, Generic, Iterable, Iterator, List, Optional, Type, TypeVar
+
+T = TypeVar("T")
+
+__ALL__ = ["RecordBatch", "intern_text", "intern_list"]
+
+
+def intern_text(value: Optional[str]) -> Optional[str]:
+    # 作者、演员、标签、出版社等在大量记录间重复, 驻留后只保留一份
+    if not value:
+        return value
+    return sys.intern(value)
+
+
+def intern_list(values: Iterable[str]) -> List[str]:
+    return [intern_text(value) for value in values]
+
+
+class RecordBatch(Generic[T]):
+    # 按列保存同一类型的记录, 批量导出、比较时不必为每条记录创建对象
+
+    def __init__(self, record_type: Type[T], records: Iterable[T] = ()):
+        self.record_type = record_type
+        self.names = [field.name for field in dataclasses.fields(record_type)]
+        self.columns: Dict[str, List[Any]] = {name: [] for name in self.names}
+        self.size = 0
+        self.extend(records)
+
+    def append(self, record: T):
+        for name in self.names:
+            self.columns[name].append(getattr(record, name))
+        self.size += 1
+
+    def extend(self, records: Iterable[T]):
+        for record in records:
+            self.append(record)
+
+    def column(self, name: str) -> List[Any]:
+        return self.columns[name]
+
+    def row(self, index: int) -> T:
+        return self.record_type(**{name: self.columns[name][index] for name in self.names})
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __iter__(self) -> Iterator[T]:
+        for index in range(self.size):
+            yield self.row(index)
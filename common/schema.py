@@ -0,0 +1,135 @@
+import re
+import threading
+import unicodedata
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from common.notion import NotionWriter
+
+SCHEMA_OPTION_TYPES = ("select", "multi_select")
+# 作者前的国籍、译者等标注, 例如 [日]、(美)、【英】、〔法〕、译者:
+SCHEMA_PREFIX_PATTERN = re.compile(r"^(?:[\[(【〔][^\])】〕]{1,4}[\])】〕]|译者?\s*[:：])\s*")
+SCHEMA_SPACE_PATTERN = re.compile(r"\s+")
+
+__ALL__ = ["OptionIndex", "normalize_option"]
+
+
+def normalize_option(value: Optional[str]) -> str:
+    # 全角转半角, 去掉国籍、译者标注, 合并空白; Notion 的选项名不能包含逗号
+    if not value:
+        return ""
+    value = unicodedata.normalize("NFKC", value)
+    value = SCHEMA_PREFIX_PATTERN.sub("", value.strip())
+    value = value.replace(",", " ")
+    return SCHEMA_SPACE_PATTERN.sub(" ", value).strip()
+
+
+def option_key(value: str) -> str:
+    return normalize_option(value).casefold()
+
+
+class OptionIndex:
+    # 数据库里 select / multi_select 已有选项的本地索引, 写入前把取值统一成已有的写法
+
+    def __init__(self, client, database_id: str, property_names: Optional[Iterable[str]] = None,
+                 writer: Optional[NotionWriter] = None):
+        self.client = client
+        self.writer = writer  # 给出时请求经过 writer 的限流和重试
+        self.database_id = database_id
+        self.property_names = set(property_names) if property_names is not None else None
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()  # 同时只发一个 databases.update, 避免并发更新互相覆盖选项列表
+        self.types: Dict[str, str] = {}
+        self.options: Dict[str, List[Dict[str, Any]]] = {}
+        self.names: Dict[str, Dict[str, str]] = {}
+        self.pending: Dict[str, Dict[str, str]] = {}
+        self.load()
+
+    def load(self):
+        self.index(self.request(self.client.databases.retrieve, database_id=self.database_id))
+
+    def index(self, resp: Dict[str, Any]):
+        # resp 为 databases.retrieve / databases.update 返回的数据库对象
+        with self.lock:
+            for name, prop in resp["properties"].items():
+                kind = prop.get("type")
+                if kind not in SCHEMA_OPTION_TYPES:
+                    continue
+                if self.property_names is not None and name not in self.property_names:
+                    continue
+                options = prop[kind].get("options", [])
+                self.types[name] = kind
+                self.options[name] = options
+                names = {}
+                for option in options:
+                    names.setdefault(option_key(option["name"]), option["name"])
+                self.names[name] = names
+                # 已经出现在数据库里的选项不再重复添加
+                pending = self.pending.get(name, {})
+                for key in names:
+                    pending.pop(key, None)
+
+    def request(self, func: Callable[..., Any], **kwargs) -> Any:
+        if self.writer is not None:
+            return self.writer.call(func, "notion_schema", **kwargs)
+        return func(**kwargs)
+
+    def canonical(self, property_name: str, value: Optional[str]) -> Optional[str]:
+        normalized = normalize_option(value)
+        if not normalized:
+            return None
+        key = normalized.casefold()
+        with self.lock:
+            names = self.names.setdefault(property_name, {})
+            if key not in names:
+                names[key] = normalized
+                self.pending.setdefault(property_name, {})[key] = normalized
+            return names[key]
+
+    def apply(self, properties: Dict[str, Any]) -> Dict[str, Any]:
+        # 返回新的属性字典, 选项名换成索引中的写法, multi_select 去重并保持顺序
+        result = dict(properties)
+        for name, kind in self.types.items():
+            value = properties.get(name)
+            if not isinstance(value, dict) or kind not in value:
+                continue
+            if kind == "select":
+                option = self.canonical(name, (value[kind] or {}).get("name"))
+                result[name] = {**value, kind: {"name": option} if option else None}
+            else:
+                options = []
+                for item in value[kind] or []:
+                    option = self.canonical(name, item.get("name"))
+                    if option and option not in options:
+                        options.append(option)
+                result[name] = {**value, kind: [{"name": option} for option in options]}
+        return result
+
+    def flush(self) -> int:
+        # 在使用新选项的页面写入之前调用, 一次 databases.update 建好这一批页面新增的所有选项;
+        # 否则 Notion 会在每个页面写入时逐个创建选项
+        with self.flush_lock:
+            with self.lock:
+                properties = {}
+                added = 0
+                for name, pending in self.pending.items():
+                    if not pending:
+                        continue
+                    kind = self.types[name]
+                    options = [{"id": option["id"]} if "id" in option else {"name": option["name"]}
+                               for option in self.options.get(name, [])]
+                    options.extend({"name": option} for option in pending.values())
+                    properties[name] = {kind: {"options": options}}
+                    added += len(pending)
+                pending, self.pending = self.pending, {}
+            if properties:
+                try:
+                    resp = self.request(self.client.databases.update, database_id=self.database_id,
+                                        properties=properties)
+                except Exception:
+                    # 放回待建选项, 下一批再试
+                    with self.lock:
+                        for name, options in pending.items():
+                            self.pending.setdefault(name, {}).update(options)
+                    raise
+                # 返回的数据库对象带上了新选项的 id, 下次更新时保留
+                self.index(resp)
+            return added
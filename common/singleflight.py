@@ -0,0 +1,79 @@
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+from common.metrics import get_metrics
+
+__ALL__ = ["SingleFlight"]
+
+
+class Call:
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class AsyncCall:
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+# 相同 key 的并发调用只执行一次, 其余调用等待并拿到同一个结果(或同一个异常)
+class SingleFlight:
+
+    def __init__(self, name: str = ""):
+        self.name = name
+        self.lock = threading.Lock()
+        self.calls: Dict[Hashable, Call] = {}
+        self.acalls: Dict[Hashable, AsyncCall] = {}
+
+    def do(self, key: Hashable, func: Callable[..., Any], *args, **kwargs) -> Any:
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = Call()
+        if not leader:
+            get_metrics().incr("singleflight_shared", flight=self.name)
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = func(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.event.set()
+
+    async def ado(self, key: Hashable, func: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        # 只在同一个事件循环内合并; 共享的调用在独立的 task 里执行, 某个调用方被取消不影响其他调用方,
+        # 所有调用方都取消后才取消这个 task
+        call = self.acalls.get(key)
+        if call is None:
+            call = self.acalls[key] = AsyncCall(asyncio.ensure_future(func(*args, **kwargs)))
+            call.task.add_done_callback(lambda task: self.finish(key, call))
+        else:
+            get_metrics().incr("singleflight_shared", flight=self.name)
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                self.finish(key, call)
+                call.task.cancel()
+
+    def finish(self, key: Hashable, call: AsyncCall):
+        if self.acalls.get(key) is call:
+            del self.acalls[key]
+        if call.task.done() and not call.task.cancelled():
+            # 没有调用方等待时避免 "exception was never retrieved" 警告
+            call.task.exception()
@@ -0,0 +1,174 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+SYNC_STATE_PATH = os.environ.get("SYNC_STATE_PATH", os.path.join(".cache", "sync_state.sqlite3"))
+SYNC_REFRESH_INTERVAL = 30 * 24 * 3600  # 同步成功的页面每隔多久重新刷新一次
+SYNC_RETRY_BASE = 3600  # 失败页面第一次重试前的等待秒数, 之后每次翻倍
+SYNC_RETRY_MAX = 7 * 24 * 3600  # 失败重试的最长间隔
+
+STATUS_OK = "ok"
+STATUS_FAILED = "failed"
+STATUS_PENDING = "pending"  # 已进入流水线还没有结果, 任务中断后下次运行优先处理
+
+__ALL__ = ["SyncStateStore"]
+
+
+class SyncStateStore:
+
+    def __init__(self, path: str = SYNC_STATE_PATH, refresh_interval: float = SYNC_REFRESH_INTERVAL,
+                 retry_base: float = SYNC_RETRY_BASE, retry_max: float = SYNC_RETRY_MAX):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.refresh_interval = refresh_interval
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            " page_id TEXT PRIMARY KEY,"
+            " database_id TEXT NOT NULL,"
+            " name TEXT,"
+            " identifier TEXT,"
+            " subject_id TEXT,"
+            " content_hash TEXT,"
+            " status TEXT,"
+            " failures INTEGER NOT NULL DEFAULT 0,"
+            " error TEXT,"
+            " last_attempt REAL,"
+            " last_success REAL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS pages_refresh ON pages (database_id, status, last_success)")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS runs ("
+            " database_id TEXT PRIMARY KEY,"
+            " last_run REAL NOT NULL)")
+        # 查询数据库的游标位置, 中断后从这里继续; query_key 为查询条件的摘要, 条件变化时游标作废
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS checkpoints ("
+            " database_id TEXT PRIMARY KEY,"
+            " query_key TEXT NOT NULL,"
+            " cursor TEXT NOT NULL,"
+            " updated_at REAL NOT NULL)")
+
+    def should_sync(self, page_id: str, identifier: str, now: Optional[float] = None, force: bool = False) -> bool:
+        # force 为 True 时 (例如页面封面为空) 不等待定期刷新, 但连续失败的页面仍按退避间隔重试
+        now = now or time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT identifier, status, failures, last_attempt, last_success FROM pages "
+                                    "WHERE page_id = ?", (page_id,)).fetchone()
+        if row is None:
+            return True
+        last_identifier, status, failures, last_attempt, last_success = row
+        if last_identifier != str(identifier):
+            return True
+        if status == STATUS_PENDING:
+            return True
+        if status == STATUS_FAILED:
+            # 连续失败的页面按指数退避重试
+            delay = min(self.retry_max, self.retry_base * (2 ** max(failures - 1, 0)))
+            return now >= (last_attempt or 0) + delay
+        return force or now >= (last_success or 0) + self.refresh_interval
+
+    def content_hash(self, page_id: str) -> Optional[str]:
+        with self.lock:
+            row = self.conn.execute("SELECT content_hash FROM pages WHERE page_id = ?", (page_id,)).fetchone()
+        return row[0] if row else None
+
+    def record_success(self, database_id: str, page_id: str, name: str, identifier: str,
+                       subject_id: Optional[str], content_hash: str):
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO pages (page_id, database_id, name, identifier, subject_id, content_hash, status,"
+                " failures, error, last_attempt, last_success) VALUES (?, ?, ?, ?, ?, ?, ?, 0, NULL, ?, ?)"
+                " ON CONFLICT(page_id) DO UPDATE SET database_id = excluded.database_id, name = excluded.name,"
+                " identifier = excluded.identifier, subject_id = excluded.subject_id,"
+                " content_hash = excluded.content_hash, status = excluded.status, failures = 0, error = NULL,"
+                " last_attempt = excluded.last_attempt, last_success = excluded.last_success",
+                (page_id, database_id, name, str(identifier), subject_id, content_hash, STATUS_OK, now, now))
+
+    def record_failure(self, database_id: str, page_id: str, name: str, identifier: str, error: str):
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO pages (page_id, database_id, name, identifier, status, failures, error, last_attempt)"
+                " VALUES (?, ?, ?, ?, ?, 1, ?, ?)"
+                " ON CONFLICT(page_id) DO UPDATE SET database_id = excluded.database_id, name = excluded.name,"
+                " failures = CASE WHEN pages.identifier = excluded.identifier THEN pages.failures + 1 ELSE 1 END,"
+                " identifier = excluded.identifier, status = excluded.status, error = excluded.error,"
+                " last_attempt = excluded.last_attempt",
+                (page_id, database_id, name, str(identifier), STATUS_FAILED, error, now))
+
+    def record_pending(self, database_id: str, page_id: str, name: str, identifier: str):
+        # 只改状态, 保留上次成功写入的摘要和失败次数
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO pages (page_id, database_id, name, identifier, status) VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT(page_id) DO UPDATE SET database_id = excluded.database_id, name = excluded.name,"
+                " identifier = excluded.identifier, status = excluded.status",
+                (page_id, database_id, name, str(identifier), STATUS_PENDING))
+
+    def pending_pages(self, database_id: str) -> Iterator[Tuple[str, str, str]]:
+        # 上次运行中断时还在处理中的页面 (page_id, name, identifier)
+        with self.lock:
+            rows = self.conn.execute("SELECT page_id, name, identifier FROM pages WHERE database_id = ?"
+                                     " AND status = ?", (database_id, STATUS_PENDING)).fetchall()
+        return iter(rows)
+
+    def dead_letters(self, database_id: str) -> Iterator[Tuple[str, str, str, int, str, float]]:
+        # 同步失败的页面 (page_id, name, identifier, failures, error, last_attempt), 最近失败的在前
+        with self.lock:
+            rows = self.conn.execute("SELECT page_id, name, identifier, failures, error, last_attempt FROM pages"
+                                     " WHERE database_id = ? AND status = ? ORDER BY last_attempt DESC",
+                                     (database_id, STATUS_FAILED)).fetchall()
+        return iter(rows)
+
+    @staticmethod
+    def query_key(query_filter: Optional[Dict[str, Any]]) -> str:
+        data = json.dumps(query_filter, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+    def load_cursor(self, database_id: str, query_key: str) -> Optional[str]:
+        with self.lock:
+            row = self.conn.execute("SELECT cursor FROM checkpoints WHERE database_id = ? AND query_key = ?",
+                                    (database_id, query_key)).fetchone()
+        return row[0] if row else None
+
+    def save_cursor(self, database_id: str, query_key: str, cursor: str):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO checkpoints (database_id, query_key, cursor, updated_at)"
+                              " VALUES (?, ?, ?, ?)", (database_id, query_key, cursor, time.time()))
+
+    def clear_cursor(self, database_id: str):
+        with self.lock:
+            self.conn.execute("DELETE FROM checkpoints WHERE database_id = ?", (database_id,))
+
+    def stale_pages(self, database_id: str, now: Optional[float] = None) -> Iterator[Tuple[str, str, str]]:
+        # 返回需要定期刷新的页面 (page_id, name, identifier)
+        now = now or time.time()
+        with self.lock:
+            rows = self.conn.execute("SELECT page_id, name, identifier FROM pages WHERE database_id = ?"
+                                     " AND status = ? AND last_success < ?",
+                                     (database_id, STATUS_OK, now - self.refresh_interval)).fetchall()
+        return iter(rows)
+
+    def last_run(self, database_id: str) -> Optional[float]:
+        with self.lock:
+            row = self.conn.execute("SELECT last_run FROM runs WHERE database_id = ?", (database_id,)).fetchone()
+        return row[0] if row else None
+
+    def mark_run(self, database_id: str, started_at: float):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO runs (database_id, last_run) VALUES (?, ?)",
+                              (database_id, started_at))
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
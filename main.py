@@ -1,13 +1,62 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
 import os
+import re
+import sys
+import time
 import dataclasses
 from book import DoubanBookProvider, MetaRecord
 from movie import DoubanaMovieProvider, MovieMetaRecord
-from notion_client import Client as NotionClient
-from typing import List, Dict, Any
+from common import iter_database_pages, aiter_database_pages, close_async_client, configure_async_client, get_transport, NotionWriter, Pipeline, Stage, SyncStateStore, \
+    Provider, ProviderRegistry, StagedProvider, CoverStore, open_exporter, iter_exported, \
+    OptionIndex, get_metrics, start_metrics_server, configure_transport, PageCache, get_page_cache
+from common.state import SYNC_STATE_PATH
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from notion_client import AsyncClient as AsyncNotionClient, Client as NotionClient
+from urllib.parse import urlparse
+from typing import AsyncIterator, Callable, Iterable, Iterator, Dict, Any, List, Optional, Union
 
 BOOK_DATABASE_ID = ""  # 读书笔记对应到数据库id
 MOVIE_DATABASE_ID = ""
 NOTION_TOKEN = ""  # 自己的integrations的token
+# 流水线各阶段的并发数: 豆瓣搜索, 详情页下载, 页面解析, Notion 更新
+SYNC_CONCURRENCY = {
+    "search": 2,
+    "fetch": 5,
+    "parse": 2,
+    "update": 3,
+    "lookup": 5,  # 配置了多个数据源时, 搜索/下载/解析合并为一个阶段
+    "cover": 4,  # 封面下载, 只在配置了 CoverStore 时启用
+}
+SYNC_PARSE_PROCESSES = 0  # 解析进程数, 0 表示在解析线程里直接解析
+SYNC_PARSE_BATCH = 8  # 交给解析进程时每批的页面数, 减少进程间传输的次数
+SYNC_SCHEMA_BATCH = 20  # 统一选项写法时每批写入的页面数, 每批新增的选项用一次 databases.update 建好
+SYNC_SCHEMA_BATCH_TIMEOUT = 1.0  # 凑满一批的最长等待秒数
+ASYNC_SYNC_CONCURRENCY = 100  # 异步模式下同时进行的查询数
+BOOK_QUERY_FILTER = {
+    "property": "Cover",  # 封面列的名称
+    "files": {
+        "is_empty": True
+    }
+}
+MOVIE_QUERY_FILTER = {
+    "property": "封面",  # 封面列的名称
+    "files": {
+        "is_empty": True
+    }
+}
+# 由 OptionIndex 统一选项写法的 select / multi_select 列
+BOOK_OPTION_PROPERTIES = ("Authors", "Publisher", "Tags")
+MOVIE_OPTION_PROPERTIES = ("主演", "导演", "国家", "标签")
+CLI_PARALLEL_JOBS = 4  # 同时同步的数据库数
+CLI_REQUEST_BUDGET = 10  # 所有数据库合计同时进行的豆瓣请求数
+DEAD_LETTER_REPORT_LIMIT = 20  # 运行结束时最多列出多少条失败记录
+CONVERT_STAGE = "convert"  # 读取 Notion 行失败时记入失败列表的阶段名, 重试时重新读取这些页面
+SUBJECT_URL_PATTERN = re.compile(".*/subject/(\\d+)/?")
+# 原始页面缓存中详情页所属的域名, 离线重新解析时据此选择解析器
+REPARSE_HOSTS = {"book.douban.com": "book", "movie.douban.com": "movie"}
 
 
 @dataclasses.dataclass
@@ -15,6 +64,10 @@ class BookEmptyPage:
     page_id: str
     book_name: str
     isbn: str
+    # 查询时返回的页面属性, 用于写入前比较; 来自同步状态库的页面为空
+    properties: Dict[str, Any] = dataclasses.field(default_factory=dict, repr=False)
+    # 封面为空的页面不论同步状态如何都要处理
+    force: bool = False
 
 
 @dataclasses.dataclass
@@ -22,6 +75,22 @@ class MovieEmptyPage:
     page_id: str
     movie_name: str
     imdb: str
+    properties: Dict[str, Any] = dataclasses.field(default_factory=dict, repr=False)
+    force: bool = False
+
+
+@dataclasses.dataclass
+class SyncTask:
+    page_id: str
+    name: str
+    query: str
+    database_id: str = ""
+    properties: Dict[str, Any] = dataclasses.field(default_factory=dict, repr=False)
+    force: bool = False
+    urls: List[str] = dataclasses.field(default_factory=list)
+    url: Optional[str] = None
+    content: Optional[bytes] = dataclasses.field(default=None, repr=False)
+    record: Optional[Union[MetaRecord, MovieMetaRecord]] = dataclasses.field(default=None, repr=False)
 
 
 def gen_book_properties(meta: MetaRecord) -> Dict[Any, Any]:
@@ -103,68 +172,906 @@ def gen_movie_properties(meta: MovieMetaRecord) -> Dict[Any, Any]:
     }
 
 
-def sync_movie_info(movies: List[MovieEmptyPage], provider: DoubanaMovieProvider, nc: NotionClient) -> int:
-    for movie in movies:
-        try:
-            movie_mata_record = provider.search_one(query=movie.imdb)
-            properties = gen_movie_properties(movie_mata_record)
-            nc.pages.update(page_id=movie.page_id, **properties)
-            print(f"Synced {movie.movie_name}")
-        except Exception as e:
-            print(f"Failed to sync {movie.movie_name}, error: {e}")
-    return len(movies)
+def default_registry() -> ProviderRegistry:
+    registry = ProviderRegistry()
+    registry.register("book", DoubanBookProvider())
+    registry.register("movie", DoubanaMovieProvider())
+    return registry
 
 
-def sync_book_info(books: List[BookEmptyPage], provider: DoubanBookProvider, nc: NotionClient) -> int:
-    for book in books:
-        try:
-            book_mata_record = provider.search_one(query=book.isbn)
-            properties = gen_book_properties(book_mata_record)
-            nc.pages.update(page_id=book.page_id, **properties)
-            print(f"Synced {book.book_name}")
-        except Exception as e:
-            print(f"Failed to sync {book.book_name}, error: {e}")
-    return len(books)
+class ParsePool(ProcessPoolExecutor):
 
+    def __init__(self, processes: int):
+        # 用 spawn 启动, 避免 fork 时复制其他线程持有的锁和 sqlite 连接
+        super().__init__(max_workers=processes, mp_context=multiprocessing.get_context("spawn"))
+        self.processes = processes
 
-def sync_movie(database_id: str, c: NotionClient):
-    movie_provider = DoubanaMovieProvider()
-    query_filter = {
-        "property": "封面",  # 封面列的名称
-        "files": {
-            "is_empty": True
-        }
-    }
-    page_properites = c.databases.query(database_id=database_id, filter=query_filter)
-    results = page_properites["results"]
-    movies_incomplete = [MovieEmptyPage(
+
+def open_parse_pool(processes: int) -> Optional[ParsePool]:
+    if processes <= 0:
+        return None
+    return ParsePool(processes)
+
+
+def sync_info(tasks: Iterable[SyncTask], provider: Provider,
+              nc: NotionClient, gen_properties: Callable[[Any], Dict[Any, Any]],
+              concurrency: Optional[Dict[str, int]] = None, writer: Optional[NotionWriter] = None,
+              state: Optional[SyncStateStore] = None, covers: Optional[CoverStore] = None,
+              exporter: Optional[Any] = None, schema: Optional[OptionIndex] = None,
+              parse_pool: Optional[ParsePool] = None) -> int:
+    concurrency = {**SYNC_CONCURRENCY, **(concurrency or {})}
+    writer = writer or NotionWriter(nc, concurrency=concurrency["update"])
+    # 搜索和下载两个阶段共用豆瓣的连接池
+    get_transport().ensure_pool_size(concurrency["search"] + concurrency["fetch"])
+    if state is not None:
+        tasks = select_tasks(tasks, state)
+
+    def search(task: SyncTask) -> SyncTask:
+        task.urls = provider.search_urls(task.query)
+        if not task.urls:
+            raise LookupError(f"no result for {task.query}")
+        return task
+
+    def fetch(task: SyncTask) -> SyncTask:
+        # 按搜索结果顺序下载, 拿到第一个可用的详情页即可; 已缓存的条目跳过下载和解析
+        for url in task.urls:
+            record = provider.cached(url)
+            if record is not None:
+                task.url, task.record = url, record
+                return task
+            content = provider.fetch(url)
+            if content is not None:
+                task.url, task.content = url, content
+                return task
+        raise LookupError(f"no subject page for {task.query}")
+
+    def parse(task: SyncTask) -> SyncTask:
+        if task.record is None:
+            task.record = provider.parse(task.url, task.content)
+            task.content = None
+        return verify(task)
+
+    def verify(task: SyncTask) -> SyncTask:
+        # 与 search_one 相同: 查询是编号时详情页上的编号对不上就继续尝试后面的搜索结果, 都对不上时保留第一个
+        if task.record is None or provider.verify(task.query, task.record):
+            return task
+        for url in task.urls[task.urls.index(task.url) + 1:]:
+            record = provider.cached(url)
+            if record is None:
+                content = provider.fetch(url)
+                if content is None:
+                    continue
+                record = provider.parse(url, content)
+            if record is not None and provider.verify(task.query, record):
+                get_metrics().incr("identifier_mismatch", result="next")
+                task.url, task.record = url, record
+                return task
+        get_metrics().incr("identifier_mismatch", result="first")
+        return task
+
+    def parse_batch(batch: List[SyncTask]) -> List[Union[SyncTask, Exception]]:
+        # 原始页面整批交给解析进程, 解析结果回到主进程后再写缓存
+        pending = [task for task in batch if task.record is None]
+        if pending:
+            records = parse_pool.submit(batch_parser, [(task.url, task.content) for task in pending]).result()
+            for task, record in zip(pending, records):
+                task.content = None
+                task.record = record if isinstance(record, Exception) else provider.store(task.url, record)
+        results = []
+        for task in batch:
+            if isinstance(task.record, Exception):
+                results.append(task.record)
+                continue
+            try:
+                results.append(verify(task))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def lookup(task: SyncTask) -> SyncTask:
+        task.record = provider.search_one(task.query)
+        if task.record is None:
+            raise LookupError(f"no result for {task.query}")
+        task.url = task.record.url
+        return task
+
+    def cover(task: SyncTask) -> SyncTask:
+        task.record.cover = covers.localize(task.record.cover)
+        return task
+
+    def update(task: SyncTask) -> SyncTask:
+        return write(task, gen_properties(task.record))
+
+    def update_batch(batch: List[SyncTask]) -> List[Union[SyncTask, Exception]]:
+        # 先统一这一批的选项写法并一次建好新选项, 再逐个写入页面
+        payloads = [apply_options(schema, gen_properties(task.record)) for task in batch]
+        flush_options(schema, len(batch))
+        results = []
+        for task, properties in zip(batch, payloads):
+            try:
+                results.append(write(task, properties))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def write(task: SyncTask, properties: Dict[str, Any]) -> SyncTask:
+        updated = writer.update(task.page_id, properties, previous=previous_hash(task, state),
+                                current=task.properties or None)
+        record_written(task, properties, updated, writer, state, exporter)
+        return task
+
+    def on_error(task: SyncTask, stage_name: str, e: Exception):
+        record_failed(task, stage_name, e, state)
+
+    if isinstance(provider, StagedProvider):
+        stages = [
+            Stage("search", search, concurrency["search"]),
+            Stage("fetch", fetch, concurrency["fetch"]),
+        ]
+        batch_parser = provider.batch_parser() if parse_pool is not None else None
+        if batch_parser is not None:
+            # 每个解析线程等待一批的结果, 线程数不少于进程数才能让所有进程同时工作
+            stages.append(Stage("parse", parse_batch, max(concurrency["parse"], parse_pool.processes),
+                                batch_size=SYNC_PARSE_BATCH))
+        else:
+            stages.append(Stage("parse", parse, concurrency["parse"]))
+    else:
+        stages = [Stage("lookup", lookup, concurrency["lookup"])]
+    if covers is not None:
+        stages.append(Stage("cover", cover, concurrency["cover"]))
+    if schema is not None:
+        stages.append(Stage("update", update_batch, concurrency["update"], batch_size=SYNC_SCHEMA_BATCH,
+                            batch_timeout=SYNC_SCHEMA_BATCH_TIMEOUT))
+    else:
+        stages.append(Stage("update", update, concurrency["update"]))
+    return Pipeline(stages, on_error=on_error).run(tasks)
+
+
+def previous_hash(task: SyncTask, state: Optional[SyncStateStore]) -> Optional[str]:
+    # 拿到了页面现有属性时直接与之比较; 只有来自同步状态库的页面才按上次写入的摘要跳过
+    return state.content_hash(task.page_id) if state is not None and not task.properties else None
+
+
+def record_written(task: SyncTask, properties: Dict[str, Any], updated: bool, writer: NotionWriter,
+                   state: Optional[SyncStateStore] = None, exporter: Optional[Any] = None):
+    if updated:
+        get_metrics().incr("pages", result="synced")
+        print(f"Synced {task.name}")
+    else:
+        get_metrics().incr("pages", result="unchanged")
+    if exporter is not None:
+        exporter.write(task.page_id, task.query, task.record)
+    if state is not None:
+        subject_match = SUBJECT_URL_PATTERN.match(task.url or "")
+        state.record_success(task.database_id, task.page_id, task.name, task.query,
+                             subject_match.group(1) if subject_match else None, writer.payload_hash(properties))
+
+
+def record_failed(task: SyncTask, stage_name: str, e: Exception, state: Optional[SyncStateStore] = None):
+    get_metrics().incr("pages", result="failed")
+    print(f"Failed to sync {task.name}, error: {e}")
+    if state is not None:
+        state.record_failure(task.database_id, task.page_id, task.name, task.query, f"{stage_name}: {e}")
+
+
+def apply_options(schema: OptionIndex, properties: Dict[str, Any]) -> Dict[str, Any]:
+    return {**properties, "properties": schema.apply(properties["properties"])}
+
+
+def flush_options(schema: OptionIndex, pages: int):
+    try:
+        schema.flush()
+    except Exception as e:
+        # 建选项失败不影响页面写入, Notion 会在写入页面时创建缺少的选项
+        print(f"Failed to create options for {pages} pages, error: {e!r}")
+
+
+def claim_task(task: SyncTask, state: SyncStateStore, seen: set) -> bool:
+    # 同一页面可能既在查询结果里又需要定期刷新, 只处理一次
+    if task.page_id in seen:
+        return False
+    seen.add(task.page_id)
+    if not state.should_sync(task.page_id, task.query, force=task.force):
+        return False
+    # 先标记为处理中, 任务中断时下次运行会重新处理
+    state.record_pending(task.database_id, task.page_id, task.name, task.query)
+    return True
+
+
+def select_tasks(tasks: Iterable[SyncTask], state: SyncStateStore) -> Iterator[SyncTask]:
+    seen = set()
+    return (task for task in tasks if claim_task(task, state, seen))
+
+
+async def aselect_tasks(tasks: AsyncIterator[SyncTask], state: SyncStateStore) -> AsyncIterator[SyncTask]:
+    seen = set()
+    async for task in tasks:
+        if claim_task(task, state, seen):
+            yield task
+
+
+def sync_movie_info(movies: Iterable[MovieEmptyPage], provider: Provider, nc: NotionClient,
+                    concurrency: Optional[Dict[str, int]] = None, state: Optional[SyncStateStore] = None,
+                    database_id: str = "", writer: Optional[NotionWriter] = None,
+                    covers: Optional[CoverStore] = None, exporter: Optional[Any] = None,
+                    schema: Optional[OptionIndex] = None, parse_pool: Optional[ParsePool] = None) -> int:
+    tasks = (SyncTask(page_id=movie.page_id, name=movie.movie_name, query=movie.imdb, database_id=database_id,
+                      properties=movie.properties, force=movie.force)
+             for movie in movies)
+    return sync_info(tasks, provider, nc, gen_movie_properties, concurrency, writer=writer, state=state,
+                     covers=covers, exporter=exporter, schema=schema, parse_pool=parse_pool)
+
+
+def sync_book_info(books: Iterable[BookEmptyPage], provider: Provider, nc: NotionClient,
+                   concurrency: Optional[Dict[str, int]] = None, state: Optional[SyncStateStore] = None,
+                   database_id: str = "", writer: Optional[NotionWriter] = None,
+                   covers: Optional[CoverStore] = None, exporter: Optional[Any] = None,
+                   schema: Optional[OptionIndex] = None, parse_pool: Optional[ParsePool] = None) -> int:
+    tasks = (SyncTask(page_id=book.page_id, name=book.book_name, query=str(book.isbn), database_id=database_id,
+                      properties=book.properties, force=book.force)
+             for book in books)
+    return sync_info(tasks, provider, nc, gen_book_properties, concurrency, writer=writer, state=state,
+                     covers=covers, exporter=exporter, schema=schema, parse_pool=parse_pool)
+
+
+def movie_imdb(item: Dict[str, Any]) -> str:
+    return item["properties"]["IMDb"]["rich_text"][0]["plain_text"]
+
+
+def book_isbn(item: Dict[str, Any]) -> str:
+    return item["properties"]["ISBN"]["number"]
+
+
+def to_movie_page(item: Dict[str, Any]) -> MovieEmptyPage:
+    return MovieEmptyPage(
         page_id=item["id"],
         movie_name=item["properties"]["Name"]["title"][0]["text"]["content"],
-        imdb=item["properties"]["IMDb"]["rich_text"][0]["plain_text"]) for
-        item in results]
-    print(movies_incomplete)
-    sync_movie_info(movies_incomplete, movie_provider, c)
-
-
-def sync_book(database_id: str, c: NotionClient):
-    book_provider = DoubanBookProvider()
-    query_filter = {
-        "property": "Cover",  # 封面列的名称
-        "files": {
-            "is_empty": True
-        }
-    }
-    page_properites = c.databases.query(database_id=database_id, filter=query_filter)
-    results = page_properites["results"]
-    books_incomplete = [BookEmptyPage(
+        imdb=movie_imdb(item),
+        properties=item["properties"],
+        force=cover_missing(item, MOVIE_QUERY_FILTER))
+
+
+def to_book_page(item: Dict[str, Any]) -> BookEmptyPage:
+    return BookEmptyPage(
         page_id=item["id"],
         book_name=item["properties"]["书名"]["title"][0]["text"]["content"],
-        isbn=item["properties"]["ISBN"]["number"]) for
-        item in results]
-    sync_book_info(books_incomplete, book_provider, c)
+        isbn=book_isbn(item),
+        properties=item["properties"],
+        force=cover_missing(item, BOOK_QUERY_FILTER))
+
+
+def convert_page(item: Dict[str, Any], convert: Callable[[Dict[str, Any]], Any],
+                 identifier: Callable[[Dict[str, Any]], Any], database_id: str,
+                 state: Optional[SyncStateStore] = None) -> Optional[Any]:
+    # 书名、ISBN 等列为空的行跳过并记入失败列表, 不中断整个数据库的同步; 能读到的编号照常记下
+    try:
+        return convert(item)
+    except (KeyError, IndexError, TypeError) as e:
+        name = page_title(item)
+        get_metrics().incr("pages", result="failed")
+        print(f"Failed to read page {name or item.get('id')}, error: {e!r}")
+        if state is not None:
+            state.record_failure(database_id, item.get("id", ""), name, read_identifier(item, identifier),
+                                 f"{CONVERT_STAGE}: {e!r}")
+        return None
+
+
+def read_identifier(item: Dict[str, Any], identifier: Callable[[Dict[str, Any]], Any]) -> str:
+    try:
+        value = identifier(item)
+    except (KeyError, IndexError, TypeError):
+        return ""
+    return "" if value is None else str(value)
+
+
+def page_title(item: Dict[str, Any]) -> str:
+    for prop in (item.get("properties") or {}).values():
+        if isinstance(prop, dict) and prop.get("type") == "title":
+            return "".join(text.get("plain_text", "") for text in prop.get("title") or [])
+    return ""
+
+
+def cover_missing(item: Dict[str, Any], query_filter: Dict[str, Any]) -> bool:
+    # 页面命中 "封面为空" 的查询条件, 封面可能被手动清空过, 需要重新填充
+    return not (item["properties"].get(query_filter["property"]) or {}).get("files")
+
+
+def changed_filter(query_filter: Dict[str, Any], since: Optional[float]) -> Dict[str, Any]:
+    # 增量同步: 除了封面为空的页面, 再加上上次运行之后编辑过的页面
+    if since is None:
+        return query_filter
+    return {
+        "or": [
+            query_filter,
+            {
+                "timestamp": "last_edited_time",
+                "last_edited_time": {
+                    "on_or_after": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(since))
+                }
+            }
+        ]
+    }
+
+
+def iter_query_items(database_id: str, c: NotionClient, query_filter: Dict[str, Any],
+                     state: Optional[SyncStateStore] = None,
+                     writer: Optional[NotionWriter] = None) -> Iterator[Dict[str, Any]]:
+    # 从上次中断时保存的游标继续查询, 每取完一批保存一次
+    if state is None:
+        return iter_database_pages(c, database_id, query_filter, writer=writer)
+    query_key = state.query_key(query_filter)
+    return iter_database_pages(c, database_id, query_filter, start_cursor=state.load_cursor(database_id, query_key),
+                               on_cursor=lambda cursor: state.save_cursor(database_id, query_key, cursor),
+                               writer=writer)
+
+
+def iter_movie_pages(database_id: str, c: NotionClient, state: Optional[SyncStateStore] = None,
+                     writer: Optional[NotionWriter] = None) -> Iterator[MovieEmptyPage]:
+    since = state.last_run(database_id) if state is not None else None
+    if state is not None:
+        for page_id, name, identifier in state.pending_pages(database_id):
+            yield MovieEmptyPage(page_id=page_id, movie_name=name, imdb=identifier)
+    for item in iter_query_items(database_id, c, changed_filter(MOVIE_QUERY_FILTER, since), state, writer):
+        page = convert_page(item, to_movie_page, movie_imdb, database_id, state)
+        if page is not None:
+            yield page
+    if state is not None:
+        for page_id, name, identifier in state.stale_pages(database_id):
+            yield MovieEmptyPage(page_id=page_id, movie_name=name, imdb=identifier)
+
+
+def iter_book_pages(database_id: str, c: NotionClient, state: Optional[SyncStateStore] = None,
+                    writer: Optional[NotionWriter] = None) -> Iterator[BookEmptyPage]:
+    since = state.last_run(database_id) if state is not None else None
+    if state is not None:
+        for page_id, name, identifier in state.pending_pages(database_id):
+            yield BookEmptyPage(page_id=page_id, book_name=name, isbn=identifier)
+    for item in iter_query_items(database_id, c, changed_filter(BOOK_QUERY_FILTER, since), state, writer):
+        page = convert_page(item, to_book_page, book_isbn, database_id, state)
+        if page is not None:
+            yield page
+    if state is not None:
+        for page_id, name, identifier in state.stale_pages(database_id):
+            yield BookEmptyPage(page_id=page_id, book_name=name, isbn=identifier)
+
+
+def sync_movie(database_id: str, c: NotionClient, state: Optional[SyncStateStore] = None,
+               registry: Optional[ProviderRegistry] = None, covers: Optional[CoverStore] = None,
+               export_path: Optional[str] = None, writer: Optional[NotionWriter] = None,
+               concurrency: Optional[Dict[str, int]] = None, dry_run: bool = False,
+               parse_pool: Optional[ParsePool] = None) -> int:
+    movie_provider = (registry or default_registry()).provider("movie")
+    started_at = time.time()
+    if dry_run:
+        # 试运行不写 Notion, 也不更新同步状态, 以免之后的正式运行跳过这些页面
+        state = None
+    writer = writer or NotionWriter(c, dry_run=dry_run)
+    schema = OptionIndex(c, database_id, MOVIE_OPTION_PROPERTIES, writer) if not dry_run else None
+    exporter = open_exporter(export_path, MovieMetaRecord) if export_path else None
+    try:
+        count = sync_movie_info(iter_movie_pages(database_id, c, state, writer), movie_provider, c,
+                                concurrency, state=state, database_id=database_id, writer=writer, covers=covers,
+                                exporter=exporter, schema=schema, parse_pool=parse_pool)
+    finally:
+        if exporter is not None:
+            exporter.close()
+    if state is not None:
+        state.mark_run(database_id, started_at)
+        state.clear_cursor(database_id)
+        report_failures(database_id, state)
+    print(f"Synced {count} movies")
+    return count
+
+
+def sync_book(database_id: str, c: NotionClient, state: Optional[SyncStateStore] = None,
+              registry: Optional[ProviderRegistry] = None, covers: Optional[CoverStore] = None,
+              export_path: Optional[str] = None, writer: Optional[NotionWriter] = None,
+              concurrency: Optional[Dict[str, int]] = None, dry_run: bool = False,
+              parse_pool: Optional[ParsePool] = None) -> int:
+    book_provider = (registry or default_registry()).provider("book")
+    started_at = time.time()
+    if dry_run:
+        # 试运行不写 Notion, 也不更新同步状态, 以免之后的正式运行跳过这些页面
+        state = None
+    writer = writer or NotionWriter(c, dry_run=dry_run)
+    schema = OptionIndex(c, database_id, BOOK_OPTION_PROPERTIES, writer) if not dry_run else None
+    exporter = open_exporter(export_path, MetaRecord) if export_path else None
+    try:
+        count = sync_book_info(iter_book_pages(database_id, c, state, writer), book_provider, c,
+                               concurrency, state=state, database_id=database_id, writer=writer, covers=covers,
+                               exporter=exporter, schema=schema, parse_pool=parse_pool)
+    finally:
+        if exporter is not None:
+            exporter.close()
+    if state is not None:
+        state.mark_run(database_id, started_at)
+        state.clear_cursor(database_id)
+        report_failures(database_id, state)
+    print(f"Synced {count} books")
+    return count
+
+
+def report_failures(database_id: str, state: SyncStateStore):
+    failures = list(state.dead_letters(database_id))
+    if not failures:
+        return
+    print(f"{len(failures)} pages failed:")
+    for page_id, name, identifier, attempts, error, _ in failures[:DEAD_LETTER_REPORT_LIMIT]:
+        print(f"  {name} ({identifier}, {page_id}): {error}, {attempts} attempts")
+
+
+def dead_letter_items(database_id: str, c: NotionClient, state: SyncStateStore,
+                      writer: NotionWriter) -> Iterator[Any]:
+    # (page_id, name, identifier, item): 读取行时失败的页面重新从 Notion 取回 item, 列可能已经补全;
+    # 其余页面 item 为 None, 直接按记录的编号重试
+    for page_id, name, identifier, _, error, _ in state.dead_letters(database_id):
+        if not (error or "").startswith(f"{CONVERT_STAGE}:"):
+            yield page_id, name, identifier, None
+            continue
+        try:
+            item = writer.call(c.pages.retrieve, "notion_retrieve", page_id=page_id)
+        except Exception as e:
+            print(f"Failed to read page {name or page_id}, error: {e!r}")
+            continue
+        yield page_id, name, identifier, item
+
+
+def retry_failed_movies(database_id: str, c: NotionClient, state: SyncStateStore,
+                        registry: Optional[ProviderRegistry] = None, writer: Optional[NotionWriter] = None) -> int:
+    # 只重试失败列表里的页面, 不重新扫描数据库; 标记为处理中以跳过失败退避
+    writer = writer or NotionWriter(c)
+    movies = []
+    for page_id, name, identifier, item in dead_letter_items(database_id, c, state, writer):
+        movie = convert_page(item, to_movie_page, movie_imdb, database_id, state) if item is not None \
+            else MovieEmptyPage(page_id=page_id, movie_name=name, imdb=identifier)
+        if movie is None:
+            continue
+        state.record_pending(database_id, movie.page_id, movie.movie_name, movie.imdb)
+        movies.append(movie)
+    count = sync_movie_info(movies, (registry or default_registry()).provider("movie"), c,
+                            state=state, database_id=database_id, writer=writer,
+                            schema=OptionIndex(c, database_id, MOVIE_OPTION_PROPERTIES, writer))
+    report_failures(database_id, state)
+    return count
+
+
+def retry_failed_books(database_id: str, c: NotionClient, state: SyncStateStore,
+                       registry: Optional[ProviderRegistry] = None, writer: Optional[NotionWriter] = None) -> int:
+    writer = writer or NotionWriter(c)
+    books = []
+    for page_id, name, identifier, item in dead_letter_items(database_id, c, state, writer):
+        book = convert_page(item, to_book_page, book_isbn, database_id, state) if item is not None \
+            else BookEmptyPage(page_id=page_id, book_name=name, isbn=identifier)
+        if book is None:
+            continue
+        state.record_pending(database_id, book.page_id, book.book_name, str(book.isbn))
+        books.append(book)
+    count = sync_book_info(books, (registry or default_registry()).provider("book"), c,
+                           state=state, database_id=database_id, writer=writer,
+                           schema=OptionIndex(c, database_id, BOOK_OPTION_PROPERTIES, writer))
+    report_failures(database_id, state)
+    return count
+
+
+def seed_records(path: str, record_type: type, provider: Provider) -> int:
+    # 把导出的记录写回本地缓存, 换机器后不必重新抓取豆瓣
+    count = 0
+    for exported in iter_exported(path, record_type):
+        provider.seed(exported.query, exported.record)
+        count += 1
+    return count
+
+
+def restore_info(path: str, record_type: type, nc: NotionClient, gen_properties: Callable[[Any], Dict[Any, Any]],
+                 writer: Optional[NotionWriter] = None) -> int:
+    # 直接用导出的记录更新 Notion 页面, 用于重建数据库
+    writer = writer or NotionWriter(nc)
+    updated = 0
+    for exported in iter_exported(path, record_type):
+        try:
+            if writer.update(exported.page_id, gen_properties(exported.record)):
+                updated += 1
+        except Exception as e:
+            print(f"Failed to restore {exported.page_id}, error: {e}")
+    return updated
+
+
+def seed_book_records(path: str, registry: Optional[ProviderRegistry] = None) -> int:
+    return seed_records(path, MetaRecord, (registry or default_registry()).provider("book"))
+
+
+def seed_movie_records(path: str, registry: Optional[ProviderRegistry] = None) -> int:
+    return seed_records(path, MovieMetaRecord, (registry or default_registry()).provider("movie"))
+
+
+def reparse_pages(cache: Optional[PageCache] = None, concurrency: int = SYNC_CONCURRENCY["parse"]) -> int:
+    # 用原始页面缓存重新解析所有详情页并覆盖解析结果缓存, 不发请求; 解析器修复或新增字段后执行一次
+    cache = cache or get_page_cache()
+    if cache is None:
+        return 0
+    providers = {"book": DoubanBookProvider(), "movie": DoubanaMovieProvider()}
+
+    def pages() -> Iterator[Any]:
+        for url, content in cache.iter_pages():
+            kind = REPARSE_HOSTS.get(urlparse(url).netloc)
+            if kind is not None and SUBJECT_URL_PATTERN.match(url):
+                yield kind, url, content
+
+    def parse(page: Any) -> Any:
+        kind, url, content = page
+        providers[kind].parse(url, content)
+        return page
+
+    def on_error(page: Any, stage_name: str, e: Exception):
+        print(f"Failed to reparse {page[1]}, error: {e}")
+
+    return Pipeline([Stage("reparse", parse, concurrency)], on_error=on_error).run(pages())
+
+
+def aiter_query_items(database_id: str, c: AsyncNotionClient, query_filter: Dict[str, Any],
+                      state: Optional[SyncStateStore] = None,
+                      writer: Optional[NotionWriter] = None) -> AsyncIterator[Dict[str, Any]]:
+    if state is None:
+        return aiter_database_pages(c, database_id, query_filter, writer=writer)
+    query_key = state.query_key(query_filter)
+    return aiter_database_pages(c, database_id, query_filter, start_cursor=state.load_cursor(database_id, query_key),
+                                on_cursor=lambda cursor: state.save_cursor(database_id, query_key, cursor),
+                                writer=writer)
+
+
+async def aiter_movie_pages(database_id: str, c: AsyncNotionClient, state: Optional[SyncStateStore] = None,
+                            writer: Optional[NotionWriter] = None) -> AsyncIterator[MovieEmptyPage]:
+    # 与 iter_movie_pages 相同, 只有查询 Notion 是异步的
+    since = state.last_run(database_id) if state is not None else None
+    if state is not None:
+        for page_id, name, identifier in state.pending_pages(database_id):
+            yield MovieEmptyPage(page_id=page_id, movie_name=name, imdb=identifier)
+    async for item in aiter_query_items(database_id, c, changed_filter(MOVIE_QUERY_FILTER, since), state, writer):
+        page = convert_page(item, to_movie_page, movie_imdb, database_id, state)
+        if page is not None:
+            yield page
+    if state is not None:
+        for page_id, name, identifier in state.stale_pages(database_id):
+            yield MovieEmptyPage(page_id=page_id, movie_name=name, imdb=identifier)
+
+
+async def aiter_book_pages(database_id: str, c: AsyncNotionClient, state: Optional[SyncStateStore] = None,
+                           writer: Optional[NotionWriter] = None) -> AsyncIterator[BookEmptyPage]:
+    since = state.last_run(database_id) if state is not None else None
+    if state is not None:
+        for page_id, name, identifier in state.pending_pages(database_id):
+            yield BookEmptyPage(page_id=page_id, book_name=name, isbn=identifier)
+    async for item in aiter_query_items(database_id, c, changed_filter(BOOK_QUERY_FILTER, since), state, writer):
+        page = convert_page(item, to_book_page, book_isbn, database_id, state)
+        if page is not None:
+            yield page
+    if state is not None:
+        for page_id, name, identifier in state.stale_pages(database_id):
+            yield BookEmptyPage(page_id=page_id, book_name=name, isbn=identifier)
+
+
+async def async_sync_info(tasks: AsyncIterator[SyncTask],
+                          provider: Provider,
+                          nc: AsyncNotionClient, gen_properties: Callable[[Any], Dict[Any, Any]],
+                          concurrency: int = ASYNC_SYNC_CONCURRENCY,
+                          writer: Optional[NotionWriter] = None, state: Optional[SyncStateStore] = None,
+                          covers: Optional[CoverStore] = None, exporter: Optional[Any] = None,
+                          schema: Optional[OptionIndex] = None) -> int:
+    # sync_info 的异步版本: 一个事件循环里同时进行 concurrency 个查询, 不占用线程;
+    # 写入经过 writer 的令牌桶和重试, 查询可以开得很宽, 写入仍按 Notion 的限流进行.
+    # 封面下载和建选项只有同步实现, 放到默认线程池里执行
+    writer = writer or NotionWriter(nc)
+    loop = asyncio.get_running_loop()
+    if state is not None:
+        tasks = aselect_tasks(tasks, state)
+    semaphore = asyncio.Semaphore(concurrency)
+    running = set()
+    completed = 0
+
+    async def sync_one(task: SyncTask):
+        nonlocal completed
+        stage = "lookup"
+        try:
+            task.record = await provider.asearch_one(query=task.query)
+            if task.record is None:
+                raise LookupError(f"no result for {task.query}")
+            task.url = task.record.url
+            if covers is not None:
+                stage = "cover"
+                task.record.cover = await loop.run_in_executor(None, covers.localize, task.record.cover)
+            stage = "update"
+            properties = gen_properties(task.record)
+            if schema is not None:
+                properties = apply_options(schema, properties)
+                # 同时等待的页面新增的选项在下一次 flush 里一起建好
+                await loop.run_in_executor(None, flush_options, schema, 1)
+            updated = await writer.aupdate(task.page_id, properties, previous=previous_hash(task, state),
+                                           current=task.properties or None)
+            record_written(task, properties, updated, writer, state, exporter)
+            completed += 1
+        except Exception as e:
+            record_failed(task, stage, e, state)
+        finally:
+            semaphore.release()
+
+    # 先拿到信号量再读取下一条, 保证同时在途的查询数不超过 concurrency
+    async for task in tasks:
+        await semaphore.acquire()
+        future = asyncio.ensure_future(sync_one(task))
+        running.add(future)
+        future.add_done_callback(running.discard)
+    if running:
+        await asyncio.gather(*running)
+    return completed
+
+
+async def async_sync_movie(database_id: str, c: AsyncNotionClient, state: Optional[SyncStateStore] = None,
+                           registry: Optional[ProviderRegistry] = None, covers: Optional[CoverStore] = None,
+                           export_path: Optional[str] = None, writer: Optional[NotionWriter] = None,
+                           concurrency: int = ASYNC_SYNC_CONCURRENCY, dry_run: bool = False,
+                           schema_client: Optional[NotionClient] = None) -> int:
+    # 与 sync_movie 相同; OptionIndex 只有同步实现, 给出 schema_client (同一 token 的同步客户端) 时才统一选项写法.
+    # 豆瓣连接池由调用方在事件循环结束前用 close_async_client 关闭
+    movie_provider = (registry or default_registry()).provider("movie")
+    started_at = time.time()
+    if dry_run:
+        state = None
+    writer = writer or NotionWriter(c, dry_run=dry_run)
+    schema = None
+    if schema_client is not None and not dry_run:
+        schema = await asyncio.get_running_loop().run_in_executor(
+            None, OptionIndex, schema_client, database_id, MOVIE_OPTION_PROPERTIES, writer)
+    exporter = open_exporter(export_path, MovieMetaRecord) if export_path else None
+
+    async def tasks():
+        async for movie in aiter_movie_pages(database_id, c, state, writer):
+            yield SyncTask(page_id=movie.page_id, name=movie.movie_name, query=movie.imdb, database_id=database_id,
+                           properties=movie.properties, force=movie.force)
+
+    try:
+        count = await async_sync_info(tasks(), movie_provider, c, gen_movie_properties, concurrency, writer=writer,
+                                      state=state, covers=covers, exporter=exporter, schema=schema)
+    finally:
+        if exporter is not None:
+            exporter.close()
+    if state is not None:
+        state.mark_run(database_id, started_at)
+        state.clear_cursor(database_id)
+        report_failures(database_id, state)
+    print(f"Synced {count} movies")
+    return count
+
+
+async def async_sync_book(database_id: str, c: AsyncNotionClient, state: Optional[SyncStateStore] = None,
+                          registry: Optional[ProviderRegistry] = None, covers: Optional[CoverStore] = None,
+                          export_path: Optional[str] = None, writer: Optional[NotionWriter] = None,
+                          concurrency: int = ASYNC_SYNC_CONCURRENCY, dry_run: bool = False,
+                          schema_client: Optional[NotionClient] = None) -> int:
+    book_provider = (registry or default_registry()).provider("book")
+    started_at = time.time()
+    if dry_run:
+        state = None
+    writer = writer or NotionWriter(c, dry_run=dry_run)
+    schema = None
+    if schema_client is not None and not dry_run:
+        schema = await asyncio.get_running_loop().run_in_executor(
+            None, OptionIndex, schema_client, database_id, BOOK_OPTION_PROPERTIES, writer)
+    exporter = open_exporter(export_path, MetaRecord) if export_path else None
+
+    async def tasks():
+        async for book in aiter_book_pages(database_id, c, state, writer):
+            yield SyncTask(page_id=book.page_id, name=book.book_name, query=str(book.isbn), database_id=database_id,
+                           properties=book.properties, force=book.force)
+
+    try:
+        count = await async_sync_info(tasks(), book_provider, c, gen_book_properties, concurrency, writer=writer,
+                                      state=state, covers=covers, exporter=exporter, schema=schema)
+    finally:
+        if exporter is not None:
+            exporter.close()
+    if state is not None:
+        state.mark_run(database_id, started_at)
+        state.clear_cursor(database_id)
+        report_failures(database_id, state)
+    print(f"Synced {count} books")
+    return count
+
+
+@dataclasses.dataclass
+class SyncJob:
+    kind: str  # book / movie
+    database_id: str
+    token: str
+    name: str = ""
+    concurrency: Dict[str, int] = dataclasses.field(default_factory=dict)
+    export_path: Optional[str] = None
+
+
+def load_config(path: str) -> Dict[str, Any]:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def config_jobs(config: Dict[str, Any]) -> List[SyncJob]:
+    jobs = []
+    for entry in config.get("databases", []):
+        kind = entry.get("kind")
+        if kind not in ("book", "movie"):
+            raise ValueError(f"unknown database kind {kind} for {entry.get('database_id')}")
+        # token 可以直接写在配置里, 也可以指定从哪个环境变量读取
+        token = entry.get("token") or os.environ.get(entry.get("token_env", "NOTION_TOKEN"), "")
+        if not token:
+            raise ValueError(f"no Notion token for database {entry['database_id']}")
+        jobs.append(SyncJob(kind=kind, database_id=entry["database_id"], token=token,
+                            name=entry.get("name") or entry["database_id"],
+                            concurrency=entry.get("concurrency", {}), export_path=entry.get("export")))
+    return jobs
+
+
+def run_jobs(jobs: List[SyncJob], parallel: int = CLI_PARALLEL_JOBS, budget: int = CLI_REQUEST_BUDGET,
+             state: Optional[SyncStateStore] = None, dry_run: bool = False, retry_failed: bool = False,
+             registry: Optional[ProviderRegistry] = None, parse_processes: int = SYNC_PARSE_PROCESSES,
+             use_async: bool = False) -> int:
+    # 所有数据库共用一个豆瓣连接池, budget 为同时进行的豆瓣请求总数;
+    # Notion 的限流按 integration 计算, 同一个 token 的数据库共用一个 writer
+    if use_async:
+        failed = asyncio.run(arun_jobs(jobs, parallel, budget, state=state, dry_run=dry_run, registry=registry))
+        export_metrics()
+        return failed
+    configure_transport(pool_size=budget, max_per_host=budget, max_total=budget)
+    registry = registry or default_registry()
+    covers = CoverStore() if os.environ.get("COVER_BASE_URL") else None
+    clients: Dict[str, NotionClient] = {}
+    writers: Dict[str, NotionWriter] = {}
+    for job in jobs:
+        if job.token not in clients:
+            clients[job.token] = NotionClient(auth=job.token)
+            writers[job.token] = NotionWriter(clients[job.token], dry_run=dry_run)
+
+    def run(job: SyncJob) -> int:
+        client = clients[job.token]
+        if retry_failed:
+            retry = retry_failed_books if job.kind == "book" else retry_failed_movies
+            return retry(job.database_id, client, state, registry=registry, writer=writers[job.token])
+        sync = sync_book if job.kind == "book" else sync_movie
+        return sync(job.database_id, client, state, registry=registry, covers=covers, export_path=job.export_path,
+                    writer=writers[job.token], concurrency=job.concurrency, dry_run=dry_run,
+                    parse_pool=parse_pool)
+
+    failed = 0
+    # 解析进程池由所有数据库共用
+    parse_pool = open_parse_pool(parse_processes)
+    try:
+        with ThreadPoolExecutor(max_workers=max(parallel, 1), thread_name_prefix="sync_job") as executor:
+            futures = {executor.submit(run, job): job for job in jobs}
+            for future, job in futures.items():
+                try:
+                    print(f"Finished {job.kind} database {job.name}, {future.result()} pages synced")
+                except Exception as e:
+                    failed += 1
+                    print(f"Failed to sync {job.kind} database {job.name}, error: {e!r}")
+    finally:
+        if parse_pool is not None:
+            parse_pool.shutdown()
+    export_metrics()
+    return failed
+
+
+async def arun_jobs(jobs: List[SyncJob], parallel: int = CLI_PARALLEL_JOBS, budget: int = CLI_REQUEST_BUDGET,
+                    state: Optional[SyncStateStore] = None, dry_run: bool = False,
+                    registry: Optional[ProviderRegistry] = None) -> int:
+    # run_jobs 的异步版本: 所有数据库在同一个事件循环里同步, budget 为豆瓣连接池的连接总数
+    configure_async_client(pool_size=budget, pool_size_per_host=budget)
+    registry = registry or default_registry()
+    covers = CoverStore() if os.environ.get("COVER_BASE_URL") else None
+    clients: Dict[str, AsyncNotionClient] = {}
+    schema_clients: Dict[str, NotionClient] = {}
+    writers: Dict[str, NotionWriter] = {}
+    for job in jobs:
+        if job.token not in clients:
+            clients[job.token] = AsyncNotionClient(auth=job.token)
+            schema_clients[job.token] = NotionClient(auth=job.token)
+            writers[job.token] = NotionWriter(clients[job.token], dry_run=dry_run)
+    semaphore = asyncio.Semaphore(max(parallel, 1))
+
+    async def run(job: SyncJob) -> int:
+        async with semaphore:
+            sync = async_sync_book if job.kind == "book" else async_sync_movie
+            return await sync(job.database_id, clients[job.token], state, registry=registry, covers=covers,
+                              export_path=job.export_path, writer=writers[job.token], dry_run=dry_run,
+                              schema_client=schema_clients[job.token])
+
+    try:
+        results = await asyncio.gather(*(run(job) for job in jobs), return_exceptions=True)
+    finally:
+        await close_async_client()
+        for client in clients.values():
+            await client.aclose()
+    failed = 0
+    for job, result in zip(jobs, results):
+        if isinstance(result, Exception):
+            failed += 1
+            print(f"Failed to sync {job.kind} database {job.name}, error: {result!r}")
+        else:
+            print(f"Finished {job.kind} database {job.name}, {result} pages synced")
+    return failed
+
+
+def export_metrics():
+    # 所有数据库同步完后统一导出一次; 导出失败不影响同步结果
+    try:
+        get_metrics().export()
+    except OSError as e:
+        print(f"Failed to export metrics, error: {e!r}")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Sync Douban book and movie metadata into Notion databases.")
+    parser.add_argument("--config", help="JSON file listing the databases to sync")
+    parser.add_argument("--book", action="append", default=[], metavar="DATABASE_ID",
+                        help="book database to sync with NOTION_TOKEN, may be repeated")
+    parser.add_argument("--movie", action="append", default=[], metavar="DATABASE_ID",
+                        help="movie database to sync with NOTION_TOKEN, may be repeated")
+    parser.add_argument("--only", action="append", metavar="NAME", help="only sync databases with this name or id")
+    parser.add_argument("--jobs", type=int, help="number of databases synced at the same time")
+    parser.add_argument("--budget", type=int, help="concurrent Douban requests across all databases")
+    parser.add_argument("--state", help="sync state database path")
+    parser.add_argument("--dry-run", action="store_true", help="resolve metadata without writing to Notion")
+    parser.add_argument("--retry-failed", action="store_true", help="only retry pages that failed before")
+    parser.add_argument("--metrics-port", type=int, help="expose Prometheus metrics on this port")
+    parser.add_argument("--reparse", action="store_true",
+                        help="re-parse every cached Douban subject page into the metadata cache, then exit")
+    parser.add_argument("--parse-processes", type=int,
+                        help="parse subject pages in this many worker processes, 0 parses in threads")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="sync every database on one asyncio event loop instead of the threaded pipeline, "
+                             "needs aiohttp; --parse-processes is ignored")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    if args.reparse:
+        print(f"Reparsed {reparse_pages()} cached pages")
+        get_metrics().export()
+        return 0
+    if args.dry_run and args.retry_failed:
+        print("--retry-failed needs the sync state, it cannot be combined with --dry-run")
+        return 2
+    if args.use_async and args.retry_failed:
+        print("--retry-failed runs on the threaded pipeline, it cannot be combined with --async")
+        return 2
+    config = load_config(args.config) if args.config else {}
+    jobs = config_jobs(config)
+    token = os.environ.get("NOTION_TOKEN", NOTION_TOKEN)
+    book_ids = args.book or ([] if jobs or args.movie else [os.environ.get("BOOK_DATABASE_ID", BOOK_DATABASE_ID)])
+    movie_ids = args.movie or ([] if jobs or args.book else [os.environ.get("MOVIE_DATABASE_ID", MOVIE_DATABASE_ID)])
+    jobs.extend(SyncJob(kind="book", database_id=database_id, token=token, name=database_id)
+                for database_id in book_ids if database_id)
+    jobs.extend(SyncJob(kind="movie", database_id=database_id, token=token, name=database_id)
+                for database_id in movie_ids if database_id)
+    if args.only:
+        jobs = [job for job in jobs if job.name in args.only or job.database_id in args.only]
+    if not jobs:
+        print("No databases to sync, pass --config, --book or --movie")
+        return 2
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port)
+    state = None
+    if not args.dry_run:
+        state = SyncStateStore(args.state or config.get("state") or SYNC_STATE_PATH)
+    try:
+        failed = run_jobs(jobs, parallel=args.jobs or config.get("jobs", CLI_PARALLEL_JOBS),
+                          budget=args.budget or config.get("budget", CLI_REQUEST_BUDGET),
+                          state=state, dry_run=args.dry_run, retry_failed=args.retry_failed,
+                          parse_processes=args.parse_processes if args.parse_processes is not None
+                          else config.get("parse_processes", SYNC_PARSE_PROCESSES),
+                          use_async=args.use_async or config.get("async", False))
+    finally:
+        if state is not None:
+            state.close()
+    return 1 if failed else 0
 
 
 if __name__ == '__main__':
-    MOVIE_DATABASE_ID = os.environ["MOVIE_DATABASE_ID"]
-    client = NotionClient(auth=os.environ["NOTION_TOKEN"])
-    sync_movie(MOVIE_DATABASE_ID, client)
+    sys.exit(main())
@@ -1,21 +1,32 @@
-import random
+import asyncio
+import json
 import re
-import time
-import requests
 from datetime import datetime
-from typing import List, Optional, Any
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from urllib.parse import urlparse, unquote
-from functools import lru_cache
+from typing import AsyncIterator, List, Optional, Any, Tuple
+from urllib.parse import unquote
 from lxml import etree
+from common.aio import get_async_client, run_sync
+from common.cache import get_meta_cache
+from common.http import get_transport, is_throttled
+from common.records import intern_list, intern_text
+from common.prefetch import aiter_prefetched
+from common.singleflight import SingleFlight
 from movie.meta import MovieMetaSourceInfo, MovieMetaRecord, MetadataProvider
 
 DOUBAN_SEARCH_JSON_URL = "https://www.douban.com/j/search"  # 最新豆瓣屏蔽此url
 DOUBAN_SEARCH_URL = "https://www.douban.com/search"
 DOUBAN_MOVIE_CAT = "1002"
-DOUBAN_MOVIE_CACHE_SIZE = 500  # 最大缓存数量
+DOUBAN_MOVIE_CACHE = "douban_movie"  # 详情页解析结果的缓存空间
+DOUBAN_MOVIE_SEARCH_CACHE = "douban_movie_search"  # 搜索结果的缓存空间
+DOUBAN_MOVIE_IMDB_CACHE = "douban_movie_imdb"  # IMDb 编号到详情页地址的映射
+DOUBAN_MOVIE_SUGGEST_URL = "https://movie.douban.com/j/subject_suggest"  # 支持按 IMDb 编号查询
+DOUBAN_MOVIE_SUBJECT_URL = "https://movie.douban.com/subject/{}/"
 DOUBAN_CONCURRENCY_SIZE = 5  # 并发查询数
+DOUBAN_PREFETCH_SIZE = 2  # search_one 按排名顺序提前下载的候选数
+DOUBAN_SEARCH_CHUNK_SIZE = 16 * 1024  # 搜索页按块增量解析, 拿到足够的候选后不再读后面的内容
+DOUBAN_REDIRECT_URL_PATTERN = re.compile("[?&]url=([^&#]+)")  # 搜索结果链接经过跳转, 真实地址在 url 参数里
 DOUBAN_MOVIE_URL_PATTERN = re.compile(".*/subject/(\\d+)/?")
+IMDB_PATTERN = re.compile("^tt\\d{7,}$")
 DEFAULT_HEADERS = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 6.1; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/71.0.3573.0 Safari/537.36',
     'Accept-Encoding': 'gzip, deflate'
@@ -24,7 +35,14 @@ DEFAULT_HEADERS = {
 __ALL__ = ["DoubanaMovieProvider"]
 
 
+def normalize_imdb(value) -> Optional[str]:
+    imdb = str(value).strip().lower()
+    return imdb if IMDB_PATTERN.match(imdb) else None
+
+
 class DoubanaMovieProvider(MetadataProvider):
+    __name__ = "Douban Movies"
+    __id__ = "douban"
 
     def __init__(self):
         self.searcher = DoubanMovieSearcher()
@@ -38,81 +56,311 @@ class DoubanaMovieProvider(MetadataProvider):
     def search_one(
             self, query: str, generic_cover: str = "", locale: str = "en"
     ) -> Optional[MovieMetaRecord]:
-        resp = self.searcher.search_movies(query)
-        if resp:
-            return resp[0]
+        return self.searcher.search_one_movie(query)
+
+    async def asearch(
+            self, query: str, generic_cover: str = "", locale: str = "en"
+    ) -> Optional[List[MovieMetaRecord]]:
+        return await self.searcher.asearch_movies(query)
+
+    async def asearch_one(
+            self, query: str, generic_cover: str = "", locale: str = "en"
+    ) -> Optional[MovieMetaRecord]:
+        return await self.searcher.asearch_one_movie(query)
+
+    def search_urls(self, query: str) -> List[str]:
+        return self.searcher.load_movie_urls(query)
+
+    def fetch(self, url: str) -> Optional[bytes]:
+        return self.searcher.movie_loader.fetch_movie(url)
+
+    def parse(self, url: str, content: bytes) -> MovieMetaRecord:
+        return self.searcher.movie_loader.parse_movie(url, content)
+
+    def cached(self, url: str) -> Optional[MovieMetaRecord]:
+        return self.searcher.movie_loader.cached_movie(url)
+
+    def batch_parser(self):
+        return parse_movie_batch
+
+    def store(self, url: str, record: MovieMetaRecord) -> MovieMetaRecord:
+        return self.searcher.movie_loader.store_movie(url, record)
+
+    def verify(self, query: str, record: MovieMetaRecord) -> bool:
+        if not self.searcher.is_identifier(query):
+            return True
+        if not self.searcher.matches(query, record):
+            return False
+        self.searcher.store_imdb_url(query, record.url)
+        return True
+
+    def seed(self, query: str, record: MovieMetaRecord):
+        # 写入缓存后, 同一查询直接命中详情页缓存, 不再访问豆瓣
+        self.searcher.movie_loader.store_movie(record.url, record)
+        self.searcher.store_resolved(query, record.url)
 
 
 class DoubanMovieSearcher:
 
     def __init__(self):
         self.movie_loader = DoubanMovieLoader()
-        self.thread_pool = ThreadPoolExecutor(max_workers=10, thread_name_prefix='douban_movie_async')
+        self.flight = SingleFlight("douban_movie_search")
 
     def search_movies(self, query: str) -> List[Any]:
-        movie_urls = self.load_movie_urls(query)
-        movies = []
-        futures = [self.thread_pool.submit(self.movie_loader.load_movie, movie_url) for movie_url in movie_urls]
-        for future in as_completed(futures):
-            movie = future.result()
-            if movie is not None:
-                movies.append(future.result())
-        return movies
+        # 同步接口只是异步实现的包装, 在共享的后台事件循环里执行
+        return run_sync(self.asearch_movies(query))
+
+    def search_one_movie(self, query: str) -> Optional[MovieMetaRecord]:
+        return run_sync(self.asearch_one_movie(query))
+
+    async def aiter_movies(self, query: str, prefetch: int = DOUBAN_PREFETCH_SIZE) -> AsyncIterator[MovieMetaRecord]:
+        # 按搜索结果的排名顺序产出, 只提前下载 prefetch 个候选; 调用方停止迭代时取消还没开始的下载
+        movies = aiter_prefetched(self.movie_loader.aload_movie, await self.aload_movie_urls(query), prefetch)
+        try:
+            async for movie in movies:
+                if movie is not None:
+                    yield movie
+        finally:
+            await movies.aclose()
+
+    @staticmethod
+    def is_identifier(query: str) -> bool:
+        return normalize_imdb(query) is not None
 
     @staticmethod
-    def calc_url(href: str) -> str:
-        query = urlparse(href).query
-        params = {item.split('=')[0]: item.split('=')[1] for item in query.split('&')}
-        url = unquote(params['url'])
+    def matches(query: str, movie: MovieMetaRecord) -> bool:
+        imdb = normalize_imdb(query)
+        return imdb is not None and imdb == normalize_imdb(movie.imdb or movie.identifiers.get("imdb", ""))
+
+    @staticmethod
+    def calc_url(href: str) -> Optional[str]:
+        url_match = DOUBAN_REDIRECT_URL_PATTERN.search(href)
+        if url_match is None:
+            return None
+        url = unquote(url_match.group(1))
         if DOUBAN_MOVIE_URL_PATTERN.match(url):
             return url
+        return None
 
     def load_movie_urls(self, query: str) -> List[Any]:
+        # 同一查询同时只请求一次, 其余调用等待并共享结果
+        return self.flight.do(self.query_key(query), self.fetch_movie_urls, query)
+
+    async def aload_movie_urls(self, query: str) -> List[Any]:
+        return await self.flight.ado(self.query_key(query), self.afetch_movie_urls, query)
+
+    @staticmethod
+    def query_key(query: str) -> str:
+        # 写法不同的同一个编号合并为一次请求
+        return normalize_imdb(query) or str(query)
+
+    def fetch_movie_urls(self, query: str) -> List[Any]:
+        movie_url = self.resolve_imdb(query)
+        if movie_url:
+            return [movie_url]
+        movie_urls = self.cached_movie_urls(query)
+        if movie_urls is not None:
+            return movie_urls
         url = DOUBAN_SEARCH_URL
         params = {"cat": DOUBAN_MOVIE_CAT, "q": query}
-        res = requests.get(url, params, headers=DEFAULT_HEADERS)
+        content = get_transport().get_page(url, params, headers=DEFAULT_HEADERS)
+        if content is not None:
+            return self.store_movie_urls(query, self.extract_movie_urls(content))
+        return []
+
+    async def afetch_movie_urls(self, query: str) -> List[Any]:
+        movie_url = await self.aresolve_imdb(query)
+        if movie_url:
+            return [movie_url]
+        movie_urls = self.cached_movie_urls(query)
+        if movie_urls is not None:
+            return movie_urls
+        url = DOUBAN_SEARCH_URL
+        params = {"cat": DOUBAN_MOVIE_CAT, "q": query}
+        content = await get_async_client().get_page(url, params, headers=DEFAULT_HEADERS)
+        if content is not None:
+            return self.store_movie_urls(query, self.extract_movie_urls(content))
+        return []
+
+    @classmethod
+    def resolve_imdb(cls, query: str) -> Optional[str]:
+        # 查询本身是 IMDb 编号时不走搜索页, 用联想接口直接拿到唯一的详情页地址
+        imdb = normalize_imdb(query)
+        if imdb is None:
+            return None
+        movie_url = cls.cached_imdb_url(imdb)
+        if movie_url is not None:
+            return movie_url
+        res = get_transport().get(DOUBAN_MOVIE_SUGGEST_URL, {"q": imdb}, headers=DEFAULT_HEADERS)
+        if res.status_code not in [200, 201] or is_throttled(res.status_code, res.url):
+            return None
+        return cls.suggested_url(res.content)
+
+    @classmethod
+    async def aresolve_imdb(cls, query: str) -> Optional[str]:
+        imdb = normalize_imdb(query)
+        if imdb is None:
+            return None
+        movie_url = cls.cached_imdb_url(imdb)
+        if movie_url is not None:
+            return movie_url
+        status, content = await get_async_client().get(DOUBAN_MOVIE_SUGGEST_URL, {"q": imdb}, headers=DEFAULT_HEADERS)
+        if status not in [200, 201]:
+            return None
+        return cls.suggested_url(content)
+
+    @staticmethod
+    def cached_imdb_url(imdb: str) -> Optional[str]:
+        cache = get_meta_cache()
+        if cache is not None:
+            return cache.get(DOUBAN_MOVIE_IMDB_CACHE, imdb)
+        return None
+
+    @staticmethod
+    def suggested_url(content: bytes) -> Optional[str]:
+        # 联想接口返回的第一个条目通常就是对应的详情页, 但要等解析出的 IMDb 编号对上后才缓存 (store_imdb_url)
+        try:
+            suggestions = json.loads(content)
+        except ValueError:
+            return None
+        if not suggestions:
+            return None
+        id_match = DOUBAN_MOVIE_URL_PATTERN.match(suggestions[0].get("url", ""))
+        if not id_match:
+            return None
+        return DOUBAN_MOVIE_SUBJECT_URL.format(id_match.group(1))
+
+    @classmethod
+    def store_imdb_url(cls, query: str, movie_url: str):
+        imdb = normalize_imdb(query)
+        cache = get_meta_cache()
+        if cache is not None and imdb is not None and cls.cached_imdb_url(imdb) != movie_url:
+            cache.set(DOUBAN_MOVIE_IMDB_CACHE, imdb, movie_url)
+
+    @staticmethod
+    def cached_movie_urls(query: str) -> Optional[List[Any]]:
+        cache = get_meta_cache()
+        if cache is not None:
+            return cache.get(DOUBAN_MOVIE_SEARCH_CACHE, str(query))
+        return None
+
+    @classmethod
+    def store_resolved(cls, query: str, movie_url: str):
+        cls.store_imdb_url(query, movie_url)
+        cls.store_movie_urls(query, [movie_url])
+
+    @staticmethod
+    def store_movie_urls(query: str, movie_urls: List[Any]) -> List[Any]:
+        cache = get_meta_cache()
+        # 没有结果时不缓存, 下次运行重新搜索
+        if cache is not None and movie_urls:
+            cache.set(DOUBAN_MOVIE_SEARCH_CACHE, str(query), movie_urls)
+        return movie_urls
+
+    async def asearch_one_movie(self, query: str) -> Optional[MovieMetaRecord]:
+        # 按排名顺序检查候选, 只提前下载 DOUBAN_PREFETCH_SIZE 个; 查询不是 IMDb 编号时直接取第一个
+        first = None
+        movies = self.aiter_movies(query)
+        try:
+            async for movie in movies:
+                if self.matches(query, movie):
+                    self.store_imdb_url(query, movie.url)
+                    return movie
+                first = first or movie
+                if not self.is_identifier(query):
+                    break
+        finally:
+            await movies.aclose()
+        # 没有条目能对上编号时退回排名第一的结果
+        return first
+
+    async def asearch_movies(self, query: str) -> List[Any]:
+        movie_urls = await self.aload_movie_urls(query)
+        movies = await asyncio.gather(*[self.movie_loader.aload_movie(movie_url) for movie_url in movie_urls])
+        return [movie for movie in movies if movie is not None]
+
+    def extract_movie_urls(self, content: bytes) -> List[Any]:
+        # 结果与 //a[@class="nbg"] 取前 DOUBAN_CONCURRENCY_SIZE 个有效地址相同, 但只解析到最后一个需要的链接
         movie_urls = []
-        if res.status_code in [200, 201]:
-            html = etree.HTML(res.content)
-            alist = html.xpath('//a[@class="nbg"]')
-            for link in alist:
-                href = link.attrib['href']
-                parsed = self.calc_url(href)
-                if parsed:
-                    if len(movie_urls) < DOUBAN_CONCURRENCY_SIZE:
-                        movie_urls.append(parsed)
+        parser = etree.HTMLPullParser(events=("start",), tag="a")
+        for offset in range(0, len(content), DOUBAN_SEARCH_CHUNK_SIZE):
+            parser.feed(content[offset:offset + DOUBAN_SEARCH_CHUNK_SIZE])
+            if self.collect_urls(parser, movie_urls):
+                return movie_urls
+        try:
+            parser.close()
+        except etree.XMLSyntaxError:
+            return movie_urls
+        self.collect_urls(parser, movie_urls)
         return movie_urls
 
+    def collect_urls(self, parser, movie_urls: List[Any]) -> bool:
+        # 返回 True 表示候选已经够了
+        for _, link in parser.read_events():
+            if link.get('class') != 'nbg':
+                continue
+            parsed = self.calc_url(link.get('href', ''))
+            if parsed:
+                movie_urls.append(parsed)
+                if len(movie_urls) >= DOUBAN_CONCURRENCY_SIZE:
+                    return True
+        return False
+
 
 class DoubanMovieLoader:
 
     def __init__(self):
         self.movie_parser = DoubanMovieHtmlParser()
+        self.flight = SingleFlight("douban_movie")
+        self.fetch_flight = SingleFlight("douban_movie_fetch")
+
+    async def aload_movie(self, url):
+        # 以 subject id 合并并发请求, 同一条目只下载、解析一次
+        return await self.flight.ado(self.cache_key(url), self.aresolve_movie, url)
+
+    def parse_movie(self, url, content) -> MovieMetaRecord:
+        return self.store_movie(url, self.movie_parser.parse_movie(url, content))
 
-    @lru_cache(maxsize=DOUBAN_MOVIE_CACHE_SIZE)
-    def load_movie(self, url):
-        movie = None
-        self.random_sleep()
-        start_time = time.time()
-        res = requests.get(url, headers=DEFAULT_HEADERS)
-        if res.status_code in [200, 201]:
-            print("Download Movie:{} success,耗时 {:.0f}ms".format(url, (time.time() - start_time) * 1000))
-            movie_detail_content = res.content
-            movie = self.movie_parser.parse_movie(url, movie_detail_content)
+    def store_movie(self, url, movie: MovieMetaRecord) -> MovieMetaRecord:
+        cache = get_meta_cache()
+        if cache is not None:
+            cache.set(DOUBAN_MOVIE_CACHE, self.cache_key(url), movie)
         return movie
 
+    def cached_movie(self, url) -> Optional[MovieMetaRecord]:
+        cache = get_meta_cache()
+        if cache is not None:
+            return cache.get(DOUBAN_MOVIE_CACHE, self.cache_key(url))
+        return None
+
     @staticmethod
-    def random_sleep():
-        random_sec = random.random() / 10
-        print("Random sleep time {}s".format(random_sec))
-        time.sleep(random_sec)
+    def cache_key(url) -> str:
+        # 以豆瓣 subject id 作为缓存键, 同一条目的不同链接共享缓存
+        id_match = DOUBAN_MOVIE_URL_PATTERN.match(url)
+        return id_match.group(1) if id_match else url
+
+    def fetch_movie(self, url) -> Optional[bytes]:
+        return self.fetch_flight.do(self.cache_key(url), self.download_movie, url)
+
+    def download_movie(self, url) -> Optional[bytes]:
+        return get_transport().get_page(url, headers=DEFAULT_HEADERS)
+
+    async def aresolve_movie(self, url):
+        movie = self.cached_movie(url)
+        if movie is not None:
+            return movie
+        content = await get_async_client().get_page(url, headers=DEFAULT_HEADERS)
+        if content is not None:
+            movie = self.parse_movie(url, content)
+        return movie
 
 
 class DoubanMovieHtmlParser:
     def __init__(self):
         self.id_pattern = DOUBAN_MOVIE_URL_PATTERN
         self.date_pattern = re.compile(r'\d{4}-\d{2}-\d{2}')
-        self.tag_pattern = re.compile("criteria = '(.+)'")
+        # 直接在原始字节上匹配, 避免为了找标签把整个页面解码一遍
+        self.tag_pattern = re.compile(b"criteria = '(.+)'")
 
     def parse_movie(self, url, content) -> MovieMetaRecord:
         movie = MovieMetaRecord(
@@ -127,55 +375,94 @@ class DoubanMovieHtmlParser:
         html = etree.HTML(content)
         if html is None:
             return movie
-        title_element = html.xpath("//span[@property='v:itemreviewed']")
+        title_element, share_element, img_element, rating_element, elements, summary_element, tag_elements = \
+            self.__collect(html)
         movie.title = self.__get_text(title_element)
-        share_element = html.xpath("//a[@data-url]")
         if len(share_element):
             url = share_element[0].attrib['data-url']
         movie.url = url
         id_match = self.id_pattern.match(url)
         if id_match:
             movie.movie_id = id_match.group(1)
-        img_element = html.xpath("//img[@rel='v:image']")
         if len(img_element):
             cover = img_element[0].attrib['src']
             movie.cover = cover
-        elements = html.xpath("//span[@class='pl']")
+        movie.rating = self.__get_rating(rating_element)
+        parent_links = {}
         for element in elements:
             text = self.__get_text(element)
-            if text.startswith("导演"):
-                movie.directors.extend([self.__get_text(director_element) for director_element in
-                                        filter(self.director_filter, element.findall("..//a"))])
-            elif text.startswith("主演"):
-                movie.actors.extend([self.__get_text(actor_element) for actor_element in
-                                     filter(self.actor_filter, element.findall("..//a"))])
+            if text.startswith("导演") or text.startswith("主演"):
+                parent = element.getparent()
+                if parent not in parent_links:
+                    parent_links[parent] = element.findall("..//a")
+                if text.startswith("导演"):
+                    movie.directors.extend(intern_list(self.__get_text(director_element) for director_element in
+                                                       filter(self.director_filter, parent_links[parent])))
+                else:
+                    movie.actors.extend(intern_list(self.__get_text(actor_element) for actor_element in
+                                                    filter(self.actor_filter, parent_links[parent])))
             elif text.startswith("类型"):
-                movie.genres = self.__get_text(element.getnext())
+                movie.genres = intern_text(self.__get_text(element.getnext()))
             elif text.startswith("制片国家/地区"):
-                movie.countries = self.__get_tail(element)
+                movie.countries = intern_text(self.__get_tail(element))
             elif text.startswith("IMDb"):
                 movie.identifiers["imdb"] = self.__get_tail(element)
                 movie.imdb = self.__get_tail(element)
             elif text.startswith("语言"):
-                movie.languages = self.__get_tail(element)
+                movie.languages = intern_text(self.__get_tail(element))
             elif text.startswith("上映日期"):
                 movie.release_date = self.__get_release_date(self.__get_tail(element))
-        summary_element = html.xpath("//div[@id='link-report']//div[@class='intro']")
         if len(summary_element):
             movie.description = etree.tostring(summary_element[-1], encoding="utf8").decode("utf8").strip()
-        tag_elements = html.xpath("//a[contains(@class, 'tag')]")
         if len(tag_elements):
-            movie.tags = [self.__get_text(tag_element) for tag_element in tag_elements]
+            movie.tags = intern_list(self.__get_text(tag_element) for tag_element in tag_elements)
         else:
-            movie.tags = self.__get_tags(content)
-        print(movie)
+            movie.tags = intern_list(self.__get_tags(content))
         return movie
 
+    @staticmethod
+    def __collect(html):
+        # 一次遍历取出所有需要的节点, 结果与逐个执行下列 XPath 相同:
+        # //span[@property='v:itemreviewed'], //a[@data-url], //img[@rel='v:image'], //strong[@property='v:average'],
+        # //span[@class='pl'], //div[@id='link-report']//div[@class='intro'], //a[contains(@class, 'tag')]
+        title_element, share_element, img_element, rating_element = [], [], [], []
+        elements, reports, tag_elements = [], [], []
+        for element in html.iter('span', 'a', 'img', 'strong', 'div'):
+            tag = element.tag
+            get = element.get
+            if tag == 'a':
+                if not share_element and get('data-url') is not None:
+                    share_element.append(element)
+                css = get('class')
+                if css is not None and 'tag' in css:
+                    tag_elements.append(element)
+            elif tag == 'span':
+                if get('class') == 'pl':
+                    elements.append(element)
+                if not title_element and get('property') == 'v:itemreviewed':
+                    title_element.append(element)
+            elif tag == 'div':
+                if get('id') == 'link-report':
+                    reports.append(element)
+            elif tag == 'strong':
+                if not rating_element and get('property') == 'v:average':
+                    rating_element.append(element)
+            elif not img_element and get('rel') == 'v:image':
+                img_element.append(element)
+        summary_element = []
+        seen = set()
+        for report in reports:
+            for element in report.iterdescendants('div'):
+                if element.get('class') == 'intro' and element not in seen:
+                    seen.add(element)
+                    summary_element.append(element)
+        return title_element, share_element, img_element, rating_element, elements, summary_element, tag_elements
+
     def __get_tags(self, movie_content) -> List[Any]:
-        tag_match = self.tag_pattern.findall(movie_content.decode('utf-8'))
-        if len(tag_match):
+        tag_match = self.tag_pattern.search(movie_content)
+        if tag_match:
             return [tag.replace('7:', '') for tag in
-                    filter(lambda tag: tag and tag.startswith('7:'), tag_match[0].split('|'))]
+                    filter(lambda tag: tag and tag.startswith('7:'), tag_match.group(1).decode('utf-8').split('|'))]
         return []
 
     def __get_release_date(self, date_str):
@@ -189,7 +476,11 @@ class DoubanMovieHtmlParser:
         return date_str
 
     def __get_rating(self, rating_element) -> float:
-        return float(self.__get_text(rating_element, '0')) / 2
+        # 暂无评分的条目显示为空
+        try:
+            return float(self.__get_text(rating_element, '0')) / 2
+        except ValueError:
+            return 0.0
 
     @staticmethod
     def author_filter(a_element):
@@ -222,3 +513,15 @@ class DoubanMovieHtmlParser:
             if not text:
                 text = self.__get_text(element.getnext(), default_str)
         return text if text else default_str
+
+
+def parse_movie_batch(pages: List[Tuple[str, bytes]]) -> List[Any]:
+    # 在解析进程里执行: 只解析不写缓存; 单个页面出错时返回异常, 不影响同一批的其他页面
+    parser = DoubanMovieHtmlParser()
+    records = []
+    for url, content in pages:
+        try:
+            records.append(parser.parse_movie(url, content))
+        except Exception as e:
+            records.append(ValueError(f"failed to parse {url}: {e!r}"))
+    return records
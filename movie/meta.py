@@ -1,17 +1,17 @@
-import abc
 import os
 import dataclasses
 from typing import Dict, List, Optional, Union
+from common.provider import StagedProvider
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class MovieMetaSourceInfo:
     id: str
     description: str
     link: str
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class MovieMetaRecord:
     movie_id: Union[str, int]
     # 名称
@@ -30,12 +30,14 @@ class MovieMetaRecord:
     identifiers: Dict[str, Union[str, int]] = dataclasses.field(default_factory=dict)
     # 互联网电影数据库
     imdb: Optional[str] = None
+    # 类型
+    genres: Optional[str] = None
     # 国家
     countries: Optional[str] = None
     # 上映日期
     release_date: Optional[str] = None
     # 评分
-    rating: Optional[int] = 0
+    rating: Optional[float] = 0
     # 语言
     languages: Optional[List[str]] = dataclasses.field(default_factory=list)
     # 标签
@@ -44,21 +46,10 @@ class MovieMetaRecord:
     description: Optional[str] = ""
 
 
-class MetadataProvider:
+class MetadataProvider(StagedProvider):
     __name__ = "Generic Metadata Provider"
     __id__ = "generic"
+    __kind__ = "movie"
 
     def __init__(self):
         pass
-
-    @abc.abstractmethod
-    def search(
-            self, query: str, generic_cover: str = "", locale: str = "cn"
-    ) -> Optional[List[MovieMetaRecord]]:
-        pass
-
-    @abc.abstractmethod
-    def search_one(
-            self, query: str, generic_cover: str = "", locale: str = "cn"
-    ) -> Optional[MovieMetaRecord]:
-        pass
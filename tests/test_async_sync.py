@@ -0,0 +1,70 @@
+import asyncio
+from urllib.parse import urlparse
+import pytest
+import book.douban
+import main
+from bench.server import StubServer
+from common import AdaptiveTokenBucket, NotionWriter, close_async_client, set_meta_cache, set_page_cache, \
+    set_rate_limiter
+from common.state import SyncStateStore
+from notion_client import AsyncClient as AsyncNotionClient
+
+PAGES = 12
+
+
+class FakeDatabases:
+
+    def __init__(self):
+        self.updates = []
+
+    def retrieve(self, database_id):
+        return {"properties": {"Tags": {"type": "multi_select", "multi_select": {"options": []}}}}
+
+    def update(self, database_id, properties):
+        self.updates.append(properties)
+        return {"properties": {"Tags": {"type": "multi_select",
+                                        "multi_select": {"options": properties["Tags"]["multi_select"]["options"]}}}}
+
+
+class FakeSchemaClient:
+
+    def __init__(self):
+        self.databases = FakeDatabases()
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    set_meta_cache(None)
+    set_page_cache(None)
+    stub = StubServer(pages=PAGES).start()
+    set_rate_limiter(urlparse(stub.base_url).netloc, AdaptiveTokenBucket(rate=1e9, burst=1e9, max_rate=1e9))
+    monkeypatch.setattr(book.douban, "DOUBAN_SEARCH_URL", f"{stub.base_url}/search")
+    monkeypatch.setattr(book.douban, "DOUBAN_BOOK_ISBN_URL", f"{stub.base_url}/isbn/{{}}/")
+    yield stub
+    stub.stop()
+
+
+def run_async_book(stub, state, schema_client=None):
+    async def run():
+        client = AsyncNotionClient(auth="test", base_url=stub.base_url)
+        try:
+            return await main.async_sync_book("book-database", client, state, writer=NotionWriter(client, rate=1e9),
+                                              schema_client=schema_client)
+        finally:
+            await close_async_client()
+            await client.aclose()
+
+    return asyncio.run(run())
+
+
+def test_async_sync_records_state_and_options(stub):
+    state = SyncStateStore(":memory:")
+    schema_client = FakeSchemaClient()
+    assert run_async_book(stub, state, schema_client) == PAGES
+    assert stub.requests["notion_update"] == PAGES
+    assert state.last_run("book-database") is not None
+    assert state.load_cursor("book-database", state.query_key(main.BOOK_QUERY_FILTER)) is None
+    assert list(state.dead_letters("book-database")) == []
+    # 新标签在写入页面之前建好
+    assert schema_client.databases.updates
+    assert {row[0] for row in state.conn.execute("SELECT status FROM pages")} == {"ok"}
@@ -0,0 +1,86 @@
+import pytest
+import common.cache
+from common.cache import MetaCache
+
+
+class FakeClock:
+
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(common.cache, "time", clock)
+    return clock
+
+
+def test_get_set_and_delete(clock):
+    cache = MetaCache(":memory:")
+    assert cache.get("book", "1") is None
+    cache.set("book", "1", {"title": "白夜行"})
+    assert cache.get("book", "1") == {"title": "白夜行"}
+    # 不同命名空间互不影响
+    assert cache.get("movie", "1") is None
+    cache.delete("book", "1")
+    assert cache.get("book", "1") is None
+    assert cache.stats() == {"book": {"hits": 1, "misses": 2}, "movie": {"hits": 0, "misses": 1}}
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = MetaCache(":memory:", ttl=10)
+    cache.set("book", "default", 1)
+    cache.set("book", "short", 2, ttl=5)
+    cache.set("book", "none", 3, ttl=0)
+    clock.now += 0.5
+    assert cache.get("book", "none") is None
+    clock.now += 5
+    assert cache.get("book", "short") is None
+    assert cache.get("book", "default") == 1
+    clock.now += 5
+    assert cache.get("book", "default") is None
+
+
+def test_evict_removes_expired_then_least_recently_used(clock):
+    cache = MetaCache(":memory:", ttl=100, max_entries=2)
+    for key in ("a", "b", "c"):
+        cache.set("book", key, key)
+        clock.now += 1
+    cache.set("book", "expired", "x", ttl=-1)
+    # 读取 a 之后 b 是最久没有访问的
+    assert cache.get("book", "a") == "a"
+    with cache.lock:
+        cache.evict()
+    assert cache.conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0] == 2
+    assert cache.get("book", "b") is None
+    assert cache.get("book", "a") == "a"
+    assert cache.get("book", "c") == "c"
+
+
+def test_set_evicts_every_interval(clock, monkeypatch):
+    monkeypatch.setattr(common.cache, "EVICT_INTERVAL", 3)
+    cache = MetaCache(":memory:", max_entries=1)
+    cache.set("book", "a", 1)
+    clock.now += 1
+    cache.set("book", "b", 2)
+    assert cache.conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0] == 2
+    clock.now += 1
+    cache.set("book", "c", 3)
+    assert cache.conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0] == 1
+    assert cache.get("book", "c") == 3
+
+
+def test_version_change_invalidates_entries(tmp_path, clock, monkeypatch):
+    path = str(tmp_path / "cache" / "douban.sqlite3")
+    cache = MetaCache(path)
+    cache.set("book", "1", "old")
+    cache.close()
+    cache = MetaCache(path)
+    assert cache.get("book", "1") == "old"
+    monkeypatch.setattr(common.cache, "META_CACHE_VERSION", common.cache.META_CACHE_VERSION + 1)
+    assert cache.get("book", "1") is None
+    cache.close()
@@ -0,0 +1,19 @@
+from book.douban import normalize_isbn
+
+
+def test_normalize_isbn_13():
+    assert normalize_isbn("978-7-5321-8066-8") == "9787532180668"
+    assert normalize_isbn(9787532180668) == "9787532180668"
+
+
+def test_normalize_isbn_10_to_13():
+    # 校验位为 X 的 ISBN-10, 大小写都可以
+    assert normalize_isbn("080442957x") == normalize_isbn("080442957X") == "9780804429573"
+    assert normalize_isbn("0306406152") == "9780306406157"
+    assert normalize_isbn("0-306-40615-2") == "9780306406157"
+
+
+def test_normalize_isbn_rejects_invalid():
+    assert normalize_isbn("") is None
+    assert normalize_isbn("abc") is None
+    assert normalize_isbn("12345") is None
@@ -0,0 +1,42 @@
+import json
+import os
+import threading
+from common.metrics import Metrics
+
+
+def test_concurrent_exports_leave_valid_files(tmp_path):
+    metrics = Metrics()
+    metrics.incr("pages", result="synced")
+    with metrics.timer("stage", stage="fetch"):
+        pass
+    summary = tmp_path / "summary.json"
+    prometheus = tmp_path / "metrics.prom"
+    errors = []
+
+    def export():
+        try:
+            for _ in range(20):
+                metrics.export(str(summary), str(prometheus))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=export) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert json.loads(summary.read_text(encoding="utf-8"))["counters"]["pages"] == \
+        [{"labels": {"result": "synced"}, "value": 1}]
+    assert 'notion_sync_pages_total{result="synced"} 1' in prometheus.read_text(encoding="utf-8")
+    assert sorted(os.listdir(tmp_path)) == ["metrics.prom", "summary.json"]
+
+
+def test_histogram_quantiles():
+    metrics = Metrics(buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 2.0):
+        metrics.observe("stage", value, stage="parse")
+    histogram = metrics.summary()["histograms"]["stage"][0]
+    assert histogram["count"] == 4
+    assert histogram["p50"] == 1.0
+    assert histogram["p99"] == 2.0
@@ -0,0 +1,39 @@
+import json
+import pytest
+from common.cache import MetaCache, set_meta_cache
+from movie import DoubanaMovieProvider, MovieMetaRecord
+from movie.douban import DoubanMovieSearcher, normalize_imdb
+
+
+@pytest.fixture
+def cache():
+    cache = MetaCache(":memory:")
+    set_meta_cache(cache)
+    yield cache
+    set_meta_cache(None)
+
+
+def make_movie(url, imdb):
+    return MovieMetaRecord(movie_id=url.rstrip("/").rsplit("/", 1)[1], title="电影", directors=[], actors=[], url=url,
+                           source=None, imdb=imdb)
+
+
+def test_normalize_imdb():
+    assert normalize_imdb(" TT0111161 ") == "tt0111161"
+    assert normalize_imdb("0111161") is None
+
+
+def test_suggestion_is_cached_only_after_imdb_matches(cache):
+    content = json.dumps([{"url": "https://movie.douban.com/subject/1292052/?suggest=tt0111161"}]).encode()
+    url = DoubanMovieSearcher.suggested_url(content)
+    assert url == "https://movie.douban.com/subject/1292052/"
+    assert DoubanMovieSearcher.cached_imdb_url("tt0111161") is None
+    provider = DoubanaMovieProvider()
+    assert not provider.verify("tt0111161", make_movie(url, "tt0000001"))
+    assert DoubanMovieSearcher.cached_imdb_url("tt0111161") is None
+    assert provider.verify("tt0111161", make_movie(url, "tt0111161"))
+    assert DoubanMovieSearcher.cached_imdb_url("tt0111161") == url
+
+
+def test_verify_accepts_any_record_for_titles(cache):
+    assert DoubanaMovieProvider().verify("肖申克的救赎", make_movie("https://movie.douban.com/subject/1/", None))
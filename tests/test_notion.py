@@ -0,0 +1,74 @@
+from common.notion import NotionWriter, diff_properties, normalize_property
+
+
+class FakePages:
+
+    def __init__(self):
+        self.updates = []
+
+    def update(self, **kwargs):
+        self.updates.append(kwargs)
+
+
+class FakeClient:
+
+    def __init__(self):
+        self.pages = FakePages()
+
+
+def test_normalize_property_matches_query_result():
+    local = {"multi_select": [{"name": "b"}, {"name": "a"}]}
+    remote = {"id": "x", "type": "multi_select", "multi_select": [{"id": "1", "name": "a"}, {"id": "2", "name": "b"}]}
+    assert normalize_property(local) == normalize_property(remote) == ("a", "b")
+
+
+def test_normalize_property_date_and_text():
+    assert normalize_property({"date": {"start": "2020-01-02T00:00:00.000+08:00"}}) == ("2020-01-02", None)
+    assert normalize_property({"date": None}) is None
+    assert normalize_property({"rich_text": [{"text": {"content": "ab"}}]}) == \
+        normalize_property({"type": "rich_text", "rich_text": [{"plain_text": "ab"}]})
+    assert normalize_property({"select": {"name": "x"}}) == "x"
+    assert normalize_property({"url": ""}) is None
+
+
+def test_diff_properties_keeps_only_changes():
+    properties = {
+        "标题": {"title": [{"text": {"content": "书名"}}]},
+        "评分": {"number": 8.5},
+        "新属性": {"url": "https://example.com"},
+    }
+    current = {
+        "标题": {"type": "title", "title": [{"plain_text": "书名"}]},
+        "评分": {"type": "number", "number": 8.0},
+    }
+    assert diff_properties(properties, current) == {"评分": {"number": 8.5}, "新属性": {"url": "https://example.com"}}
+
+
+def test_writer_skips_unchanged_current():
+    client = FakeClient()
+    writer = NotionWriter(client, rate=1000)
+    properties = {"properties": {"评分": {"number": 8.0}}}
+    assert not writer.update("page", properties, current={"评分": {"type": "number", "number": 8.0}})
+    assert client.pages.updates == []
+
+
+def test_writer_diffs_against_current_even_when_hash_matches():
+    # 页面在 Notion 里被改过时, 和上次写入的摘要相同也要写回
+    client = FakeClient()
+    writer = NotionWriter(client, rate=1000)
+    properties = {"properties": {"评分": {"number": 8.0}, "标题": {"title": [{"text": {"content": "书名"}}]}}}
+    previous = writer.payload_hash(properties)
+    current = {"评分": {"type": "number", "number": 7.0},
+               "标题": {"type": "title", "title": [{"plain_text": "书名"}]}}
+    assert writer.update("page", properties, previous=previous, current=current)
+    assert client.pages.updates == [{"page_id": "page", "properties": {"评分": {"number": 8.0}}}]
+
+
+def test_writer_skips_same_payload_without_current():
+    client = FakeClient()
+    writer = NotionWriter(client, rate=1000)
+    properties = {"properties": {"评分": {"number": 8.0}}}
+    assert writer.update("page", properties)
+    assert not writer.update("page", properties)
+    assert not writer.update("other", properties, previous=writer.payload_hash(properties))
+    assert len(client.pages.updates) == 1
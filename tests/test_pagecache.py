@@ -0,0 +1,145 @@
+import asyncio
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from common.aio import AsyncHttpClient
+from common.http import HttpTransport
+from common.metrics import Metrics, set_metrics
+from common.pagecache import PageCache, get_page_cache, page_key, set_page_cache
+from common.ratelimit import AdaptiveTokenBucket, set_rate_limiter
+
+
+# 带 ETag 的页面, If-None-Match 命中时返回 304; version 变化后返回新内容
+class EtagServer:
+
+    def __init__(self):
+        self.version = 1
+        self.statuses = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                etag = f'"v{server.version}"'
+                if self.headers.get("If-None-Match") == etag:
+                    server.statuses.append(304)
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+                body = f"page v{server.version}".encode()
+                server.statuses.append(200)
+                self.send_response(200)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.host = f"127.0.0.1:{self.server.server_port}"
+        self.url = f"http://{self.host}/page"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def server():
+    server = EtagServer()
+    set_rate_limiter(server.host, AdaptiveTokenBucket(rate=1e9, burst=1e9, max_rate=1e9))
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def metrics():
+    metrics = Metrics()
+    set_metrics(metrics)
+    yield metrics
+    set_metrics(Metrics())
+
+
+@pytest.fixture
+def page_cache():
+    yield
+    set_page_cache(None)
+
+
+def page_cache_results(metrics):
+    return {item["labels"]["result"]: item["value"] for item in metrics.summary()["counters"].get("page_cache", [])}
+
+
+def test_page_cache_round_trip():
+    cache = PageCache(":memory:", ttl=60)
+    key = page_key("https://book.douban.com/j/subject_suggest", {"q": "白夜行"})
+    assert cache.get(key) is None
+    cache.set(key, b"content", '"v1"', "Mon, 01 Jan 2024 00:00:00 GMT")
+    page = cache.get(key)
+    assert page.content == b"content" and not page.expired
+    assert page.conditional_headers({"Accept": "*/*"}) == {
+        "Accept": "*/*", "If-None-Match": '"v1"', "If-Modified-Since": "Mon, 01 Jan 2024 00:00:00 GMT"}
+    assert list(cache.iter_pages()) == [(key, b"content")]
+
+
+def test_expired_page_is_kept_and_touch_extends_it():
+    cache = PageCache(":memory:", ttl=-1)
+    cache.set("https://example.com/", b"content")
+    assert cache.get("https://example.com/").expired
+    assert cache.get("https://example.com/").conditional_headers() == {}
+    cache.ttl = 60
+    cache.touch("https://example.com/")
+    assert not cache.get("https://example.com/").expired
+
+
+def test_get_page_revalidates_with_etag(server, metrics, page_cache):
+    set_page_cache(PageCache(":memory:", ttl=0))
+    transport = HttpTransport(retries=0)
+    try:
+        assert transport.get_page(server.url) == b"page v1"
+        time.sleep(0.01)
+        # 过期后带 If-None-Match 请求, 304 时返回缓存的内容
+        assert transport.get_page(server.url) == b"page v1"
+        server.version = 2
+        time.sleep(0.01)
+        assert transport.get_page(server.url) == b"page v2"
+    finally:
+        transport.close()
+    assert server.statuses == [200, 304, 200]
+    assert page_cache_results(metrics) == {"miss": 1, "revalidated": 1, "changed": 1}
+    assert get_page_cache().get(page_key(server.url)).etag == '"v2"'
+
+
+def test_get_page_returns_fresh_page_without_request(server, metrics, page_cache):
+    set_page_cache(PageCache(":memory:", ttl=60))
+    transport = HttpTransport(retries=0)
+    try:
+        assert transport.get_page(server.url) == b"page v1"
+        assert transport.get_page(server.url) == b"page v1"
+    finally:
+        transport.close()
+    assert server.statuses == [200]
+    assert page_cache_results(metrics) == {"miss": 1, "hit": 1}
+
+
+def test_async_get_page_revalidates_with_etag(server, metrics, page_cache):
+    set_page_cache(PageCache(":memory:", ttl=0))
+
+    async def run():
+        client = AsyncHttpClient(retries=0)
+        try:
+            first = await client.get_page(server.url)
+            await asyncio.sleep(0.01)
+            return first, await client.get_page(server.url)
+        finally:
+            await client.close()
+
+    assert asyncio.run(run()) == (b"page v1", b"page v1")
+    assert server.statuses == [200, 304]
+    assert page_cache_results(metrics) == {"miss": 1, "revalidated": 1}
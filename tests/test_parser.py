@@ -0,0 +1,87 @@
+import os
+from book.douban import DoubanBookHtmlParser
+from book.meta import MetaRecord, MetaSourceInfo
+from movie.douban import DoubanMovieHtmlParser
+from movie.meta import MovieMetaRecord, MovieMetaSourceInfo
+
+FIXTURES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bench", "fixtures")
+BOOK_URL = "https://book.douban.com/subject/10554308/"
+MOVIE_URL = "https://movie.douban.com/subject/1292052/"
+
+
+def load_fixture(name: str) -> bytes:
+    with open(os.path.join(FIXTURES, name), "rb") as f:
+        return f.read()
+
+
+def expected_book(tags):
+    return MetaRecord(
+        id="10554308",
+        title="白夜行:东野圭吾作品",
+        authors=["[日] 东野圭吾", "刘姿君"],
+        url=BOOK_URL,
+        source=MetaSourceInfo("", "", ""),
+        cover="https://img1.doubanio.com/view/subject/l/public/s24514468.jpg",
+        series="新经典文库·东野圭吾作品",
+        series_index=0,
+        identifiers={"isbn": "9787544258609"},
+        publisher="南海出版公司",
+        publishedDate="2013-01-01",
+        rating=4.6,
+        languages=[],
+        tags=tags,
+        description='<div class="intro"><p>“只希望能手牵手在太阳下散步”，这个象征故事内核的绝望念想，'
+                    '有如一个美丽的幌子，随着无数凌乱、压抑、悲凉的故事片段像纪录片一样一一还原。</p>'
+                    '<p>没有一部小说能像《白夜行》一样，将人性的黑暗面描绘得如此彻底。</p></div>',
+    )
+
+
+def expected_movie(tags):
+    return MovieMetaRecord(
+        movie_id="1292052",
+        title="肖申克的救赎 The Shawshank Redemption",
+        directors=["弗兰克·德拉邦特"],
+        actors=["蒂姆·罗宾斯", "摩根·弗里曼", "鲍勃·冈顿"],
+        url=MOVIE_URL,
+        source=MovieMetaSourceInfo("", "", ""),
+        cover="https://img2.doubanio.com/view/photo/s_ratio_poster/public/p480747492.jpg",
+        identifiers={"imdb": "tt0111161"},
+        imdb="tt0111161",
+        genres="剧情",
+        countries="美国",
+        release_date="1994-09-10",
+        rating=4.85,
+        languages="英语",
+        tags=tags,
+        description="",
+    )
+
+
+def test_parse_book():
+    record = DoubanBookHtmlParser().parse_book(BOOK_URL, load_fixture("book_subject.html"))
+    assert record == expected_book(["东野圭吾", "推理", "日本", "小说", "日本文学"])
+
+
+def test_parse_book_without_tag_links():
+    # 页面没有标签链接时从 criteria 里取标签
+    content = load_fixture("book_subject.html").replace(b'class="  tag"', b'class=""')
+    record = DoubanBookHtmlParser().parse_book(BOOK_URL, content)
+    assert record == expected_book(["小说", "日本", "推理", "东野圭吾"])
+
+
+def test_parse_movie_without_tag_links():
+    # 详情页的标签链接没有 tag 样式, 标签来自 criteria
+    record = DoubanMovieHtmlParser().parse_movie(MOVIE_URL, load_fixture("movie_subject.html"))
+    assert record == expected_movie(["经典", "励志", "信念", "美国", "人性"])
+
+
+def test_parse_movie_with_tag_links():
+    content = load_fixture("movie_subject.html").replace(b'href="/tag/', b'class="tag" href="/tag/')
+    content = content.replace(b'" class="">', b'">')
+    record = DoubanMovieHtmlParser().parse_movie(MOVIE_URL, content)
+    assert record == expected_movie(["经典", "励志"])
+
+
+def test_parse_empty_page():
+    record = DoubanBookHtmlParser().parse_book(BOOK_URL, b"")
+    assert record.title == "" and record.identifiers == {}
@@ -0,0 +1,67 @@
+import threading
+import pytest
+from common.pipeline import Pipeline, Stage
+
+
+def test_pipeline_runs_all_stages():
+    pipeline = Pipeline([Stage("double", lambda x: x * 2, workers=3), Stage("drop_odd", lambda x: x if x % 4 else None)])
+    assert pipeline.run(range(10)) == 5
+
+
+def test_pipeline_routes_errors_and_continues():
+    errors = []
+
+    def fail_three(x):
+        if x == 3:
+            raise ValueError("three")
+        return x
+
+    pipeline = Pipeline([Stage("check", fail_three, workers=2)],
+                        on_error=lambda item, stage, e: errors.append((item, stage, str(e))))
+    assert pipeline.run(range(5)) == 4
+    assert errors == [(3, "check", "three")]
+
+
+def test_pipeline_stops_workers_when_source_fails():
+    def source():
+        yield 1
+        raise RuntimeError("source")
+
+    before = threading.active_count()
+    pipeline = Pipeline([Stage("a", lambda x: x, workers=2), Stage("b", lambda x: x, workers=2)])
+    with pytest.raises(RuntimeError):
+        pipeline.run(source())
+    assert threading.active_count() == before
+    assert pipeline.completed == 1
+
+
+def test_pipeline_batches():
+    batches = []
+    errors = []
+
+    def handle(batch):
+        batches.append(list(batch))
+        return [ValueError(x) if x == 2 else x for x in batch]
+
+    pipeline = Pipeline([Stage("batch", handle, batch_size=4, batch_timeout=1.0)],
+                        on_error=lambda item, stage, e: errors.append(item))
+    assert pipeline.run(range(10)) == 9
+    assert [len(batch) for batch in batches] == [4, 4, 2]
+    assert errors == [2]
+
+
+def test_pipeline_batch_exception_fails_whole_batch():
+    errors = []
+
+    def handle(batch):
+        raise RuntimeError("batch")
+
+    pipeline = Pipeline([Stage("batch", handle, batch_size=3, batch_timeout=1.0)],
+                        on_error=lambda item, stage, e: errors.append(item))
+    assert pipeline.run(range(3)) == 0
+    assert sorted(errors) == [0, 1, 2]
+
+
+def test_stage_needs_worker():
+    with pytest.raises(ValueError):
+        Stage("empty", lambda x: x, workers=0)
@@ -0,0 +1,142 @@
+import asyncio
+import dataclasses
+import threading
+import time
+from concurrent.futures import Executor, Future
+from typing import Dict, Optional
+from common.provider import MODE_FALLBACK, MODE_RACE, Provider, ProviderGroup, ProviderRegistry, RegisteredProvider, \
+    merge_records
+
+
+@dataclasses.dataclass
+class Record:
+    title: str
+    cover: str = ""
+    tags: list = dataclasses.field(default_factory=list)
+    identifiers: Dict[str, str] = dataclasses.field(default_factory=dict)
+
+
+# 本地替身数据源: delay 秒后返回 record, 或抛出 error
+class FakeProvider(Provider):
+
+    def __init__(self, name: str, record: Optional[Record] = None, delay: float = 0.0,
+                 error: Optional[Exception] = None):
+        self.__id__ = name
+        self.record = record
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def search(self, query, generic_cover="", locale="cn"):
+        record = self.search_one(query)
+        return [record] if record is not None else []
+
+    def search_one(self, query, generic_cover="", locale="cn"):
+        with self.lock:
+            self.calls += 1
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return self.record
+
+    async def asearch_one(self, query, generic_cover="", locale="cn"):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return self.record
+
+
+# 提交时直接执行, 所有结果在 race 开始等待前都已经返回
+class InlineExecutor(Executor):
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+def group(mode, *providers, budget=1.0):
+    return ProviderGroup([RegisteredProvider(provider, budget, priority) for priority, provider
+                          in zip(range(len(providers), 0, -1), providers)], mode)
+
+
+def test_merge_records_fills_missing_fields():
+    primary = Record(title="三体", identifiers={"douban": "1"})
+    partial = Record(title="", cover="cover.jpg", tags=["科幻"], identifiers={"isbn": "9787536692930", "douban": "x"})
+    merged = merge_records(primary, [partial])
+    assert merged == Record(title="三体", cover="cover.jpg", tags=["科幻"],
+                            identifiers={"isbn": "9787536692930", "douban": "1"})
+    assert primary.cover == ""
+
+
+def test_race_returns_first_good_answer():
+    slow = FakeProvider("slow", Record(title="slow"), delay=0.5)
+    failing = FakeProvider("failing", error=RuntimeError("down"))
+    fast = FakeProvider("fast", Record(title="fast"), delay=0.01)
+    started = time.monotonic()
+    record = group(MODE_RACE, slow, failing, fast).search_one("q")
+    assert record.title == "fast"
+    assert time.monotonic() - started < 0.4
+
+
+def test_race_merges_answers_already_returned():
+    partial = FakeProvider("partial", Record(title="", cover="cover.jpg"))
+    full = FakeProvider("full", Record(title="三体", tags=["科幻"]))
+    # 两个结果同时返回时高优先级的 partial 胜出, full 的结果用来补齐缺失字段
+    entries = [RegisteredProvider(partial, 1.0, 2), RegisteredProvider(full, 1.0, 1)]
+    record = ProviderGroup(entries, MODE_RACE, InlineExecutor()).search_one("q")
+    assert record == Record(title="三体", cover="cover.jpg", tags=["科幻"])
+
+
+def test_race_drops_provider_over_budget():
+    slow = FakeProvider("slow", Record(title="slow"), delay=0.5)
+    started = time.monotonic()
+    assert group(MODE_RACE, slow, budget=0.1).search_one("q") is None
+    assert time.monotonic() - started < 0.4
+
+
+def test_fallback_follows_priority():
+    failing = FakeProvider("failing", error=RuntimeError("down"))
+    empty = FakeProvider("empty")
+    good = FakeProvider("good", Record(title="good"))
+    unused = FakeProvider("unused", Record(title="unused"))
+    assert group(MODE_FALLBACK, failing, empty, good, unused).search_one("q").title == "good"
+    assert (failing.calls, empty.calls, good.calls, unused.calls) == (1, 1, 1, 0)
+
+
+def test_fallback_skips_provider_over_budget():
+    slow = FakeProvider("slow", Record(title="slow"), delay=0.5)
+    good = FakeProvider("good", Record(title="good"))
+    assert group(MODE_FALLBACK, slow, good, budget=0.1).search_one("q").title == "good"
+
+
+def test_async_race_and_fallback():
+    slow = FakeProvider("slow", Record(title="slow"), delay=0.5)
+    failing = FakeProvider("failing", error=RuntimeError("down"))
+    fast = FakeProvider("fast", Record(title="fast"), delay=0.01)
+
+    async def main():
+        race = await group(MODE_RACE, slow, failing, fast).asearch_one("q")
+        fallback = await group(MODE_FALLBACK, failing, slow, fast, budget=0.1).asearch_one("q")
+        return race, fallback
+
+    race, fallback = asyncio.run(main())
+    assert race.title == "fast"
+    assert fallback.title == "fast"
+
+
+def test_registry_returns_single_provider_or_group():
+    registry = ProviderRegistry()
+    only = FakeProvider("only", Record(title="only"))
+    registry.register("book", only)
+    assert registry.provider("book") is only
+    registry.register("book", FakeProvider("other"), priority=1)
+    provider = registry.provider("book")
+    assert isinstance(provider, ProviderGroup)
+    assert [entry.provider.__id__ for entry in provider.entries] == ["other", "only"]
+    assert provider.search_one("q").title == "only"
@@ -0,0 +1,87 @@
+import pytest
+from common.schema import OptionIndex, normalize_option
+
+
+class FakeDatabases:
+
+    def __init__(self, options, fail=False):
+        self.options = options
+        self.fail = fail
+        self.updates = []
+
+    def response(self):
+        return {"properties": {
+            "Tags": {"type": "multi_select", "multi_select": {"options": list(self.options)}},
+            "Name": {"type": "title", "title": {}},
+        }}
+
+    def retrieve(self, database_id):
+        return self.response()
+
+    def update(self, database_id, properties):
+        self.updates.append(properties)
+        if self.fail:
+            raise RuntimeError("schema update failed")
+        for option in properties["Tags"]["multi_select"]["options"]:
+            if "id" not in option:
+                self.options.append({"id": f"new{len(self.options)}", "name": option["name"]})
+        return self.response()
+
+
+class FakeClient:
+
+    def __init__(self, databases):
+        self.databases = databases
+
+
+def test_normalize_option_full_width_and_spaces():
+    assert normalize_option("ＡＢＣ　１２３") == "ABC 123"
+    assert normalize_option("  村上  春树 ") == "村上 春树"
+    assert normalize_option(None) == ""
+
+
+def test_normalize_option_prefixes():
+    assert normalize_option("[日]村上春树") == "村上春树"
+    assert normalize_option("(美) 海明威") == "海明威"
+    assert normalize_option("【英】毛姆") == "毛姆"
+    assert normalize_option("〔法〕加缪") == "加缪"
+    assert normalize_option("译者: 林少华") == "林少华"
+    assert normalize_option("译：林少华") == "林少华"
+
+
+def test_normalize_option_commas():
+    # Notion 的选项名不能包含逗号
+    assert normalize_option("Smith, John") == "Smith John"
+    assert normalize_option("Smith，John") == "Smith John"
+
+
+def test_apply_uses_existing_spelling():
+    databases = FakeDatabases([{"id": "1", "name": "Science Fiction"}])
+    index = OptionIndex(FakeClient(databases), "db")
+    result = index.apply({"Tags": {"multi_select": [{"name": "science fiction"}, {"name": "Science  Fiction"}]}})
+    assert result["Tags"] == {"multi_select": [{"name": "Science Fiction"}]}
+    assert index.flush() == 0
+    assert databases.updates == []
+
+
+def test_flush_keeps_existing_option_ids():
+    databases = FakeDatabases([{"id": "1", "name": "小说", "color": "red"}])
+    index = OptionIndex(FakeClient(databases), "db")
+    index.apply({"Tags": {"multi_select": [{"name": "小说"}, {"name": "日本"}]}})
+    assert index.flush() == 1
+    assert databases.updates == [{"Tags": {"multi_select": {"options": [{"id": "1"}, {"name": "日本"}]}}}]
+    index.apply({"Tags": {"multi_select": [{"name": "文学"}]}})
+    index.flush()
+    assert databases.updates[1] == {"Tags": {"multi_select": {"options": [{"id": "1"}, {"id": "new1"},
+                                                                          {"name": "文学"}]}}}
+
+
+def test_failed_flush_keeps_pending_options():
+    databases = FakeDatabases([], fail=True)
+    index = OptionIndex(FakeClient(databases), "db")
+    index.apply({"Tags": {"multi_select": [{"name": "日本"}]}})
+    with pytest.raises(RuntimeError):
+        index.flush()
+    databases.fail = False
+    assert index.flush() == 1
+    assert databases.updates[-1] == {"Tags": {"multi_select": {"options": [{"name": "日本"}]}}}
@@ -0,0 +1,70 @@
+import os
+import pytest
+from lxml import etree
+import book.douban
+import movie.douban
+from book.douban import DOUBAN_CONCURRENCY_SIZE, DoubanBookSearcher
+from movie.douban import DoubanMovieSearcher
+
+FIXTURES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bench", "fixtures")
+
+
+def load_fixture(name: str) -> bytes:
+    with open(os.path.join(FIXTURES, name), "rb") as f:
+        return f.read()
+
+
+def xpath_urls(searcher, content: bytes):
+    # 增量解析之前的实现
+    html = etree.HTML(content)
+    urls = [searcher.calc_url(link.attrib.get('href', '')) for link in html.xpath('//a[@class="nbg"]')]
+    return [url for url in urls if url][:DOUBAN_CONCURRENCY_SIZE]
+
+
+SEARCHERS = [
+    (book.douban, DoubanBookSearcher, "extract_book_urls", "book_search.html"),
+    (movie.douban, DoubanMovieSearcher, "extract_movie_urls", "movie_search.html"),
+]
+
+
+@pytest.fixture(params=SEARCHERS, ids=["book", "movie"])
+def case(request):
+    module, searcher_class, method, fixture = request.param
+    searcher = searcher_class()
+    return module, searcher, getattr(searcher, method), load_fixture(fixture)
+
+
+def test_extract_urls_matches_xpath(case):
+    _, searcher, extract, content = case
+    urls = extract(content)
+    assert len(urls) == DOUBAN_CONCURRENCY_SIZE
+    assert urls == xpath_urls(searcher, content)
+
+
+def test_extract_urls_across_chunk_boundaries(case, monkeypatch):
+    # 块边界落在标签中间也要得到同样的结果
+    module, searcher, extract, content = case
+    monkeypatch.setattr(module, "DOUBAN_SEARCH_CHUNK_SIZE", 7)
+    assert extract(content) == xpath_urls(searcher, content)
+
+
+def test_extract_urls_from_truncated_page(case):
+    _, searcher, extract, content = case
+    # 截断在第三个结果链接的中间
+    cut = content.index(b'class="nbg"', content.index(b'class="nbg"', content.index(b'class="nbg"') + 1) + 1)
+    truncated = content[:cut + 5]
+    urls = extract(truncated)
+    assert len(urls) == 2
+    assert urls == xpath_urls(searcher, content)[:2]
+
+
+def test_extract_urls_skips_invalid_links(case):
+    _, _, extract, _ = case
+    content = b'<html><body>' \
+              b'<a class="nbg" href="https://www.douban.com/link2/?url=https%3A%2F%2Fwww.douban.com%2Fpeople%2F1%2F">x</a>' \
+              b'<a class="nbg" href="/no-redirect">x</a>' \
+              b'<a class="other" href="https://www.douban.com/link2/?url=https%3A%2F%2Fexample.com%2Fsubject%2F2%2F">x</a>' \
+              b'<a class="nbg" href="https://www.douban.com/link2/?url=https%3A%2F%2Fexample.com%2Fsubject%2F3%2F&query=q">x</a>' \
+              b'</body></html>'
+    assert extract(content) == ["https://example.com/subject/3/"]
+    assert extract(b"") == []
@@ -0,0 +1,98 @@
+import asyncio
+import threading
+import time
+import pytest
+from common.singleflight import SingleFlight
+
+
+def test_do_shares_one_call():
+    flight = SingleFlight("test")
+    calls = []
+    started = threading.Event()
+
+    def fetch():
+        calls.append(1)
+        started.set()
+        time.sleep(0.1)
+        return "result"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do("key", fetch))) for _ in range(4)]
+    threads[0].start()
+    started.wait()
+    for thread in threads[1:]:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ["result"] * 4
+    assert len(calls) == 1
+    assert flight.calls == {}
+
+
+def test_do_shares_errors():
+    flight = SingleFlight("test")
+
+    def fail():
+        raise ValueError("fail")
+
+    with pytest.raises(ValueError):
+        flight.do("key", fail)
+    assert flight.calls == {}
+
+
+def test_ado_shares_one_call():
+    flight = SingleFlight("test")
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "result"
+
+    async def main():
+        return await asyncio.gather(*(flight.ado("key", fetch) for _ in range(3)))
+
+    assert asyncio.run(main()) == ["result"] * 3
+    assert len(calls) == 1
+    assert flight.acalls == {}
+
+
+def test_ado_cancelled_caller_does_not_cancel_others():
+    flight = SingleFlight("test")
+
+    async def fetch():
+        await asyncio.sleep(0.05)
+        return "result"
+
+    async def main():
+        first = asyncio.ensure_future(flight.ado("key", fetch))
+        second = asyncio.ensure_future(flight.ado("key", fetch))
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(main()) == "result"
+    assert flight.acalls == {}
+
+
+def test_ado_all_callers_cancelled_cancels_call():
+    flight = SingleFlight("test")
+    finished = []
+
+    async def fetch():
+        await asyncio.sleep(0.05)
+        finished.append(1)
+
+    async def main():
+        caller = asyncio.ensure_future(flight.ado("key", fetch))
+        await asyncio.sleep(0)
+        caller.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await caller
+        assert flight.acalls == {}
+        await asyncio.sleep(0.1)
+
+    asyncio.run(main())
+    assert finished == []
@@ -0,0 +1,54 @@
+from common.state import SyncStateStore
+
+
+def make_store():
+    return SyncStateStore(":memory:", refresh_interval=100, retry_base=10, retry_max=40)
+
+
+def test_should_sync_new_and_refreshed_pages():
+    store = make_store()
+    assert store.should_sync("page", "isbn")
+    store.record_success("db", "page", "书名", "isbn", "1", "hash")
+    assert not store.should_sync("page", "isbn")
+    assert store.should_sync("page", "other")
+    assert store.should_sync("page", "isbn", now=store.conn.execute("SELECT last_success FROM pages").fetchone()[0]
+                             + 101)
+
+
+def test_should_sync_force_overrides_recent_success():
+    # 封面为空的页面即使刚同步过也要重新处理
+    store = make_store()
+    store.record_success("db", "page", "书名", "isbn", "1", "hash")
+    assert not store.should_sync("page", "isbn")
+    assert store.should_sync("page", "isbn", force=True)
+
+
+def test_should_sync_force_keeps_failure_backoff():
+    # 封面为空但最近连续失败的页面仍要等到退避结束
+    store = make_store()
+    store.record_failure("db", "page", "书名", "isbn", "error")
+    store.record_failure("db", "page", "书名", "isbn", "error")
+    last_attempt = store.conn.execute("SELECT last_attempt FROM pages").fetchone()[0]
+    assert not store.should_sync("page", "isbn", now=last_attempt + 1, force=True)
+    assert store.should_sync("page", "isbn", now=last_attempt + 20, force=True)
+
+
+def test_should_sync_failures_back_off():
+    store = make_store()
+    store.record_failure("db", "page", "书名", "isbn", "error")
+    last_attempt = store.conn.execute("SELECT last_attempt FROM pages").fetchone()[0]
+    assert not store.should_sync("page", "isbn", now=last_attempt + 5)
+    assert store.should_sync("page", "isbn", now=last_attempt + 10)
+    store.record_failure("db", "page", "书名", "isbn", "error")
+    last_attempt = store.conn.execute("SELECT last_attempt FROM pages").fetchone()[0]
+    assert not store.should_sync("page", "isbn", now=last_attempt + 10)
+    assert store.should_sync("page", "isbn", now=last_attempt + 20)
+
+
+def test_should_sync_pending_pages():
+    store = make_store()
+    store.record_success("db", "page", "书名", "isbn", "1", "hash")
+    store.record_pending("db", "page", "书名", "isbn")
+    assert store.should_sync("page", "isbn")
+    assert store.content_hash("page") == "hash"
+    assert list(store.pending_pages("db")) == [("page", "书名", "isbn")]
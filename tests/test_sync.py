@@ -0,0 +1,160 @@
+from book import DoubanBookProvider, MetaRecord
+from common.notion import NotionWriter
+from common.state import SyncStateStore
+from common.provider import ProviderRegistry
+from common.schema import OptionIndex
+from main import SyncTask, book_isbn, convert_page, cover_missing, retry_failed_books, to_book_page, select_tasks, sync_info, BOOK_QUERY_FILTER
+
+
+def test_select_tasks_backs_off_failing_pages_with_empty_cover():
+    store = SyncStateStore(":memory:")
+    item = {"id": "page", "properties": {"Cover": {"type": "files", "files": []}}}
+    assert cover_missing(item, BOOK_QUERY_FILTER)
+    store.record_failure("db", "page", "书名", "isbn", "search: no result")
+    store.record_failure("db", "page", "书名", "isbn", "search: no result")
+    task = SyncTask(page_id="page", name="书名", query="isbn", database_id="db", force=True)
+    assert list(select_tasks([task], store)) == []
+    store.record_success("db", "page", "书名", "isbn", "1", "hash")
+    assert list(select_tasks([task], store)) == [task]
+
+
+class FakePages:
+
+    def __init__(self, items=None):
+        self.updates = []
+        self.items = items or {}
+
+    def retrieve(self, page_id):
+        return self.items[page_id]
+
+    def update(self, **kwargs):
+        self.updates.append(kwargs)
+
+
+class FakeDatabases:
+
+    def __init__(self):
+        self.updates = []
+
+    def retrieve(self, database_id):
+        return {"properties": {"Authors": {"type": "multi_select",
+                                           "multi_select": {"options": [{"id": "a", "name": "村上春树"}]}}}}
+
+    def update(self, database_id, properties):
+        self.updates.append(properties)
+        return self.retrieve(database_id)
+
+
+class FakeClient:
+
+    def __init__(self):
+        self.pages = FakePages()
+        self.databases = FakeDatabases()
+
+
+class FakeBookProvider(DoubanBookProvider):
+    # 搜索结果里排第一的条目 ISBN 对不上, 第二个才是要找的书
+    isbns = {"https://book.douban.com/subject/1/": "9787111111111",
+             "https://book.douban.com/subject/2/": "9787532180668"}
+
+    def search_urls(self, query):
+        return list(self.isbns)
+
+    def cached(self, url):
+        return None
+
+    def fetch(self, url):
+        return url.encode()
+
+    def parse(self, url, content):
+        return MetaRecord(id=url[-2], title=url, authors=[], url=url, source=None,
+                          identifiers={"isbn": self.isbns[url]})
+
+
+def sync_fake_book(isbn):
+    client = FakeClient()
+    writer = NotionWriter(client, rate=1000)
+    task = SyncTask(page_id="page", name="书名", query=isbn)
+    assert sync_info([task], FakeBookProvider(), client, lambda record: {"properties": {"url": {"url": record.url}}},
+                     writer=writer) == 1
+    return client.pages.updates[0]["properties"]["url"]["url"]
+
+
+def test_sync_info_skips_candidates_with_other_isbn():
+    assert sync_fake_book("978-7-5321-8066-8") == "https://book.douban.com/subject/2/"
+
+
+def test_sync_info_falls_back_to_first_candidate():
+    assert sync_fake_book("9787000000000") == "https://book.douban.com/subject/1/"
+
+
+def test_retry_failed_uses_shared_writer_and_options():
+    class AuthorProvider(FakeBookProvider):
+
+        def parse(self, url, content):
+            record = super().parse(url, content)
+            record.authors = ["[日]村上春树"]
+            return record
+
+    client = FakeClient()
+    writer = NotionWriter(client, rate=1000)
+    registry = ProviderRegistry()
+    registry.register("book", AuthorProvider())
+    store = SyncStateStore(":memory:")
+    store.record_failure("db", "page", "书名", "9787532180668", "search: timeout")
+    assert retry_failed_books("db", client, store, registry=registry, writer=writer) == 1
+    assert writer.written == {"page": store.content_hash("page")}
+    assert client.pages.updates[0]["properties"]["Authors"] == {"multi_select": [{"name": "村上春树"}]}
+    assert list(store.dead_letters("db")) == []
+
+
+def book_item(title):
+    return {"id": "page", "properties": {
+        "书名": {"type": "title", "title": [{"plain_text": title, "text": {"content": title}}] if title else []},
+        "ISBN": {"type": "number", "number": 9787532180668},
+        "Cover": {"type": "files", "files": []}}}
+
+
+def test_unreadable_row_keeps_identifier_and_is_reread_on_retry():
+    store = SyncStateStore(":memory:")
+    assert convert_page(book_item(""), to_book_page, book_isbn, "db", store) is None
+    (page_id, _, identifier, _, error, _), = store.dead_letters("db")
+    assert (page_id, identifier) == ("page", "9787532180668")
+    assert error.startswith("convert:")
+
+    client = FakeClient()
+    client.pages.items["page"] = book_item("书名")
+    registry = ProviderRegistry()
+    registry.register("book", FakeBookProvider())
+    assert retry_failed_books("db", client, store, registry=registry, writer=NotionWriter(client, rate=1000)) == 1
+    assert client.pages.updates[0]["page_id"] == "page"
+    assert list(store.dead_letters("db")) == []
+
+
+def test_row_still_unreadable_stays_dead_lettered():
+    store = SyncStateStore(":memory:")
+    convert_page(book_item(""), to_book_page, book_isbn, "db", store)
+    client = FakeClient()
+    client.pages.items["page"] = book_item("")
+    registry = ProviderRegistry()
+    registry.register("book", FakeBookProvider())
+    assert retry_failed_books("db", client, store, registry=registry, writer=NotionWriter(client, rate=1000)) == 0
+    assert client.pages.updates == []
+    assert [row[3] for row in store.dead_letters("db")] == [2]
+
+
+def test_failed_option_flush_does_not_fail_the_batch():
+    class FailingDatabases(FakeDatabases):
+
+        def update(self, database_id, properties):
+            raise RuntimeError("schema update failed")
+
+    client = FakeClient()
+    client.databases = FailingDatabases()
+    writer = NotionWriter(client, rate=1000)
+    schema = OptionIndex(client, "db", ["Authors"], writer)
+    tasks = [SyncTask(page_id=f"page{i}", name="书名", query="9787532180668") for i in range(3)]
+    gen_properties = lambda record: {"properties": {"Authors": {"multi_select": [{"name": "新作者"}]}}}
+    assert sync_info(tasks, FakeBookProvider(), client, gen_properties, writer=writer, schema=schema) == 3
+    assert len(client.pages.updates) == 3
+    assert schema.pending == {"Authors": {"新作者": "新作者"}}